@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк транспорта Yandex API: прогрев, keep-alive и переиспользование соединений
+
+Локальный HTTPS mock (самоподписанный сертификат) эмулирует сетевую задержку
+установки соединения (TCP + TLS = 2 RTT) и закрывает соединения по простою,
+как балансировщик облака. Замеряется задержка первого запроса:
+
+1. холодный клиент - соединение устанавливается запросом пользователя;
+2. прогрев при запуске (ConnectionKeeper.warm_up);
+3. после простоя дольше таймаута сервера - без проб и с пробами keep-alive;
+4. серия запросов: новое соединение на вызов (прежний YandexFileSync) против общего клиента.
+
+Запуск: python scripts/bench_http_transport.py [--rtt 0.03] [--idle 1.0] [--runs 5]
+"""
+
+import argparse
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from mock_yandex_server import MockYandexServer
+from src.http_transport import ConnectionKeeper, HTTP2_AVAILABLE, create_client
+
+PAYLOAD = {"prompt": {"id": "bench", "variables": {"USER_THEME": "Сон атлета"}}, "input": "Выполни задачу"}
+
+
+def make_certificate(directory: str) -> tuple:
+    cert, key = f"{directory}/cert.pem", f"{directory}/key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+         "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+def timed_request(client: httpx.Client, url: str) -> float:
+    started = time.perf_counter()
+    client.post(url, json=PAYLOAD).raise_for_status()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк прогрева и keep-alive соединений")
+    parser.add_argument("--rtt", type=float, default=0.03, help="эмулируемый RTT до API, секунды")
+    parser.add_argument("--idle", type=float, default=1.0, help="таймаут простоя соединения на сервере, секунды")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--calls", type=int, default=10, help="запросов в серии")
+    args = parser.parse_args()
+
+    print(f"HTTP/2: {'доступен (h2)' if HTTP2_AVAILABLE else 'нет - pip install httpx[http2]'}; "
+          f"mock-сервер HTTP/1.1, RTT {args.rtt * 1000:.0f} мс, простой до закрытия {args.idle:.1f} с\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = make_certificate(tmp)
+        server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_context.load_cert_chain(cert, key)
+        client_context = ssl.create_default_context(cafile=cert)
+
+        with MockYandexServer(ssl_context=server_context, connect_delay=2 * args.rtt,
+                              idle_timeout=args.idle) as server:
+            url = f"{server.base_url}/responses"
+
+            def client():
+                return create_client(verify=client_context, http2=False)
+
+            results = {}
+
+            def record(name: str, seconds: float) -> None:
+                results.setdefault(name, []).append(seconds)
+
+            for _ in range(args.runs):
+                with client() as cold:
+                    record("холодный клиент", timed_request(cold, url))
+
+                with client() as warm:
+                    ConnectionKeeper(warm, url, interval=0).warm_up(background=False)
+                    record("прогрев при запуске", timed_request(warm, url))
+
+                with client() as idle:
+                    timed_request(idle, url)
+                    time.sleep(args.idle * 1.5)
+                    record("после простоя, без проб", timed_request(idle, url))
+
+                with client() as probed:
+                    keeper = ConnectionKeeper(probed, url, interval=args.idle / 2)
+                    timed_request(probed, url)
+                    keeper.start()
+                    time.sleep(args.idle * 1.5)
+                    record("после простоя, с пробами", timed_request(probed, url))
+                    keeper.stop()
+
+            print(f"{'Первый запрос':<28} {'медиана':>9} {'макс':>9}")
+            for name, values in results.items():
+                print(f"{name:<28} {statistics.median(values) * 1000:>7.1f} мс {max(values) * 1000:>6.1f} мс")
+
+            print(f"\nСерия из {args.calls} запросов:")
+            connections = server.state.connections
+            started = time.perf_counter()
+            for _ in range(args.calls):
+                with client() as single:
+                    single.post(url, json=PAYLOAD).raise_for_status()
+            per_call = time.perf_counter() - started
+            per_call_connections = server.state.connections - connections
+
+            connections = server.state.connections
+            started = time.perf_counter()
+            with client() as shared:
+                for _ in range(args.calls):
+                    shared.post(url, json=PAYLOAD).raise_for_status()
+            shared_time = time.perf_counter() - started
+            shared_connections = server.state.connections - connections
+
+            print(f"  новое соединение на вызов: {per_call * 1000:>7.1f} мс, соединений: {per_call_connections}")
+            print(f"  общий клиент:              {shared_time * 1000:>7.1f} мс, соединений: {shared_connections}")
+
+
+if __name__ == "__main__":
+    main()
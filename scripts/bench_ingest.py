@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк подготовки текста перед индексацией: колонтитулы и почти одинаковые чанки
+
+Корпус - PDF из data/ (нужен PyMuPDF) или синтетические рабочие тетради
+(--synthetic): колонтитулы и номера на каждой странице, плюс вторая версия
+документа с мелкими правками, как два PDF-перевода упражнений в data/.
+Замеряется:
+
+1. сколько строк колонтитулов убрано и сколько чанков оказались дубликатами;
+2. время MinHash/LSH на весь корпус;
+3. размер плоского индекса (float32, как IndexFlatIP) и время поиска top-5
+   до и после удаления дубликатов - на случайных векторах, без модели эмбеддингов.
+
+Запуск: python scripts/bench_ingest.py [--synthetic] [--dim 384] [--queries 200]
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.ingest import strip_boilerplate, deduplicate_chunks
+from src.pdf_indexer import PDFIndexer
+
+WORDS = ("гребля подтягивания выносливость интервал пульс техника тяга присед рывок толчок "
+         "восстановление сон нагрузка объём интенсивность темп отдых разминка мобильность").split()
+
+
+def synthetic_documents(pages: int = 40, seed: int = 7) -> list:
+    """Три тетради с колонтитулами и номерами страниц; первая - ещё и во второй редакции"""
+    rng = random.Random(seed)
+    documents = []
+    for number in range(3):
+        body = [" ".join(rng.choice(WORDS) for _ in range(220)) + "." for _ in range(pages)]
+        documents.append((f"tetrad_{number}.pdf", [
+            f"РАБОЧАЯ ТЕТРАДЬ №{number} · Натриум Фитнесс\n{text}\nСтраница {page + 1} из {pages}"
+            for page, text in enumerate(body)
+        ]))
+    name, pages_v1 = documents[0]
+    pages_v2 = [page.replace("пульс", "ЧСС", 1) for page in pages_v1]
+    documents.append((name.replace(".pdf", "_v2.pdf"), pages_v2))
+    return documents
+
+
+def pdf_documents(indexer: PDFIndexer) -> list:
+    return [(path.name, indexer.extract_pages(str(path))) for path in sorted(indexer.data_dir.glob("*.pdf"))]
+
+
+def chunks_for(indexer: PDFIndexer, documents: list, strip: bool) -> tuple:
+    chunks, removed_lines = [], 0
+    for name, pages in documents:
+        if strip:
+            pages, removed = strip_boilerplate(pages)
+            removed_lines += removed['lines']
+        for chunk in indexer.chunk_text("\n".join(pages)):
+            chunk['source'] = chunk['source_name'] = name
+            chunks.append(chunk)
+    return chunks, removed_lines
+
+
+def search_ms(vectors: np.ndarray, queries: np.ndarray) -> float:
+    """Поиск top-5 полным перебором скалярных произведений (то же, что IndexFlatIP)"""
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        scores = vectors @ query
+        np.argpartition(-scores, 5)[:5]
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк удаления колонтитулов и дубликатов перед индексацией")
+    parser.add_argument("--synthetic", action="store_true", help="синтетический корпус вместо PDF из data/")
+    parser.add_argument("--dim", type=int, default=384, help="размерность эмбеддингов (all-MiniLM-L6-v2 - 384)")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    indexer = PDFIndexer(data_dir=str(Path(__file__).parent.parent / "data"))
+    documents = synthetic_documents() if args.synthetic else pdf_documents(indexer)
+    print(f"Документов: {len(documents)}, страниц: {sum(len(pages) for _, pages in documents)}")
+
+    raw_chunks, _ = chunks_for(indexer, documents, strip=False)
+    clean_chunks, removed_lines = chunks_for(indexer, documents, strip=True)
+    started = time.perf_counter()
+    unique_chunks, duplicates = deduplicate_chunks(clean_chunks)
+    dedup_time = time.perf_counter() - started
+    shared = sum(1 for chunk in unique_chunks if len(chunk['sources']) > 1)
+
+    print(f"Колонтитулы и номера страниц: убрано строк {removed_lines}")
+    print(f"Чанков: {len(raw_chunks)} без подготовки, {len(clean_chunks)} после колонтитулов, "
+          f"{len(unique_chunks)} уникальных ({duplicates} дубликатов, {shared} чанков с несколькими источниками)")
+    print(f"MinHash/LSH: {dedup_time * 1000:.0f} мс на {len(clean_chunks)} чанков\n")
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    print(f"{'Индекс':<22} {'векторов':>9} {'размер':>10} {'поиск top-5':>12}")
+    for name, count in (("без подготовки", len(raw_chunks)), ("с подготовкой", len(unique_chunks))):
+        vectors = rng.standard_normal((count, args.dim)).astype(np.float32)
+        print(f"{name:<22} {count:>9} {vectors.nbytes / 1024:>7.0f} КБ {search_ms(vectors, queries):>9.3f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк однопроходного рендера Markdown → Telegram HTML против прежних регулярок
+
+Прогоняет обе реализации на типичных постах, больших входах и патологических
+строках (много незакрытых **), где ленивый \\*\\*(.+?)\\*\\* работает квадратично.
+
+Запуск: python scripts/bench_markdown_render.py
+"""
+
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.telegram_html import markdown_to_html, split_message
+
+POST = """💪 **РАЗМИНКА: КЛЮЧ К РЕЗУЛЬТАТУ**
+
+Представьте: вы приходите в зал, и первые 5 минут определяют всю тренировку.
+
+🔥 **НАУКА**
+• повышает температуру мышц на 2-3°C [PubMed](https://pubmed.ncbi.nlm.nih.gov/12345678/)
+• улучшает *нейромышечную* проводимость (ВОЗ)
+
+#натриумфитнес #разминка
+"""
+
+
+def legacy_convert(text: str) -> str:
+    """Прежняя реализация convert_markdown_to_html (три регулярки, без экранирования)"""
+    text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', text)
+    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
+    text = re.sub(r'(?<!^)(?<!\n)\*([^*\n]+?)\*', r'<i>\1</i>', text, flags=re.MULTILINE)
+    return text
+
+
+def measure(func, text: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(text)
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    workloads = [
+        ("типичный пост", POST, 2000),
+        ("большой вход (x200)", POST * 200, 10),
+        ("большой вход (x2000)", POST * 2000, 2),
+        ("незакрытые ** (20k)", "**слово " * 20000, 1),
+        ("незакрытые [ (20k)", "[слово](" * 20000, 1),
+    ]
+
+    print(f"{'Вход':<24}{'Размер':>10}{'regex, мс':>14}{'однопроход, мс':>18}")
+    for name, text, repeat in workloads:
+        legacy_ms = measure(legacy_convert, text, repeat)
+        new_ms = measure(markdown_to_html, text, repeat)
+        print(f"{name:<24}{len(text):>10}{legacy_ms:>14.2f}{new_ms:>18.2f}")
+
+    long_html = markdown_to_html(POST * 40)
+    started = time.perf_counter()
+    parts = split_message(long_html)
+    split_ms = (time.perf_counter() - started) * 1000
+    print(f"\nsplit_message: {len(long_html)} символов → {len(parts)} сообщений за {split_ms:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
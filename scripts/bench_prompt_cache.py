@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кеш-дружественной раскладки промптов против mock-сервера
+
+Сравнивает прежнюю раскладку (значения запроса в начале input_text)
+с текущей (статический префикс + динамический суффикс) на одинаковой
+последовательности запросов и выводит долю кеша по шаблонам и стоимость входа.
+
+Запуск: python scripts/bench_prompt_cache.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+os.environ.setdefault("YANDEX_CLOUD_API_KEY", "bench")
+os.environ.setdefault("YANDEX_FOLDER_ID", "bench")
+os.environ.setdefault("YANDEX_AGENT_ID", "bench")
+
+from mock_yandex_server import MockYandexServer
+from src.bot import NatriumBot
+from src.prompt_layout import PromptTemplate, get_cached_tokens
+
+PRICING = {'input': 0.0012, 'cached': 0.0006}
+
+THEMES = [
+    "Сон атлета: 7-9 часов", "Гребля Concept2", "Регенерация после HIIT",
+    "Питание атлета: мифы", "Электролиты в спорте", "Разминка перед метконом",
+]
+WORKLOAD = [("themes", None, None)] + [
+    ("post", theme, length) for theme in THEMES for length in (500, 700)
+] + [("themes", None, None)]
+
+
+class LegacyLayoutTemplate(PromptTemplate):
+    """Прежняя раскладка: значения запроса стоят в начале input_text"""
+
+    def render(self, **values) -> str:
+        return f"{self.suffix.format(**values)}\n\n{self.prefix}"
+
+
+def run(base_url: str, legacy: bool) -> dict:
+    import src.bot as bot_module
+
+    saved = (bot_module.POST_TEMPLATES, bot_module.THEMES_TEMPLATE)
+    if legacy:
+        bot_module.POST_TEMPLATES = {
+            k: LegacyLayoutTemplate(t.name, t.prefix, t.suffix) for k, t in saved[0].items()
+        }
+        bot_module.THEMES_TEMPLATE = LegacyLayoutTemplate(saved[1].name, saved[1].prefix, saved[1].suffix)
+
+    os.environ["YANDEX_API_BASE_URL"] = base_url
+    bot = NatriumBot()
+    totals = {'input_tokens': 0, 'cached_tokens': 0, 'cost': 0.0}
+    previous = []
+    try:
+        for kind, theme, length in WORKLOAD:
+            if kind == "themes":
+                _, usage = bot.generate_themes(previous_themes=previous)
+                previous.extend(THEMES[:3])
+            else:
+                _, usage = bot.generate_post(theme=theme, post_length=length)
+            cached = get_cached_tokens(usage)
+            totals['input_tokens'] += usage['input_tokens']
+            totals['cached_tokens'] += cached
+            totals['cost'] += (usage['input_tokens'] - cached) / 1000 * PRICING['input'] + cached / 1000 * PRICING['cached']
+    finally:
+        bot_module.POST_TEMPLATES, bot_module.THEMES_TEMPLATE = saved
+
+    totals['templates'] = bot.cache_stats.report()
+    return totals
+
+
+def main():
+    results = {}
+    for name, legacy in (("legacy", True), ("cache-friendly", False)):
+        # Отдельный сервер на каждый прогон - кеш не переносится между раскладками
+        with MockYandexServer() as server:
+            results[name] = run(server.base_url, legacy)
+
+    for name, totals in results.items():
+        ratio = totals['cached_tokens'] / totals['input_tokens'] * 100 if totals['input_tokens'] else 0
+        print(f"\n=== {name} ===")
+        print(f"Входные токены: {totals['input_tokens']}, из кеша: {totals['cached_tokens']} ({ratio:.1f}%)")
+        print(f"Стоимость входа: ~{totals['cost']:.4f} ₽")
+        for template, stats in totals['templates'].items():
+            print(f"  {template:<16} запросов: {stats['requests']:>3}  кеш: {stats['ratio'] * 100:5.1f}%")
+
+    legacy_cost = results['legacy']['cost']
+    new_cost = results['cache-friendly']['cost']
+    if legacy_cost:
+        print(f"\n💰 Снижение стоимости входа: {(1 - new_cost / legacy_cost) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
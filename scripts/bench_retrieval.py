@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального сервиса поиска (src/retrieval_service.py)
+
+N потоков-клиентов одновременно шлют запросы:
+
+1. «в процессе» - каждый поток сам вызывает encode + search (как отдельный
+   PDFIndexer в боте, CLI и пакетном задании, только без повторной загрузки модели);
+2. «сервис» - те же запросы через Unix-сокет; QueryBatcher объединяет
+   одновременные запросы в один вызов модели и FAISS.
+
+По умолчанию индекс - заглушка на numpy: «модель» стоит фиксированные
+--model-ms на вызов плюс немного на каждый запрос (как у SentenceTransformer,
+где пакет почти не дороже одного запроса), поиск - полный перебор.
+С --real используется PDFIndexer с построенным индексом data/pdf_index.faiss.
+
+Запуск: python scripts/bench_retrieval.py [--clients 8] [--queries 50] [--chunks 5000] [--real]
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.retrieval_service import RetrievalServer, RetrievalClient
+
+QUERIES = ["техника гребли", "восстановление после тренировки", "сон атлета", "подтягивания для новичков",
+           "интервальная тренировка", "burpee", "периодизация подготовки", "пульсовые зоны"]
+
+
+class StubIndexer:
+    """Индекс-заглушка: стоимость «модели» на вызов + полный перебор по случайным векторам"""
+
+    def __init__(self, chunks: int, dim: int = 384, model_ms: float = 15.0, per_query_ms: float = 0.5):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((chunks, dim)).astype(np.float32)
+        self.vectors /= np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        self.doc_chunks = [{'text': f"Фрагмент {i}", 'source_name': "stub.pdf"} for i in range(chunks)]
+        self.dim, self.model_ms, self.per_query_ms = dim, model_ms, per_query_ms
+        self._model_lock = threading.Lock()  # одна модель на процесс - вызовы не параллельны
+
+    def encode_queries(self, queries, expand: bool = True):
+        with self._model_lock:
+            time.sleep((self.model_ms + self.per_query_ms * len(queries)) / 1000)
+        vectors = np.stack([np.random.default_rng(abs(hash(q)) % 2 ** 32).standard_normal(self.dim) for q in queries])
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    def search_vectors(self, embeddings, k: int = 5):
+        scores = embeddings @ self.vectors.T
+        top = np.argsort(-scores, axis=1)[:, :k]
+        return [[dict(self.doc_chunks[i], chunk_id=int(i), similarity=float(scores[row, i])) for i in ids]
+                for row, ids in enumerate(top)]
+
+
+def run_clients(clients: int, queries: int, search) -> tuple:
+    latencies, lock = [], threading.Lock()
+
+    def worker(number: int):
+        for i in range(queries):
+            started = time.perf_counter()
+            search(QUERIES[(number + i) % len(QUERIES)])
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), time.perf_counter() - started
+
+
+def print_row(name: str, latencies: list, elapsed: float) -> None:
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<12} {statistics.median(latencies):>8.1f} мс {p95:>8.1f} мс {len(latencies) / elapsed:>9.0f} запр/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк локального сервиса поиска")
+    parser.add_argument("--clients", type=int, default=8, help="одновременных клиентов")
+    parser.add_argument("--queries", type=int, default=50, help="запросов на клиента")
+    parser.add_argument("--chunks", type=int, default=5000, help="чанков в индексе-заглушке")
+    parser.add_argument("--model-ms", type=float, default=15.0, help="стоимость вызова модели-заглушки, мс")
+    parser.add_argument("--real", action="store_true", help="PDFIndexer с data/pdf_index.faiss вместо заглушки")
+    args = parser.parse_args()
+
+    if args.real:
+        from src.pdf_indexer import PDFIndexer
+        indexer = PDFIndexer()
+        indexer.load_index(mmap=True)
+        indexer.encode_queries(["прогрев"], expand=False)
+    else:
+        indexer = StubIndexer(args.chunks, model_ms=args.model_ms)
+
+    print(f"Клиентов: {args.clients}, запросов на клиента: {args.queries}, чанков: {len(indexer.doc_chunks)}\n")
+    print(f"{'':<12} {'p50':>11} {'p95':>11} {'пропускная':>14}")
+    print_row("в процессе", *run_clients(args.clients, args.queries,
+                                         lambda q: indexer.search_vectors(indexer.encode_queries([q]), 5)))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = RetrievalServer(indexer, Path(tmp) / "retrieval.sock")
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        client = RetrievalClient(server.socket_path)
+        print_row("сервис", *run_clients(args.clients, args.queries, lambda q: client.search(q, 5)))
+        stats = client.stats()
+        print(f"\nСервис: пакетов {stats['batches']}, в среднем {stats['avg_batch']:.1f} запросов на пакет, "
+              f"задержка на стороне сервиса p50 {stats['latency_p50_ms']:.1f} мс, p95 {stats['latency_p95_ms']:.1f} мс")
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного запуска Telegram-бота
+
+1. Время импорта: python -X importtime для src/telegram_bot.py, самые
+   дорогие модули (собственное и накопленное время).
+2. Время до первого обработанного обновления: бот запускается отдельным
+   процессом против локального mock Bot API; getUpdates отдаёт одно
+   сообщение /start, замеряется время от старта процесса до первого
+   sendMessage (ответа пользователю).
+
+Запуск: python scripts/bench_startup.py [--runs 5] [--budget 1.0]
+Код возврата 1 - медиана превысила бюджет.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+BOT_SCRIPT = ROOT / "src" / "telegram_bot.py"
+TOKEN = "123456:mock"
+
+MOCK_USER = {"id": 42, "is_bot": False, "first_name": "Bench"}
+MOCK_CHAT = {"id": 42, "type": "private", "first_name": "Bench"}
+MOCK_BOT = {"id": 123456, "is_bot": True, "first_name": "Mock", "username": "mock_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class MockBotApi:
+    """Mock Telegram Bot API: одно обновление /start, фиксирует время ответов бота"""
+
+    def __init__(self):
+        self.events = {}
+        self.update_sent = False
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def _result(self, method: str):
+        self.events.setdefault(method, time.perf_counter())
+        if method == "getMe":
+            return MOCK_BOT
+        if method == "getUpdates":
+            if self.update_sent:
+                time.sleep(0.2)
+                return []
+            self.update_sent = True
+            return [{"update_id": 1, "message": {
+                "message_id": 1, "date": int(time.time()), "chat": MOCK_CHAT, "from": MOCK_USER,
+                "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}]
+            }}]
+        if method == "sendMessage":
+            return {"message_id": 2, "date": int(time.time()), "chat": MOCK_CHAT, "from": MOCK_BOT, "text": "ok"}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                body = json.dumps({"ok": True, "result": api._result(self.path.rsplit("/", 1)[-1])}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # бот остановлен посреди long polling
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def bot_env(tmp: str, base_url: str = "") -> dict:
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "YANDEX_AGENT_ID": "bench", "YANDEX_CLOUD_API_KEY": "bench", "YANDEX_FOLDER_ID": "bench",
+        "ESTIMATOR_HISTORY_PATH": f"{tmp}/estimator.json",
+        "USAGE_LEDGER_PATH": f"{tmp}/usage.sqlite3",
+        "POST_ARCHIVE_PATH": f"{tmp}/posts.sqlite3",
+        "TRACE_EXPORT_PATH": f"{tmp}/traces.jsonl",
+    })
+    if base_url:
+        env["TELEGRAM_API_BASE_URL"] = base_url
+    return env
+
+
+def import_profile(tmp: str, top: int) -> float:
+    print("=== Импорт src/telegram_bot.py (-X importtime) ===")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import telegram_bot"],
+        cwd=ROOT / "src", env=bot_env(tmp), capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Отступ имени (по 2 пробела на уровень) - глубина вложенности импорта
+        name = name.rstrip()[1:]
+        rows.append((int(cumulative_us), int(self_us), len(name) - len(name.lstrip()), name.strip()))
+
+    total = next((row[0] for row in rows if row[3] == "telegram_bot"), 0) / 1e6
+    # Прямые импорты telegram_bot.py - то, что можно сделать ленивым
+    direct = [row for row in rows if row[2] == 2]
+    print(f"Всего: {total * 1000:.0f} мс. Самые дорогие прямые импорты:")
+    for cumulative_us, self_us, _, name in sorted(direct, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:>8.1f} мс  {name}")
+    return total
+
+
+def first_update(tmp: str) -> tuple:
+    """(время до getMe, время до первого ответа) от старта процесса, секунды"""
+    api = MockBotApi()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(BOT_SCRIPT)], cwd=ROOT, env=bot_env(tmp, api.base_url),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + 30
+        while "sendMessage" not in api.events and time.perf_counter() < deadline and process.poll() is None:
+            time.sleep(0.005)
+        if "sendMessage" not in api.events:
+            raise RuntimeError("бот не ответил на /start (занят PID-файл /tmp/natrium-smm-bot.pid?)")
+        return api.events["getMe"] - started, api.events["sendMessage"] - started
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного запуска бота")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="бюджет до первого ответа, секунды")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import_profile(tmp, args.top)
+
+        print(f"\n=== Время до первого обработанного обновления ({args.runs} запусков) ===")
+        ready, answered = [], []
+        for run in range(args.runs):
+            to_ready, to_answer = first_update(tmp)
+            ready.append(to_ready)
+            answered.append(to_answer)
+            print(f"  #{run + 1}: getMe {to_ready * 1000:.0f} мс, ответ на /start {to_answer * 1000:.0f} мс")
+
+    median = statistics.median(answered)
+    print(f"\nМедиана: готовность {statistics.median(ready) * 1000:.0f} мс, "
+          f"первый ответ {median * 1000:.0f} мс (бюджет {args.budget * 1000:.0f} мс)")
+    if median > args.budget:
+        print("❌ Бюджет превышен")
+        sys.exit(1)
+    print("✅ В пределах бюджета")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Подбор порога семантического кеша постов (src/semantic_cache.py)
+
+Для размеченных пар тем (scripts/fixtures/theme_pairs.json) считает косинус
+embed_theme и совпадение слов времени/отрицания (theme_guard), печатает пары
+и для каждого порога - сколько одинаковых тем попадут в кеш и сколько разных
+тем получат чужой пост. Рекомендуемый порог - наименьший без ложных попаданий.
+
+Запуск: python scripts/calibrate_semantic_cache.py [--pairs scripts/fixtures/theme_pairs.json]
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.semantic_cache import embed_theme, theme_guard
+
+PAIRS_PATH = Path(__file__).parent / "fixtures" / "theme_pairs.json"
+THRESHOLDS = [0.7, 0.75, 0.8, 0.85, 0.9, 0.95]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подбор порога семантического кеша постов")
+    parser.add_argument("--pairs", default=str(PAIRS_PATH), help="файл с размеченными парами тем")
+    args = parser.parse_args()
+
+    with open(args.pairs, 'r', encoding='utf-8') as f:
+        pairs = json.load(f)['pairs']
+
+    scored = []
+    for pair in pairs:
+        similarity = float(embed_theme(pair['a']) @ embed_theme(pair['b']))
+        guard = theme_guard(pair['a']) == theme_guard(pair['b'])
+        # Без совпадения слов времени/отрицания пара в кеш не попадает при любом пороге
+        scored.append((pair, similarity if guard else -1.0, similarity, guard))
+
+    for pair, _, similarity, guard in sorted(scored, key=lambda item: -item[2]):
+        mark = "=" if pair['same'] else "≠"
+        print(f"{mark} {similarity:.3f} {'  ' if guard else '⛔'} {pair['a']} | {pair['b']}")
+
+    print(f"\n{'порог':>6} {'попадания':>10} {'ложные':>7}")
+    same_total = sum(1 for pair in pairs if pair['same'])
+    for threshold in THRESHOLDS:
+        hits = sum(1 for pair, score, _, _ in scored if pair['same'] and score >= threshold)
+        false_hits = sum(1 for pair, score, _, _ in scored if not pair['same'] and score >= threshold)
+        print(f"{threshold:>6.2f} {hits:>5}/{same_total:<4} {false_hits:>7}")
+
+    worst = max((score for pair, score, _, _ in scored if not pair['same']), default=0.0)
+    print(f"\nСамая похожая пара разных тем: {worst:.3f} - порог должен быть выше")
+
+
+if __name__ == "__main__":
+    main()
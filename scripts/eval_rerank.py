@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Качество и задержка поиска по базе знаний с переранжированием и без
+
+Запросы и разметка - scripts/fixtures/retrieval_eval.json: чанк релевантен,
+если он из одного из указанных документов и содержит одно из ключевых слов.
+Сравниваются:
+
+1. FAISS - top-k первого этапа (би-энкодер all-MiniLM-L6-v2);
+2. rerank - top-N кандидатов FAISS переоценены кросс-энкодером в пределах
+   бюджета (не уложился - порядок FAISS);
+3. rerank без бюджета - верхняя граница качества;
+4. rerank, повтор - те же запросы ещё раз, оценки пар из кеша.
+
+Метрики: hit@1, hit@k, MRR@k, nDCG@k, задержка поиска на запрос p50/p95,
+доля запросов, вернувшихся к порядку FAISS. Нужен построенный индекс
+data/pdf_index.faiss, FAISS и sentence-transformers.
+
+Запуск: python scripts/eval_rerank.py [--k 5] [--candidates 50] [--budget-ms 300] [--model ...]
+"""
+
+import argparse
+import json
+import math
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.glossary import fold
+from src.pdf_indexer import PDFIndexer
+from src.rerank import Reranker, DEFAULT_MODEL, DEFAULT_CANDIDATES, DEFAULT_BUDGET_MS
+
+EVAL_PATH = Path(__file__).parent / "fixtures" / "retrieval_eval.json"
+
+
+def is_relevant(chunk: dict, item: dict) -> bool:
+    names = [source.get('source_name') or '' for source in chunk.get('sources', [])] or [chunk.get('source_name', '')]
+    text = fold(chunk['text'])
+    return any(fold(source) in fold(name) for source in item['sources'] for name in names) \
+        and any(fold(term) in text for term in item['terms'])
+
+
+def evaluate(indexer: PDFIndexer, items: list, k: int, rerank: bool) -> dict:
+    hits_1, hits_k, reciprocal, ndcg, latencies = [], [], [], [], []
+    for item in items:
+        started = time.perf_counter()
+        results = indexer.search(item['query'], k=k, rerank=rerank)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        relevant = [is_relevant(chunk, item) for chunk in results]
+        first = relevant.index(True) + 1 if True in relevant else None
+        hits_1.append(bool(relevant[:1] and relevant[0]))
+        hits_k.append(first is not None)
+        reciprocal.append(1 / first if first else 0.0)
+        dcg = sum(1 / math.log2(rank + 2) for rank, flag in enumerate(relevant) if flag)
+        ideal = sum(1 / math.log2(rank + 2) for rank in range(sum(relevant)))
+        ndcg.append(dcg / ideal if ideal else 0.0)
+
+    latencies.sort()
+    return {
+        'hit@1': statistics.mean(hits_1),
+        'hit@k': statistics.mean(hits_k),
+        'mrr': statistics.mean(reciprocal),
+        'ndcg': statistics.mean(ndcg),
+        'p50': statistics.median(latencies),
+        'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Оценка переранжирования кросс-энкодером")
+    parser.add_argument("--k", type=int, default=5, help="результатов на запрос")
+    parser.add_argument("--candidates", type=int, default=DEFAULT_CANDIDATES, help="кандидатов FAISS на переоценку")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="бюджет переранжирования, мс")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="модель CrossEncoder")
+    parser.add_argument("--eval", default=str(EVAL_PATH), help="файл с запросами и разметкой")
+    args = parser.parse_args()
+
+    with open(args.eval, 'r', encoding='utf-8') as f:
+        items = json.load(f)['queries']
+
+    indexer = PDFIndexer(rerank=False)
+    indexer.load_index()
+    indexer.encode_queries(["прогрев"], expand=False)
+
+    budgeted = Reranker(args.model, args.candidates, args.budget_ms)
+    unlimited = Reranker(args.model, args.candidates, 0)
+    budgeted.model, unlimited.model  # загрузка моделей - не в замерах
+
+    print(f"Запросов: {len(items)}, k={args.k}, кандидатов: {args.candidates}, бюджет: {args.budget_ms:.0f} мс\n")
+    print(f"{'':<22} {'hit@1':>6} {'hit@k':>6} {'MRR':>6} {'nDCG':>6} {'p50':>9} {'p95':>9} {'откат':>6}")
+    runs = [("FAISS", None), ("rerank", budgeted), ("rerank без бюджета", unlimited), ("rerank, повтор", budgeted)]
+    for name, reranker in runs:
+        indexer.reranker = reranker
+        before = dict(reranker.stats) if reranker else {}
+        metrics = evaluate(indexer, items, args.k, rerank=reranker is not None)
+        fallback = ""
+        if reranker:
+            queries = reranker.stats['queries'] - before['queries']
+            fallback = f"{(reranker.stats['fallbacks'] - before['fallbacks']) / queries * 100:.0f}%"
+        print(f"{name:<22} {metrics['hit@1']:>6.2f} {metrics['hit@k']:>6.2f} {metrics['mrr']:>6.2f} "
+              f"{metrics['ndcg']:>6.2f} {metrics['p50']:>6.1f} мс {metrics['p95']:>6.1f} мс {fallback:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Фаззинг и бенчмарк извлечения тем (src/themes.py)
+
+1. Сравнивает extract_themes с прежним parse_themes_list на сохранённых
+   ответах агента (scripts/fixtures/themes/*.txt).
+2. Фаззинг: случайные мутации ответов (мусорные символы, разметка, CRLF,
+   обрезка, повторы строк) - проверяет инварианты результата.
+3. Бенчмарк: прежний парсер против однопроходного на ответах и большом входе.
+
+Запуск: python scripts/fuzz_themes.py [--iterations 5000] [--seed 42]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.themes import extract_themes, MAX_THEMES
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "themes"
+
+NOISE = ['**', '*', '[', ']', '(', ')', '️⃣', '🔟', '1.', '2)', '\t', ' ', '—', '>', '•', '​', 'Ё', '#']
+
+
+def legacy_parse_themes_list(themes_text: str) -> list:
+    """Прежний TelegramSMMBot.parse_themes_list (четыре регулярки + дедупликация списком)"""
+    patterns = [
+        r'[1-9]️⃣\s+([^\[\n]+)',
+        r'🔟\s+([^\[\n]+)',
+        r'^\d+\)\s+([^\[\n]+)',
+        r'^\d+\.\s+([^\[\n]+)',
+    ]
+    all_themes = []
+    for pattern in patterns:
+        for match in re.findall(pattern, themes_text, re.MULTILINE):
+            theme = re.sub(r'\s*[\[\(].*$', '', match.strip()).strip()
+            if theme:
+                all_themes.append(theme)
+
+    if len(all_themes) > 10:
+        unique_themes = []
+        for theme in reversed(all_themes):
+            if theme not in unique_themes:
+                unique_themes.insert(0, theme)
+            if len(unique_themes) == 10:
+                break
+        return unique_themes
+
+    themes, seen = [], set()
+    for theme in all_themes:
+        if theme not in seen:
+            seen.add(theme)
+            themes.append(theme)
+    return themes[:10]
+
+
+def load_fixtures() -> dict:
+    return {path.name: path.read_text(encoding='utf-8') for path in sorted(FIXTURES_DIR.glob("*.txt"))}
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    lines = text.splitlines()
+    for _ in range(rng.randint(1, 6)):
+        action = rng.randrange(6)
+        if not lines:
+            break
+        i = rng.randrange(len(lines))
+        if action == 0:
+            pos = rng.randint(0, len(lines[i]))
+            lines[i] = lines[i][:pos] + rng.choice(NOISE) + lines[i][pos:]
+        elif action == 1:
+            lines.insert(i, lines[i])
+        elif action == 2:
+            lines[i] = lines[i][:rng.randint(0, len(lines[i]))]
+        elif action == 3:
+            del lines[i]
+        elif action == 4:
+            lines[i] = rng.choice(['**', '  ', '> ', '- ']) + lines[i]
+        else:
+            lines[i] = ''.join(chr(rng.randint(0x20, 0x4FF)) for _ in range(rng.randint(0, 40)))
+    separator = '\r\n' if rng.random() < 0.2 else '\n'
+    return separator.join(lines)
+
+
+def check_invariants(themes: list) -> list:
+    errors = []
+    if len(themes) > MAX_THEMES:
+        errors.append(f"тем больше {MAX_THEMES}: {len(themes)}")
+    titles = [theme.title.casefold() for theme in themes]
+    if len(titles) != len(set(titles)):
+        errors.append("дубликаты названий")
+    for theme in themes:
+        if not theme.title or theme.title != theme.title.strip():
+            errors.append(f"пустое или необрезанное название: {theme.title!r}")
+        if any(c in theme.title for c in '[\n\r'):
+            errors.append(f"мусор в названии: {theme.title!r}")
+        if '**' in theme.title:
+            errors.append(f"разметка в названии: {theme.title!r}")
+        if not 0 <= theme.number <= 99:
+            errors.append(f"номер вне диапазона: {theme.number}")
+    return errors
+
+
+def compare(fixtures: dict) -> None:
+    print("=== Сравнение с прежним парсером ===")
+    for name, text in fixtures.items():
+        new = [theme.title for theme in extract_themes(text)]
+        old = legacy_parse_themes_list(text)
+        sources = sum(len(theme.sources) for theme in extract_themes(text))
+        status = "совпадает" if new == old else "отличается"
+        print(f"{name:<28} тем: {len(new):>2} (было {len(old):>2}), источников: {sources:>2} - {status}")
+        if new != old:
+            for i in range(max(len(new), len(old))):
+                a = new[i] if i < len(new) else '-'
+                b = old[i] if i < len(old) else '-'
+                if a != b:
+                    print(f"   {i + 1:>2}. новый: {a!r}\n       старый: {b!r}")
+
+
+def fuzz(fixtures: dict, iterations: int, seed: int) -> int:
+    print(f"\n=== Фаззинг: {iterations} итераций, seed={seed} ===")
+    rng = random.Random(seed)
+    samples = list(fixtures.values())
+    failures = 0
+    slowest = 0.0
+    for iteration in range(iterations):
+        text = mutate(rng.choice(samples), rng)
+        started = time.perf_counter()
+        try:
+            themes = extract_themes(text)
+        except Exception as e:
+            failures += 1
+            print(f"❌ #{iteration}: исключение {e!r} на {text[:80]!r}")
+            continue
+        slowest = max(slowest, time.perf_counter() - started)
+        errors = check_invariants(themes)
+        if errors:
+            failures += 1
+            print(f"❌ #{iteration}: {'; '.join(errors)}")
+    print(f"Ошибок: {failures}, самый медленный разбор: {slowest * 1000:.2f} мс")
+    return failures
+
+
+def bench(fixtures: dict) -> None:
+    print("\n=== Бенчмарк ===")
+    big = "\n".join(fixtures.values()) * 200
+    workloads = [("ответы агента", list(fixtures.values()), 2000), ("большой вход", [big], 5)]
+    for name, texts, repeat in workloads:
+        timings = {}
+        for label, func in (("прежний", legacy_parse_themes_list), ("однопроходный", extract_themes)):
+            started = time.perf_counter()
+            for _ in range(repeat):
+                for text in texts:
+                    func(text)
+            timings[label] = (time.perf_counter() - started) / (repeat * len(texts)) * 1000
+        print(f"{name:<16} прежний: {timings['прежний']:.3f} мс, однопроходный: {timings['однопроходный']:.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фаззинг и бенчмарк extract_themes")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    compare(fixtures)
+    failures = fuzz(fixtures, args.iterations, args.seed)
+    bench(fixtures)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Перенос постов-файлов из output/posts в архив (output/posts.sqlite3)
+
+Раньше main.save_post писал каждый пост отдельным .md файлом; теперь посты
+хранятся в архиве с полнотекстовым поиском. Повторный запуск безопасен -
+уже перенесённые файлы пропускаются.
+
+Запуск: python scripts/import_posts.py [--dir output/posts] [--search "гребля"]
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from src.post_archive import get_archive
+
+DEFAULT_DIR = Path(__file__).parent.parent / "output" / "posts"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт постов-файлов в архив")
+    parser.add_argument("--dir", default=str(DEFAULT_DIR), help="каталог с .md постами")
+    parser.add_argument("--search", help="после импорта выполнить поиск по архиву")
+    args = parser.parse_args()
+
+    archive = get_archive()
+    imported = archive.import_markdown(args.dir)
+    print(f"Импортировано: {imported}, всего в архиве: {archive.count()} ({archive.db_path})")
+    print(f"Полнотекстовый индекс: {'FTS5' if archive.fts else 'нет (поиск через LIKE)'}")
+
+    if args.search:
+        started = time.perf_counter()
+        results = archive.search(args.search, limit=10)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"\nПоиск «{args.search}»: {len(results)} за {elapsed:.2f} мс")
+        for found in results:
+            date = datetime.fromtimestamp(found['ts']).strftime('%d.%m.%Y')
+            print(f"  {date}  {found['technique']:<10} {found['theme']}")
+
+
+if __name__ == "__main__":
+    main()
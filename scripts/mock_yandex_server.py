@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Локальный mock Yandex Cloud Assistant API (REST /v1/responses) для бенчмарков
+
+Эмулирует префиксный кеш: cached_tokens = токены самого длинного общего
+префикса input с предыдущими запросами, округлённые вниз до блока CACHE_BLOCK.
+Для замеров соединений умеет TLS, задержку установки соединения (эмуляция
+RTT рукопожатий TCP + TLS до облака) и закрытие соединений по простою.
+Запуск отдельно: python scripts/mock_yandex_server.py [port]
+"""
+
+import json
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CACHE_BLOCK = 64  # гранулярность префиксного кеша в токенах
+
+SAMPLE_THEMES = "\n".join(
+    f"{n} Тема номер {i} про тренировки [CrossFit]"
+    for i, n in enumerate(["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"], 1)
+)
+
+SAMPLE_POST = """💪 **ТЕМА: КЛЮЧЕВАЯ ИДЕЯ ПОСТА**
+
+Знакомо: после тренировки нет сил? Разбираемся, что с этим делать.
+
+🔥 **ФАКТЫ:**
+• Сон 7-9 часов ускоряет восстановление [PubMed](https://pubmed.ncbi.nlm.nih.gov/1/)
+• Белок 1.6 г/кг в день (ВОЗ)
+
+✅ **ВЫВОДЫ:** восстановление - часть тренировки.
+
+Приходи в Натриум!
+
+#натриумфитнес #кроссфит"""
+
+
+def count_tokens(text: str) -> int:
+    """Грубая оценка токенов: слова и знаки препинания"""
+    return len(re.findall(r'\w+|[^\w\s]', text))
+
+
+def common_prefix_len(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class MockState:
+    def __init__(self, latency: float = 0.0, idle_timeout: float = None):
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.inputs = []
+        self.requests = 0
+        self.connections = 0
+
+    def cached_tokens(self, text: str) -> int:
+        with self.lock:
+            best = max((common_prefix_len(text, prev) for prev in self.inputs), default=0)
+            self.inputs.append(text)
+            self.requests += 1
+        tokens = count_tokens(text[:best])
+        return tokens - tokens % CACHE_BLOCK
+
+
+def make_handler(state: MockState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Соединение без запросов дольше idle_timeout закрывается (как у балансировщика)
+        timeout = state.idle_timeout
+
+        def setup(self):
+            super().setup()
+            with state.lock:
+                state.connections += 1
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _send_json(self, payload: dict, status: int = 200):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_POST(self):
+            if not self.path.endswith("/responses"):
+                self._send_json({"error": "not found"}, 404)
+                return
+
+            payload = self._read_json()
+            input_text = payload.get("input", "")
+            variables = (payload.get("prompt") or {}).get("variables") or {}
+
+            if state.latency:
+                time.sleep(state.latency)
+
+            text = SAMPLE_POST if variables.get("USER_THEME") else SAMPLE_THEMES
+            input_tokens = count_tokens(input_text)
+            output_tokens = count_tokens(text)
+            self._send_json({
+                "output": [{"content": [{"text": text}]}],
+                "usage": {
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens,
+                    "input_tokens_details": {"cached_tokens": state.cached_tokens(input_text)},
+                    "output_tokens_details": {"reasoning_tokens": 0}
+                }
+            })
+
+        def do_PATCH(self):
+            self._read_json()
+            self._send_json({"status": "ok"})
+
+    return Handler
+
+
+class MockYandexServer:
+    """Mock-сервер в фоновом потоке (контекстный менеджер)"""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, ssl_context=None,
+                 connect_delay: float = 0.0, idle_timeout: float = None):
+        """
+        Args:
+            port: порт (0 - любой свободный)
+            latency: задержка ответа на /responses, секунды
+            ssl_context: серверный ssl.SSLContext - HTTPS вместо HTTP
+            connect_delay: задержка каждого нового соединения (эмуляция RTT рукопожатий)
+            idle_timeout: закрывать соединение после стольких секунд простоя
+        """
+        self.state = MockState(latency=latency, idle_timeout=idle_timeout)
+        self.ssl_context = ssl_context
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def get_request(self):
+                sock, address = super().get_request()
+                # Заголовки и тело ответа уходят отдельными write - без NODELAY ответ ждёт delayed ACK (~40 мс)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if connect_delay:
+                    time.sleep(connect_delay)
+                if ssl_context is not None:
+                    sock = ssl_context.wrap_socket(sock, server_side=True)
+                return sock, address
+
+        self.httpd = Server(("127.0.0.1", port), make_handler(self.state))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        scheme = "https" if self.ssl_context is not None else "http"
+        return f"{scheme}://{host}:{port}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    with MockYandexServer(port=port) as server:
+        print(f"Mock Yandex API: {server.base_url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
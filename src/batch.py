@@ -0,0 +1,253 @@
+import csv
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import httpx
+
+from src.bot import POST_TEMPLATES
+from src.post_archive import get_archive
+from src.post_schema import to_markdown
+from src.usage_ledger import get_ledger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TECHNIQUE = "cov+cok"
+DEFAULT_POST_LENGTH = 500
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 2
+BATCH_DIR = Path(__file__).parent.parent / "output" / "batch"
+
+# Пользователь пакетного режима в журнале использования и архиве
+BATCH_USER_ID = 'batch'
+
+# Временные ошибки API - повторяем с паузой; остальные сразу считаем провалом задания
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _job_key(theme: str, technique: str, post_length: int, occurrence: int) -> str:
+    """Устойчивый ключ задания (не зависит от порядка строк в файле)"""
+    digest = hashlib.sha1(f"{theme}\n{technique}\n{post_length}".encode('utf-8')).hexdigest()[:12]
+    return f"{digest}-{occurrence}"
+
+
+def load_jobs(path) -> list:
+    """Читает план публикаций из CSV или JSONL
+
+    Поля: theme (обязательно), technique (по умолчанию cov+cok),
+    post_length или length (по умолчанию 500). В CSV нужна строка заголовка.
+
+    Returns:
+        list: dict с key, theme, technique, post_length
+
+    Raises:
+        ValueError: неизвестный формат файла или некорректная строка
+    """
+    path = Path(path)
+    with open(path, encoding='utf-8-sig') as f:
+        if path.suffix.lower() == '.csv':
+            rows = list(csv.DictReader(f))
+        elif path.suffix.lower() in ('.jsonl', '.ndjson'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            raise ValueError(f"Неизвестный формат плана: {path.suffix} (нужен .csv или .jsonl)")
+
+    jobs, occurrences = [], {}
+    for number, row in enumerate(rows, 1):
+        theme = (row.get('theme') or '').strip()
+        technique = (row.get('technique') or DEFAULT_TECHNIQUE).strip()
+        length = row.get('post_length') or row.get('length') or DEFAULT_POST_LENGTH
+        if not theme:
+            raise ValueError(f"Строка {number}: пустая тема")
+        if technique not in POST_TEMPLATES:
+            raise ValueError(f"Строка {number}: неизвестная техника '{technique}' ({', '.join(POST_TEMPLATES)})")
+        try:
+            post_length = int(length)
+        except (TypeError, ValueError):
+            raise ValueError(f"Строка {number}: некорректная длина '{length}'")
+
+        signature = (theme, technique, post_length)
+        occurrences[signature] = occurrences.get(signature, 0) + 1
+        jobs.append({
+            'key': _job_key(theme, technique, post_length, occurrences[signature]),
+            'theme': theme,
+            'technique': technique,
+            'post_length': post_length
+        })
+    return jobs
+
+
+def load_done(state_path) -> set:
+    """Ключи успешно выполненных заданий из файла результатов (для продолжения)"""
+    done = set()
+    state_path = Path(state_path)
+    if not state_path.exists():
+        return done
+    with open(state_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # строка, оборванная при аварийной остановке
+            if record.get('status') == 'ok':
+                done.add(record['key'])
+    return done
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class BatchRunner:
+    """Пакетная генерация постов по плану с ограниченным параллелизмом
+
+    Задания выполняются в пуле из workers потоков. Каждый результат сразу
+    дописывается строкой в JSONL-файл результатов (он же состояние): при
+    повторном запуске с тем же файлом успешные задания пропускаются, а
+    упавшие выполняются заново.
+    """
+
+    def __init__(self, natrium_bot, state_path, workers: int = DEFAULT_WORKERS,
+                 retries: int = DEFAULT_RETRIES, archive: bool = True):
+        """
+        Args:
+            natrium_bot: экземпляр NatriumBot
+            state_path: JSONL-файл результатов и состояния
+            workers: максимум одновременных запросов к API
+            retries: повторы задания при временных ошибках (429, 5xx, сеть)
+            archive: сохранять посты в архив (output/posts.sqlite3)
+        """
+        self.natrium_bot = natrium_bot
+        self.state_path = Path(state_path)
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.archive = archive
+        self._lock = threading.Lock()
+
+        self.stats = {
+            'total': 0,
+            'skipped': 0,     # выполнены в прошлых запусках
+            'ok': 0,
+            'failed': 0,
+            'retries': 0,
+            'latencies': [],
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'output_tokens': 0,
+            'total_tokens': 0,
+            'cost': 0.0,
+            'elapsed_s': 0.0
+        }
+
+    def _generate(self, job: dict) -> tuple:
+        """Генерирует пост задания с повторами; (post, usage, latency_s)"""
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                post, usage = self.natrium_bot.generate_post(
+                    theme=job['theme'], technique=job['technique'], post_length=job['post_length']
+                )
+                return post, usage, time.perf_counter() - started
+            except (httpx.HTTPStatusError, httpx.TransportError) as e:
+                status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                if attempt == self.retries or (status is not None and status not in RETRYABLE_STATUS):
+                    raise
+                with self._lock:
+                    self.stats['retries'] += 1
+                time.sleep(2 ** attempt)
+
+    def _run_job(self, job: dict) -> dict:
+        record = dict(job)
+        try:
+            post, usage, latency = self._generate(job)
+            if not post:
+                raise ValueError("пустой ответ агента")
+            post = to_markdown(post)
+            row = get_ledger().record(BATCH_USER_ID, "Пакетная генерация", job['technique'], usage)
+            if self.archive:
+                get_archive().add(post, job['theme'], job['technique'], job['post_length'], usage,
+                                  source='batch', user_id=BATCH_USER_ID)
+            record.update(status='ok', post=post, latency_s=round(latency, 3), usage=row)
+        except Exception as e:
+            logger.error(f"Задание '{job['theme']}' не выполнено: {e}")
+            record.update(status='error', error=str(e))
+
+        with self._lock:
+            with open(self.state_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if record['status'] == 'ok':
+                self.stats['ok'] += 1
+                self.stats['latencies'].append(record['latency_s'])
+                for field in ('input_tokens', 'cached_tokens', 'output_tokens', 'total_tokens', 'cost'):
+                    self.stats[field] += record['usage'][field]
+            else:
+                self.stats['failed'] += 1
+        return record
+
+    def run(self, jobs: list, progress=print) -> dict:
+        """Выполняет задания, пропуская уже выполненные
+
+        Args:
+            jobs: задания из load_jobs
+            progress: функция вывода прогресса (None - без вывода)
+
+        Returns:
+            dict: статистика (см. summary)
+        """
+        done = load_done(self.state_path)
+        pending = [job for job in jobs if job['key'] not in done]
+        self.stats['total'] = len(jobs)
+        self.stats['skipped'] = len(jobs) - len(pending)
+        if progress and self.stats['skipped']:
+            progress(f"⏭ Уже выполнено в прошлых запусках: {self.stats['skipped']}")
+
+        started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch")
+        try:
+            futures = [executor.submit(self._run_job, job) for job in pending]
+            for finished, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                if progress:
+                    if record['status'] == 'ok':
+                        progress(f"[{finished}/{len(pending)}] ✅ {record['theme']} ({record['latency_s']:.1f} с)")
+                    else:
+                        progress(f"[{finished}/{len(pending)}] ❌ {record['theme']}: {record['error']}")
+        finally:
+            # Ctrl+C: невыполненные задания отменяются, результаты уже в файле
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.stats['elapsed_s'] = time.perf_counter() - started
+            if self.archive:
+                get_archive().flush()
+        return self.stats
+
+    def summary(self) -> str:
+        """Текстовая сводка: пропускная способность, задержки, токены и стоимость"""
+        stats = self.stats
+        elapsed = stats['elapsed_s']
+        latencies = stats['latencies']
+        lines = [
+            f"Заданий: {stats['total']} (выполнено: {stats['ok']}, ошибок: {stats['failed']}, "
+            f"пропущено: {stats['skipped']}, повторов: {stats['retries']})",
+            f"Время: {elapsed:.1f} с, потоков: {self.workers}, "
+            f"производительность: {stats['ok'] / elapsed * 60 if elapsed else 0:.1f} постов/мин",
+        ]
+        if latencies:
+            lines.append(
+                f"Задержка: p50 {_percentile(latencies, 0.5):.1f} с, p95 {_percentile(latencies, 0.95):.1f} с, "
+                f"макс {max(latencies):.1f} с"
+            )
+        lines.append(
+            f"Токены: {stats['total_tokens']} (вход {stats['input_tokens']}, из кеша {stats['cached_tokens']}, "
+            f"выход {stats['output_tokens']})"
+        )
+        lines.append(f"Стоимость: ~{stats['cost']:.4f} ₽" + (f" (~{stats['cost'] / stats['ok']:.4f} ₽ за пост)" if stats['ok'] else ""))
+        lines.append(f"Результаты: {self.state_path}")
+        return "\n".join(lines)
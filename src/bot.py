@@ -1,158 +1,79 @@
 import os
-from dotenv import load_dotenv
 from pathlib import Path
 import httpx
 import json
 import logging
+import threading
+import time
+from src.estimator import TokenEstimator
+from src.prompt_layout import PromptTemplate, PromptCacheStats
+from src.tracing import span
+from src.post_schema import POST_JSON_EXAMPLE, VARIANT_SEPARATOR, is_structured, split_variants, to_markdown
+from src.post_validator import (check_post, repairs_for, parse_header, apply_header, add_hashtags,
+                                visible_length, ISSUE_TITLE, ISSUE_LEAD, ISSUE_HASHTAGS, ISSUE_TOO_LONG)
+from src.usage_ledger import merge_usage
+from src.research_cache import ResearchBriefCache, MIN_BRIEF_CHARS
+from src.glossary import get_glossary
+from src.routing import RoutingTable, RouteTelemetry, operation_for
+from src.http_transport import get_http_client, ConnectionKeeper
+from src.singleflight import SingleFlight, request_key
+from src.prompt_versions import PromptVersions, PromptWatcher, prompt_hash, DEPLOYED, UNCHANGED, FAILED
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-load_dotenv()
+# =====================================================================
+# Шаблоны input_text
+# Статический префикс одинаков байт-в-байт между запросами (попадает в кеш),
+# все значения конкретного запроса - только в суффиксе в конце сообщения.
+# =====================================================================
 
-class NatriumBot:
-    def __init__(self, prompts_dir: str = "prompts"):
-        self.api_key = os.getenv("YANDEX_CLOUD_API_KEY")
-        self.folder_id = os.getenv("YANDEX_FOLDER_ID")
-        self.agent_id = os.getenv("YANDEX_AGENT_ID")
-        self.prompts_dir = Path(__file__).parent.parent / prompts_dir
-        
-        # Создаем HTTP клиент с увеличенным таймаутом (для длинных тем)
-        self.http_client = httpx.Client(
-            timeout=httpx.Timeout(120.0, connect=10.0),
-            headers={
-                "Authorization": f"Api-Key {self.api_key}",
-                "x-folder-id": self.folder_id,
-                "Content-Type": "application/json"
-            }
-        )
-        
-        self.base_url = "https://rest-assistant.api.cloud.yandex.net/v1"
-    
-    def update_agent_prompt(self, prompt_file: str = "agent_system_prompt.md") -> bool:
-        """Обновляет системный промпт агента в Yandex Cloud
-        
-        Args:
-            prompt_file: имя файла с промптом в prompts_dir
-            
-        Returns:
-            bool: True если обновление успешно
-        """
-        try:
-            # Читаем новый промпт из файла
-            prompt_path = self.prompts_dir / prompt_file
-            if not prompt_path.exists():
-                logger.error(f"Prompt file not found: {prompt_path}")
-                return False
-            
-            with open(prompt_path, 'r', encoding='utf-8') as f:
-                new_prompt = f.read()
-            
-            logger.info(f"Updating agent {self.agent_id} with prompt from {prompt_file}")
-            logger.info(f"Prompt length: {len(new_prompt)} chars")
-            
-            # Обновляем агента через API
-            payload = {
-                "prompt": new_prompt,
-                "name": "Natrium SMM Bot"  # Можно задать имя агента
-            }
-            
-            response = self.http_client.patch(
-                f"{self.base_url}/agents/{self.agent_id}",
-                json=payload
-            )
-            response.raise_for_status()
-            
-            logger.info(f"✅ Agent prompt updated successfully!")
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Failed to update agent prompt: {e}")
-            return False
-    
-    def _format_variables(self, variables: dict) -> str:
-        """Форматирует переменные в строку для additional_instructions"""
-        if not variables:
-            return ""
-        lines = ["Используй следующие переменные:"]
-        for key, value in variables.items():
-            lines.append(f"{key}: {value}")
-        return "\n".join(lines)
-    
-
-    def generate_themes(self, technique: str = "cov+cok", custom_input: str = None, previous_themes: list = None) -> tuple:
-        """Генерирует 10 тем (пустая USER_THEME)
-
-        Args:
-            technique: техника генерации
-            custom_input: пользовательский input (опционально)
-            previous_themes: список предыдущих тем для избежания повторений
-
-        Returns:
-            tuple: (themes_text, usage_dict)
-        """
-        import time
-
-        variables = {
-            "TECHNIQUE": technique,
-            "USER_THEME": "",
-            "POST_LENGTH": "500"
-        }
-        
-        # Добавляем timestamp для рандомизации
-        timestamp_hint = f"Запрос #{int(time.time() % 10000)}"
-        
-        # Формируем список предыдущих тем для избежания повторений
-        previous_themes_text = ""
-        if previous_themes and len(previous_themes) > 0:
-            previous_themes_text = f"""
-❌ НЕ ИСПОЛЬЗУЙ ЭТИ ТЕМЫ (они уже были сгенерированы):
-{chr(10).join([f'- {theme}' for theme in previous_themes])}
-
-ГЕНЕРИРУЙ ПОЛНОСТЬЮ НОВЫЕ ТЕМЫ, НЕ ПОХОЖИЕ НА ПРЕДЫДУЩИЕ!
-"""
-
-        # Формируем явную инструкцию
-        if custom_input:
-            input_text = f"""ЗАДАЧА: {custom_input}
-
-ВАЖНО:
+_THEMES_RULES = """ВАЖНО:
 - Это запрос на ГЕНЕРАЦИЮ ТЕМ, НЕ поста!
 - USER_THEME = "" (пустая строка)
-- Каждая тема НЕ БОЛЕЕ 5 СЛОВ
+- Каждая тема НЕ БОЛЕЕ {max_words} СЛОВ
 - Темы на ОБЫЧНОМ регистре (не CAPS!)
 - Добавь источники в [квадратных скобках]
-{previous_themes_text}
-🔥 ДЛЯ РАЗНООБРАЗИЯ И НОВИЗНЫ:
-- ОБЯЗАТЕЛЬНО используй книгу "Большая книга о соцсетях" в FileSearch
-- Применяй рекомендации из книги: вирусные форматы, хуки, триггеры
-- Генерируй НЕСТАНДАРТНЫЕ темы (не только базовые упражнения/питание)
-- Используй актуальные тренды 2026 года из Web Search
-- Миксуй форматы: вопросы, мифы, инсайты, кейсы, челленджи
+- Если в параметрах запроса есть список уже сгенерированных тем - НЕ ПОВТОРЯЙ ИХ"""
 
-⚠️ КРИТИЧЕСКИ ВАЖНО - НЕ ПОВТОРЯЙСЯ:
+_THEMES_NO_REPEAT = """⚠️ КРИТИЧЕСКИ ВАЖНО - НЕ ПОВТОРЯЙСЯ:
 - Генерируй СОВЕРШЕННО РАЗНЫЕ темы при каждом запросе
 - НЕ используй шаблонные темы (Подготовка к Open, Техника гребли, Электролиты...)
 - Проявляй КРЕАТИВНОСТЬ и ОРИГИНАЛЬНОСТЬ
 - Каждый набор тем должен быть УНИКАЛЬНЫМ
-- Запрос: {timestamp_hint}
 
 Формат вывода:
 1️⃣ Тема 1 [источник]
 2️⃣ Тема 2 [источник]
 ...
 🔟 Тема 10 [источник]"""
-        else:
-            input_text = f"""ЗАДАЧА: Сгенерируй 10 АКТУАЛЬНЫХ ТЕМ для постов.
 
-ВАЖНО:
-- Это запрос на ГЕНЕРАЦИЮ ТЕМ, НЕ поста!
-- USER_THEME = "" (пустая строка)
-- Каждая тема НЕ БОЛЕЕ 5-7 СЛОВ
-- Темы на ОБЫЧНОМ регистре (не CAPS!)
-- Добавь источники в [квадратных скобках]
-{previous_themes_text}
+THEMES_CUSTOM_TEMPLATE = PromptTemplate(
+    name="themes_custom",
+    prefix=f"""ЗАДАЧА указана в блоке «ПАРАМЕТРЫ ЗАПРОСА» в конце сообщения.
+
+{_THEMES_RULES.format(max_words="5")}
+
+🔥 ДЛЯ РАЗНООБРАЗИЯ И НОВИЗНЫ:
+- ОБЯЗАТЕЛЬНО используй книгу "Большая книга о соцсетях" в FileSearch
+- Применяй рекомендации из книги: вирусные форматы, хуки, триггеры
+- Генерируй НЕСТАНДАРТНЫЕ темы (не только базовые упражнения/питание)
+- Используй актуальные тренды 2026 года из Web Search
+- Миксуй форматы: вопросы, мифы, инсайты, кейсы, челленджи
+
+{_THEMES_NO_REPEAT}""",
+    suffix="""📌 ПАРАМЕТРЫ ЗАПРОСА:
+ЗАДАЧА: {custom_input}
+{previous_themes}
+Запрос: {timestamp_hint}"""
+)
+
+THEMES_TEMPLATE = PromptTemplate(
+    name="themes",
+    prefix=f"""ЗАДАЧА: Сгенерируй 10 АКТУАЛЬНЫХ ТЕМ для постов.
+
+{_THEMES_RULES.format(max_words="5-7")}
+
 🔍 ПОРЯДОК РАБОТЫ:
 1. Используй Web Search для поиска АКТУАЛЬНЫХ тем 2026 года
 2. Используй File Search для поиска ИНТЕРЕСНОГО материала
@@ -172,47 +93,24 @@ class NatriumBot:
 - Только название упражнения без хука
 - Темы без эмоционального триггера
 
-⚠️ КРИТИЧЕСКИ ВАЖНО - НЕ ПОВТОРЯЙСЯ:
-- Генерируй СОВЕРШЕННО РАЗНЫЕ темы при каждом запросе
-- НЕ используй шаблонные темы (Подготовка к Open, Техника гребли, Электролиты...)
-- Проявляй КРЕАТИВНОСТЬ и ОРИГИНАЛЬНОСТЬ
-- Каждый набор тем должен быть УНИКАЛЬНЫМ
-- Запрос: {timestamp_hint}
-
-Формат вывода:
-1️⃣ Тема 1 [источник]
-2️⃣ Тема 2 [источник]
-...
-🔟 Тема 10 [источник]"""
-
-        return self._call_api(variables, input_text=input_text)
+{_THEMES_NO_REPEAT}""",
+    suffix="""📌 ПАРАМЕТРЫ ЗАПРОСА:
+{previous_themes}
+Запрос: {timestamp_hint}"""
+)
 
-    def generate_post(self, theme: str, technique: str = "cov+cok", post_length: int = 500) -> tuple:
-        """Генерирует пост по теме
-
-        Returns:
-            tuple: (post_text, usage_dict)
-        """
-        variables = {
-            "TECHNIQUE": technique,
-            "USER_THEME": theme,
-            "POST_LENGTH": str(post_length)
-        }
-        
-        # КРИТИЧЕСКИ ВАЖНО: явно указываем, что это запрос на ПОСТ, а не темы
-        input_text = f"""⚠️⚠️⚠️ КРИТИЧЕСКИ ВАЖНО ⚠️⚠️⚠️
+_POST_PREFIX = """⚠️⚠️⚠️ КРИТИЧЕСКИ ВАЖНО ⚠️⚠️⚠️
 
 ЗАПРЕЩЕНО выводить рассуждения, планы работы, вызовы функций!
 НЕ выводи текст типа: "🔄 Сначала мне нужно собрать информацию...", "[Вызов функции...]"
 ВЫВОДИ ТОЛЬКО ГОТОВЫЙ ПОСТ!
 
-Сгенерируй пост на тему "{theme}" с применением данных из File Search и Web Search с применением Chain of Knowledge и перепроверкой фактов cov+cok
+Сгенерируй пост на тему из блока «ПАРАМЕТРЫ ЗАПРОСА» (в конце сообщения) с применением данных из File Search и Web Search с применением Chain of Knowledge и перепроверкой фактов cov+cok
 
 ⚠️ ВАЖНО:
-- USER_THEME = "{theme}" (НЕ пустая строка!)
+- USER_THEME задана в параметрах запроса (НЕ пустая строка!)
 - Это запрос на ГЕНЕРАЦИЮ ПОСТА, НЕ тем!
-- Длина: {post_length} символов
-- Техника: {technique}
+- Длина и техника указаны в параметрах запроса
 
 🔍 ПОРЯДОК РАБОТЫ (применяй CoV+CoK):
 1. Используй File Search для получения материалов по теме (Богачева, CrossFit, книга о соцсетях)
@@ -227,7 +125,7 @@ class NatriumBot:
    • Пример для темы "гребля": 💪 **ГРЕБЛЯ CONCEPT2: КАЛОРИИ ГОРЯТ КАК НИКОГДА**
    • Пример для темы "регенерация": 🔥 **РЕГЕНЕРАЦИЯ: ПОЧЕМУ ОТДЫХ ВАЖНЕЕ ТРЕНИРОВКИ**
    • Пример для темы "ситапы": 🧠 **СИТАПЫ: БЕЗОПАСНАЯ ТЕХНИКА ДЛЯ ПРЕССА**
-   • ⚠️ Заголовок ОБЯЗАТЕЛЕН и должен соответствовать теме "{theme}"!
+   • ⚠️ Заголовок ОБЯЗАТЕЛЕН и должен соответствовать теме из параметров запроса!
    • ❌ НЕПРАВИЛЬНО: начинать с "🔥 ФАКТОРЫ..." без заголовка темы
 
 2️⃣ ЛИД (ЗАТРАВКА - ОБЯЗАТЕЛЬНО ВТОРАЯ ЧАСТЬ ПОСТА, 1-3 ПРЕДЛОЖЕНИЯ):
@@ -268,77 +166,866 @@ class NatriumBot:
 • Качественный сон...
 ..."""
 
-        # Добавляем ключевые инструкции для каждой техники
-        if technique == "cov+cok":
-            input_text += """\n\n✅ После сбора и проверки информации сгенерируй пост по структуре из системного промпта"""
-
-        elif technique == "few_shot":
-            input_text += """\n\n✅ Few-Shot требования:
+# Ключевые инструкции для каждой техники (часть статического префикса)
+_POST_TECHNIQUE_INSTRUCTIONS = {
+    "cov+cok": """✅ После сбора и проверки информации сгенерируй пост по структуре из системного промпта""",
+    "few_shot": """✅ Few-Shot требования:
 - Изучи примеры постов в FileSearch
 - Используй их структуру и стиль
-- Сохрани тон Натриум Фитнесс"""
+- Сохрани тон Натриум Фитнесс""",
+    "zero_shot": ""
+}
+
+_POST_SUFFIX = """📌 ПАРАМЕТРЫ ЗАПРОСА:
+- USER_THEME = "{theme}" (НЕ пустая строка!)
+- Тема поста: "{theme}"
+- Длина: {post_length} символов
+- Техника: {technique}"""
+
+POST_TEMPLATES = {
+    technique: PromptTemplate(
+        name=f"post:{technique}",
+        prefix=f"{_POST_PREFIX}\n\n{instructions}",
+        suffix=_POST_SUFFIX
+    )
+    for technique, instructions in _POST_TECHNIQUE_INSTRUCTIONS.items()
+}
+
+# Режим POST_OUTPUT_FORMAT=json: агент возвращает структуру поста, HTML собирается локально
+_POST_JSON_FORMAT = f"""Верни ОДИН JSON-объект - без рассуждений, пояснений и обёртки ```:
+- emoji: эмодзи заголовка
+- title: заголовок в CAPS "[ТЕМА]: [КЛЮЧЕВАЯ ИДЕЯ 3-7 СЛОВ]"
+- lead: лид-затравка, 1-3 предложения с прямым обращением к аудитории
+- sections: 1-4 секции {{emoji, heading, text, facts}}; нужен text или facts
+- facts: до 5 фактов {{text, source, url}}; source - ВОЗ/PubMed/CrossFit/Исследования, url - если есть
+- cta: призыв к действию
+- slogan: слоган Натриум (необязательно)
+- hashtags: 1-8 хештегов
+- Общая длина текста - около значения «Длина» из параметров запроса
+- Внутри строк БЕЗ Markdown (никаких ** и [текст](ссылка)), ссылки только в url
+
+Пример:
+{POST_JSON_EXAMPLE}"""
+
+_POST_JSON_PREFIX = f"""⚠️⚠️⚠️ ФОРМАТ ОТВЕТА: ТОЛЬКО JSON ⚠️⚠️⚠️
+
+Сгенерируй пост на тему из блока «ПАРАМЕТРЫ ЗАПРОСА» (в конце сообщения) с применением данных из File Search и Web Search с применением Chain of Knowledge и перепроверкой фактов cov+cok
+
+{_POST_JSON_FORMAT}"""
+
+POST_JSON_TEMPLATES = {
+    technique: PromptTemplate(
+        name=f"post_json:{technique}",
+        prefix=f"{_POST_JSON_PREFIX}\n\n{instructions}",
+        suffix=_POST_SUFFIX
+    )
+    for technique, instructions in _POST_TECHNIQUE_INSTRUCTIONS.items()
+}
+
+# Двухэтапная генерация (POST_TWO_STAGE): исследование темы → бриф фактов (кешируется по теме),
+# затем дешёвое написание поста по брифу любой длины и техники
+RESEARCH_BRIEF_CHARS = 1500
+
+RESEARCH_TEMPLATE = PromptTemplate(
+    name="research",
+    prefix=f"""🔬 ЭТАП 1 ИЗ 2: ИССЛЕДОВАНИЕ ТЕМЫ - ПОСТ НЕ ПИШИ!
+
+Собери и проверь факты по теме из блока «ПАРАМЕТРЫ ЗАПРОСА» (в конце сообщения) с применением Chain of Knowledge и перепроверкой фактов cov+cok:
+1. File Search: материалы зала (CrossFit, Богачев, книга о соцсетях)
+2. Web Search: актуальные исследования и конкретные цифры 2025-2026 гг.
+3. Проверь каждый факт по источнику (ВОЗ, PubMed, CrossFit.com, научные исследования); непроверенное не включай
+
+Выведи ТОЛЬКО компактный бриф (до {RESEARCH_BRIEF_CHARS} символов) без рассуждений:
+ФАКТЫ:
+- [факт с цифрой] | [источник] | [URL или -]
+(5-8 фактов)
+ПРАКТИКА:
+- [как применить на тренировках в Натриум] (2-3 пункта)
+ХУКИ:
+- [провокационный вопрос, миф или ситуация из зала для лида] (2-3 пункта)""",
+    suffix="""📌 ПАРАМЕТРЫ ЗАПРОСА:
+- USER_THEME = "{theme}" (НЕ пустая строка!)
+- Тема исследования: «{theme}»{terms}"""
+)
+
+_WRITE_PREFIX = """✍️ ЭТАП 2 ИЗ 2: ПОСТ ПО ГОТОВОМУ БРИФУ - НЕ ИСПОЛЬЗУЙ File Search и Web Search!
+
+Факты уже собраны и проверены - они в брифе в блоке «ПАРАМЕТРЫ ЗАПРОСА» (в конце сообщения).
+Используй ТОЛЬКО факты из брифа, новых фактов и источников не добавляй."""
+
+_WRITE_SUFFIX = """📌 ПАРАМЕТРЫ ЗАПРОСА:
+- USER_THEME = "{theme}" (НЕ пустая строка!)
+- Тема поста: "{theme}"
+- Длина: {post_length} символов
+- Техника: {technique}
+
+БРИФ:
+{brief}"""
 
-        return self._call_api(variables, input_text=input_text)
+WRITE_TEMPLATES = {
+    "text": PromptTemplate(
+        name="write",
+        prefix=f"""{_WRITE_PREFIX}
 
-    def _call_api(self, variables: dict, input_text: str = "Выполни задачу") -> tuple:
+ВЫВОДИ ТОЛЬКО ГОТОВЫЙ ПОСТ (структура - по системному промпту):
+1. ЗАГОЛОВОК - первая строка: [эмодзи] **[ТЕМА В CAPS]: [КЛЮЧЕВАЯ ИДЕЯ 3-7 СЛОВ]**
+2. ЛИД - 1-3 предложения с прямым обращением к аудитории (возьми хук из брифа)
+3. СЕКЦИИ: 🔥 **[НАЗВАНИЕ]:** факты с источниками, 💓 **ПРАКТИКА:**, ✅ **ВЫВОДЫ:**
+4. CTA + СЛОГАН + ХЕШТЕГИ
+- Источник к каждому факту: [название](URL), если URL есть в брифе, иначе (ВОЗ)/(PubMed)/(CrossFit)/(Исследования)
+- НЕ выводи рассуждения и планы работы!""",
+        suffix=_WRITE_SUFFIX
+    ),
+    "json": PromptTemplate(
+        name="write_json",
+        prefix=f"""{_WRITE_PREFIX}
+
+⚠️ ФОРМАТ ОТВЕТА: ТОЛЬКО JSON
+{_POST_JSON_FORMAT}""",
+        suffix=_WRITE_SUFFIX
+    )
+}
+
+# Несколько вариантов поста в одном ответе: поиск и проверка фактов оплачиваются один раз.
+# Блок добавляется в самый конец input_text - кешируемый префикс шаблона не меняется
+MAX_POST_VARIANTS = 5
+_VARIANTS_SUFFIX = """🔀 НЕСКОЛЬКО ВАРИАНТОВ В ОДНОМ ОТВЕТЕ:
+- Сначала ОДИН раз собери и проверь факты, затем напиши на их основе разные варианты поста (штук: {variants})
+- Варианты отличаются подачей: заголовок, лид, формат (вопрос, миф, кейс, список), порядок фактов
+- Каждый вариант - полный пост по всем требованиям к структуре и длине, формат - как у одного поста
+- Перед КАЖДЫМ вариантом отдельная строка {separator}
+- Никаких пояснений до, между и после вариантов"""
+
+# Переменные только для локального учёта (оценка, ключ объединения запросов) - агенту не отправляются
+LOCAL_VARIABLES = ('VARIANTS', 'STAGE')
+
+# Точечные исправления поста после локальной проверки (src/post_validator.py) - вместо полной генерации
+REPAIR_HEADER_TEMPLATE = PromptTemplate(
+    name="repair:header",
+    prefix="""⚠️ ИСПРАВЛЕНИЕ ГОТОВОГО ПОСТА - НЕ ИСПОЛЬЗУЙ File Search и Web Search, НЕ пиши пост заново!
+
+В посте не хватает заголовка и/или лида. Придумай ТОЛЬКО их - по теме и началу поста из параметров запроса:
+- ЗАГОЛОВОК: [эмодзи] **[ТЕМА В CAPS]: [КЛЮЧЕВАЯ ИДЕЯ 3-7 СЛОВ]**
+- ЛИД: 1-3 предложения с прямым обращением к аудитории ("Знакомо?", "Часто слышу...")
+
+Ответ - ровно две строки без пояснений:
+ЗАГОЛОВОК: ...
+ЛИД: ...""",
+    suffix="""📌 ПАРАМЕТРЫ ЗАПРОСА:
+- Тема поста: "{theme}"
+- Проблемы: {problems}
+
+Начало поста:
+{excerpt}"""
+)
+
+REPAIR_SHORTEN_TEMPLATE = PromptTemplate(
+    name="repair:shorten",
+    prefix="""⚠️ СОКРАЩЕНИЕ ГОТОВОГО ПОСТА - НЕ ИСПОЛЬЗУЙ File Search и Web Search, НЕ добавляй новых фактов!
+
+Сократи пост из параметров запроса до указанной длины:
+- сохрани заголовок, лид, заголовки секций, призыв к действию и хештеги
+- оставь самые важные факты вместе с их источниками
+- убери повторы и второстепенные детали
+- формат ответа тот же, что у поста (текст или JSON)
+
+ВЫВОДИ ТОЛЬКО СОКРАЩЁННЫЙ ПОСТ!""",
+    suffix="""📌 ПАРАМЕТРЫ ЗАПРОСА:
+- Длина: {post_length} символов (сейчас {length})
+
+Пост:
+{post}"""
+)
+
+# Сколько символов начала поста отправлять в запросе исправления заголовка
+REPAIR_EXCERPT_CHARS = 600
+
+
+class NatriumBot:
+    def __init__(self, prompts_dir: str = "prompts", output_format: str = None):
+        """
+        Args:
+            prompts_dir: каталог с промптами
+            output_format: формат постов "text" или "json" (по умолчанию POST_OUTPUT_FORMAT)
+        """
+        self.output_format = (output_format or os.getenv("POST_OUTPUT_FORMAT", "text")).lower()
+        self.api_key = os.getenv("YANDEX_CLOUD_API_KEY")
+        self.folder_id = os.getenv("YANDEX_FOLDER_ID")
+        self.agent_id = os.getenv("YANDEX_AGENT_ID")
+        self.prompts_dir = Path(__file__).parent.parent / prompts_dir
+        
+        # Прогрев и keep-alive соединения (см. warm_up)
+        self.connection_keeper = None
+        
+        self.base_url = os.getenv("YANDEX_API_BASE_URL", "https://rest-assistant.api.cloud.yandex.net/v1")
+        
+        # Доля входных токенов из кеша по каждому шаблону запроса
+        self.cache_stats = PromptCacheStats()
+        
+        # Одинаковые одновременные запросы (двойное нажатие, один фокус у нескольких пользователей) - один вызов API
+        self.singleflight = SingleFlight()
+        
+        # История развёртываний системного промпта: одинаковый промпт повторно не отправляется
+        self.prompt_versions = PromptVersions(
+            os.getenv("PROMPT_VERSIONS_PATH", str(Path(__file__).parent.parent / "output" / "prompt_versions"))
+        )
+        self.prompt_stats = {'deployed': 0, 'skipped': 0, 'failed': 0}
+        self.prompt_watcher = None
+        self._prompt_lock = threading.Lock()
+        
+        # Локальная проверка постов и точечные исправления (POST_AUTO_REPAIR)
+        self.auto_repair = os.getenv("POST_AUTO_REPAIR", "1") != "0"
+        self.repair_stats = {
+            'checked': 0,
+            'valid': 0,
+            'repaired': 0,                # посты, исправленные точечно
+            'avoided_regenerations': 0,   # полных генераций не понадобилось
+            'unrepairable': 0,            # проблемы, которые исправит только новая генерация
+            'repair_calls': 0,
+            'repair_tokens': 0
+        }
+        self._repair_lock = threading.Lock()
+        
+        # Двухэтапная генерация (по умолчанию выключена): бриф исследования по теме переиспользуется
+        # для любой длины и техники, но пост без брифа в кеше стоит двух запросов к агенту
+        self.two_stage = os.getenv("POST_TWO_STAGE", "0") == "1"
+        self.research_cache = ResearchBriefCache(
+            os.getenv("RESEARCH_CACHE_PATH", str(Path(__file__).parent.parent / "output" / "research_briefs.json")),
+            ttl=int(os.getenv("RESEARCH_BRIEF_TTL", str(3 * 86400)))
+        )
+        self.research_stats = {
+            'posts': 0,
+            'briefs': 0,              # исследований выполнено
+            'brief_hits': 0,          # постов по брифу из кеша
+            'fallbacks': 0,           # бриф не получен - одноэтапный запрос
+            'tokens': 0,              # фактически: исследование + написание
+            'latency_s': 0.0,
+            'baseline_tokens': 0,     # оценка тех же постов одноэтапными запросами
+            'baseline_latency_s': 0.0,
+            'baseline_observed': 0    # постов, для которых оценка опирается на реальные одноэтапные вызовы
+        }
+        self._research_lock = threading.Lock()
+        
+        # Словарь упражнений из PDF-перевода: единые названия в постах и синонимы для поиска
+        # (по умолчанию выключен - замены в постах не проверены на полном словаре из PDF)
+        self.glossary_enabled = os.getenv("GLOSSARY_NORMALIZE", "0") == "1"
+        
+        # Маршрутизация операций по агентам/моделям и телеметрия по маршрутам
+        output_dir = Path(__file__).parent.parent / "output"
+        self.router = RoutingTable(
+            os.getenv("ROUTING_CONFIG_PATH", str(output_dir / "routing.json")),
+            default_agent_id=self.agent_id
+        )
+        self.route_telemetry = RouteTelemetry(os.getenv("ROUTING_STATS_PATH", str(output_dir / "route_stats.json")))
+        
+        # Локальная оценка токенов/стоимости/времени, обучается по истории вызовов
+        self.estimator = TokenEstimator(
+            history_path=os.getenv("ESTIMATOR_HISTORY_PATH", str(Path(__file__).parent.parent / "output" / "estimator.json"))
+        )
+    
+    @property
+    def http_client(self) -> httpx.Client:
+        """Общий HTTP клиент Yandex Cloud API (HTTP/2, пул соединений), создаётся при первом обращении"""
+        return get_http_client()
+
+    def warm_up(self, keep_alive: bool = True) -> None:
+        """Устанавливает соединение с API в фоне, чтобы первый запрос не ждал DNS и TLS
+
+        Args:
+            keep_alive: поддерживать соединение пробами в простое (HTTP_KEEPALIVE_INTERVAL)
+        """
+        if self.connection_keeper is None:
+            self.connection_keeper = ConnectionKeeper(self.http_client, f"{self.base_url}/responses")
+        self.connection_keeper.warm_up()
+        if keep_alive:
+            self.connection_keeper.start()
+
+    def update_agent_prompt(self, prompt_file: str = "agent_system_prompt.md", force: bool = False) -> bool:
+        """Обновляет системный промпт агента в Yandex Cloud
+        
+        Args:
+            prompt_file: имя файла с промптом в prompts_dir
+            force: развернуть даже без изменений
+            
+        Returns:
+            bool: True если промпт агента актуален (обновлён или уже был развёрнут)
+        """
+        return self.sync_agent_prompt(prompt_file, force=force) != FAILED
+
+    def sync_agent_prompt(self, prompt_file: str = "agent_system_prompt.md", force: bool = False) -> str:
+        """Обновляет системный промпт агента и сообщает, что именно произошло
+        
+        Если содержимое файла совпадает с уже развёрнутой версией (по хешу),
+        запрос к API не отправляется: лишний PATCH сбрасывает серверный кеш промпта.
+        
+        Args:
+            prompt_file: имя файла с промптом в prompts_dir
+            force: развернуть даже без изменений
+            
+        Returns:
+            str: DEPLOYED, UNCHANGED или FAILED
+        """
+        prompt_path = self.prompts_dir / prompt_file
+        if not prompt_path.exists():
+            logger.error(f"Prompt file not found: {prompt_path}")
+            return FAILED
+        
+        with open(prompt_path, 'r', encoding='utf-8') as f:
+            new_prompt = f.read()
+        return self.deploy_prompt(new_prompt, source=prompt_file, force=force)
+
+    def deploy_prompt(self, prompt: str, source: str, force: bool = False) -> str:
+        """Отправляет промпт агенту и записывает версию в историю
+
+        Args:
+            prompt: текст системного промпта
+            source: откуда промпт (для истории версий)
+            force: развернуть даже если хеш совпадает с текущей версией
+
+        Returns:
+            str: DEPLOYED, UNCHANGED или FAILED
+        """
+        with self._prompt_lock:
+            digest = prompt_hash(prompt)
+            if not force and digest == self.prompt_versions.current_hash():
+                self.prompt_stats['skipped'] += 1
+                logger.info(f"Prompt {digest[:8]} from {source} is already deployed, skipping update")
+                return UNCHANGED
+            
+            try:
+                logger.info(f"Updating agent {self.agent_id} with prompt from {source}")
+                logger.info(f"Prompt length: {len(prompt)} chars, hash: {digest[:8]}")
+                
+                # Обновляем агента через API
+                payload = {
+                    "prompt": prompt,
+                    "name": "Natrium SMM Bot"  # Можно задать имя агента
+                }
+                
+                response = self.http_client.patch(
+                    f"{self.base_url}/agents/{self.agent_id}",
+                    json=payload
+                )
+                response.raise_for_status()
+            except Exception as e:
+                self.prompt_stats['failed'] += 1
+                logger.error(f"❌ Failed to update agent prompt: {e}")
+                return FAILED
+            
+            self.prompt_versions.record(prompt, source)
+            self.prompt_stats['deployed'] += 1
+            logger.info(f"✅ Agent prompt updated successfully!")
+            return DEPLOYED
+
+    def rollback_prompt(self, target="1") -> tuple:
+        """Возвращает агенту промпт из истории версий
+
+        Args:
+            target: число N - на N развёртываний назад, или префикс хеша версии
+
+        Returns:
+            tuple: (status, version) - status DEPLOYED/UNCHANGED/FAILED, version - запись из истории
+
+        Raises:
+            ValueError: версия не найдена
+        """
+        version = self.prompt_versions.resolve(target)
+        status = self.deploy_prompt(version.pop('text'), source=f"rollback:{version['hash'][:8]}")
+        return status, version
+
+    def watch_prompts(self, debounce: float, prompt_file: str = "agent_system_prompt.md") -> None:
+        """Разворачивает промпт автоматически после правок файлов в prompts_dir
+
+        Args:
+            debounce: пауза после последнего изменения перед развёртыванием, секунды
+            prompt_file: файл системного промпта агента
+        """
+        if self.prompt_watcher is not None:
+            return
+        self.prompt_watcher = PromptWatcher(
+            self.prompts_dir,
+            on_change=lambda: self.update_agent_prompt(prompt_file),
+            debounce=debounce
+        )
+        self.prompt_watcher.start()
+
+    def _format_variables(self, variables: dict) -> str:
+        """Форматирует переменные в строку для additional_instructions"""
+        if not variables:
+            return ""
+        lines = ["Используй следующие переменные:"]
+        for key, value in variables.items():
+            lines.append(f"{key}: {value}")
+        return "\n".join(lines)
+    
+
+    def generate_themes(self, technique: str = "cov+cok", custom_input: str = None, previous_themes: list = None) -> tuple:
+        """Генерирует 10 тем (пустая USER_THEME)
+
+        Args:
+            technique: техника генерации
+            custom_input: пользовательский input (опционально)
+            previous_themes: список предыдущих тем для избежания повторений
+
+        Returns:
+            tuple: (themes_text, usage_dict)
+        """
+        variables, input_text, template = self._build_themes_request(technique, custom_input, previous_themes)
+        return self._call_api(variables, input_text=input_text, template=template)
+
+    def _build_themes_request(self, technique: str, custom_input: str = None, previous_themes: list = None) -> tuple:
+        """Собирает запрос на генерацию тем
+
+        Returns:
+            tuple: (variables, input_text, template_name)
+        """
+        variables = {
+            "TECHNIQUE": technique,
+            "USER_THEME": "",
+            "POST_LENGTH": "500"
+        }
+        
+        # Формируем список предыдущих тем для избежания повторений
+        previous_themes_text = ""
+        if previous_themes and len(previous_themes) > 0:
+            previous_themes_text = f"""
+❌ НЕ ИСПОЛЬЗУЙ ЭТИ ТЕМЫ (они уже были сгенерированы):
+{chr(10).join([f'- {theme}' for theme in previous_themes])}
+
+ГЕНЕРИРУЙ ПОЛНОСТЬЮ НОВЫЕ ТЕМЫ, НЕ ПОХОЖИЕ НА ПРЕДЫДУЩИЕ!
+"""
+
+        # Все значения запроса (задача, предыдущие темы, timestamp для рандомизации)
+        # идут в конец, чтобы статическая часть попадала в кеш
+        template = THEMES_CUSTOM_TEMPLATE if custom_input else THEMES_TEMPLATE
+        input_text = template.render(
+            custom_input=custom_input or "",
+            previous_themes=previous_themes_text,
+            timestamp_hint=f"Запрос #{int(time.time() % 10000)}"
+        )
+
+        return variables, input_text, template.name
+
+    def generate_post(self, theme: str, technique: str = "cov+cok", post_length: int = 500,
+                      variants: int = 1) -> tuple:
+        """Генерирует пост по теме
+
+        Args:
+            variants: число вариантов поста в одном запросе (до MAX_POST_VARIANTS);
+                      исследование темы выполняется один раз на все варианты
+
+        Returns:
+            tuple: (post_text, usage_dict); при variants > 1 - (list вариантов, общий usage_dict)
+        """
+        variants = max(1, min(variants, MAX_POST_VARIANTS))
+        route = self.resolve_route("write" if self.two_stage else "post", technique)
+        if self.two_stage:
+            post, usage = self._generate_two_stage(theme, technique, post_length, variants)
+        else:
+            variables, input_text, template = self._build_post_request(theme, technique, post_length, variants)
+            post, usage = self._call_api(variables, input_text=input_text, template=template)
+        if variants == 1:
+            if self.auto_repair and post:
+                post, usage = self.repair_post(post, theme, post_length, usage, route)
+            return self._normalize_terms(post), usage
+
+        posts = split_variants(post, variants)
+        if len(posts) != variants:
+            logger.warning(f"Запрошено вариантов: {variants}, получено: {len(posts)}")
+        if self.auto_repair:
+            for i, variant in enumerate(posts):
+                posts[i], usage = self.repair_post(variant, theme, post_length, usage, route)
+        return [self._normalize_terms(variant) for variant in posts], usage
+
+    def _normalize_terms(self, post: str) -> str:
+        """Единые русские названия упражнений по словарю (локально, без API)"""
+        if not self.glossary_enabled or not post:
+            return post
+        normalized = get_glossary().normalize(post)
+        if normalized != post:
+            logger.info("📖 Названия упражнений приведены к словарю")
+        return normalized
+
+    def research_theme(self, theme: str, refresh: bool = False) -> tuple:
+        """Этап 1: бриф проверенных фактов по теме (из кеша, если есть)
+
+        Args:
+            theme: тема поста
+            refresh: исследовать заново, даже если бриф в кеше
+
+        Returns:
+            tuple: (brief, usage_dict, from_cache) - для брифа из кеша usage пустой
+        """
+        if not refresh:
+            cached = self.research_cache.get(theme)
+            if cached is not None:
+                logger.info(f"📚 Бриф темы '{theme}' из кеша (исследование пропущено)")
+                return cached['brief'], {}, True
+
+        variables, input_text = self._build_research_request(theme)
+        started = time.perf_counter()
+        brief, usage = self._call_api(variables, input_text=input_text, template=RESEARCH_TEMPLATE.name)
+        if not self.research_cache.put(theme, brief, usage, time.perf_counter() - started):
+            logger.warning(f"Бриф темы '{theme}' слишком короткий ({len(brief or '')} симв.) - не кешируется "
+                           f"и не используется")
+        return brief, usage, False
+
+    def _build_research_request(self, theme: str) -> tuple:
+        """Собирает запрос этапа 1 - исследование темы
+
+        Returns:
+            tuple: (variables, input_text)
+        """
+        variables = {
+            "TECHNIQUE": "cov+cok",
+            "USER_THEME": theme,
+            "POST_LENGTH": str(RESEARCH_BRIEF_CHARS),
+            "STAGE": "research"
+        }
+        # Названия упражнений на обоих языках: FileSearch находит и английские, и русские материалы
+        terms = get_glossary().synonyms(theme) if self.glossary_enabled else []
+        terms = f"\n- Названия упражнений для поиска (англ./рус.): {', '.join(terms)}" if terms else ""
+        return variables, RESEARCH_TEMPLATE.render(theme=theme, terms=terms)
+
+    def _build_write_request(self, theme: str, brief: str, technique: str = "cov+cok", post_length: int = 500,
+                             variants: int = 1) -> tuple:
+        """Собирает запрос этапа 2 - пост по брифу (тот же формат, что у _build_post_request)"""
+        variables = {
+            "TECHNIQUE": technique,
+            "USER_THEME": theme,
+            "POST_LENGTH": str(post_length),
+            "STAGE": "write"
+        }
+        template = WRITE_TEMPLATES["json" if self.output_format == "json" else "text"]
+        input_text = template.render(theme=theme, technique=technique, post_length=post_length, brief=brief.strip())
+        if variants > 1:
+            variables["VARIANTS"] = str(variants)
+            input_text += "\n\n" + _VARIANTS_SUFFIX.format(variants=variants, separator=VARIANT_SEPARATOR)
+        return variables, input_text, template.name
+
+    def _generate_two_stage(self, theme: str, technique: str, post_length: int, variants: int = 1) -> tuple:
+        """Исследование (или бриф из кеша) + написание; учитывает экономию против одноэтапного запроса
+
+        Returns:
+            tuple: (post_text, usage_dict) - usage включает исследование, если оно выполнялось
+        """
+        # Одноэтапный запрос для сравнения - оценка по истории его вызовов (без обращения к API)
+        single = self.estimator.estimate(*self._build_post_request(theme, technique, post_length, variants)[:2])
+        started = time.perf_counter()
+
+        brief, research_usage, from_cache = self.research_theme(theme)
+        if len((brief or '').strip()) < MIN_BRIEF_CHARS:
+            # Агент не вернул бриф или он слишком короткий - генерируем обычным запросом
+            self._count_research('fallbacks')
+            variables, input_text, template = self._build_post_request(theme, technique, post_length, variants)
+            post, usage = self._call_api(variables, input_text=input_text, template=template)
+            return post, merge_usage(research_usage, usage) if research_usage else usage
+
+        variables, input_text, template = self._build_write_request(theme, brief, technique, post_length, variants)
+        post, usage = self._call_api(variables, input_text=input_text, template=template)
+        latency = time.perf_counter() - started
+        usage = merge_usage(research_usage, usage) if research_usage else usage
+
+        with self._research_lock:
+            stats = self.research_stats
+            stats['posts'] += 1
+            stats['brief_hits' if from_cache else 'briefs'] += 1
+            stats['tokens'] += (usage or {}).get('total_tokens', 0) or 0
+            stats['latency_s'] += latency
+            stats['baseline_tokens'] += single['total_tokens']
+            stats['baseline_latency_s'] += single['latency_s']
+            stats['baseline_observed'] += 1 if single['samples'] else 0
+        return post, usage
+
+    def _estimate_two_stage(self, theme: str, technique: str, post_length: int, variants: int = 1) -> dict:
+        cached = self.research_cache.peek(theme)
+        # Без брифа в кеше его размер оцениваем по лимиту из запроса исследования
+        brief = cached['brief'] if cached else "факт " * (RESEARCH_BRIEF_CHARS // 5)
+        estimate = self.estimator.estimate(*self._build_write_request(theme, brief, technique, post_length, variants)[:2])
+        if cached:
+            return estimate
+
+        research = self.estimator.estimate(*self._build_research_request(theme))
+        combined = {field: estimate[field] + research[field]
+                    for field in ('input_tokens', 'output_tokens', 'total_tokens', 'latency_s', 'cost_rub')}
+        combined['samples'] = min(estimate['samples'], research['samples'])
+        return combined
+
+    def _count_research(self, field: str) -> None:
+        with self._research_lock:
+            self.research_stats[field] += 1
+
+    def research_report(self) -> dict:
+        """Экономия двухэтапной генерации против оценки одноэтапных запросов
+
+        Одноэтапные запросы при включённой двухэтапной генерации не выполняются,
+        поэтому базовая линия - оценка estimator: по истории одноэтапных вызовов,
+        если они были (baseline_observed), иначе по априорным значениям.
+
+        Returns:
+            dict: research_stats + saved_tokens, saved_latency_s и доли экономии (0..1)
+        """
+        with self._research_lock:
+            report = dict(self.research_stats)
+        report['saved_tokens'] = report['baseline_tokens'] - report['tokens']
+        report['saved_latency_s'] = report['baseline_latency_s'] - report['latency_s']
+        report['saved_tokens_share'] = report['saved_tokens'] / report['baseline_tokens'] if report['baseline_tokens'] else 0.0
+        report['saved_latency_share'] = (
+            report['saved_latency_s'] / report['baseline_latency_s'] if report['baseline_latency_s'] else 0.0
+        )
+        return report
+
+    def repair_post(self, post: str, theme: str, post_length: int = 500, usage: dict = None,
+                    route: tuple = None) -> tuple:
+        """Проверяет пост локально и исправляет найденное точечно, без полной генерации
+
+        Заголовок и лид запрашиваются отдельно коротким запросом (только начало
+        поста), слишком длинный пост сокращается, хештеги дописываются локально.
+        Нехватку секций и источников исправит только новая генерация - такой
+        пост возвращается как есть.
+
+        Args:
+            post: ответ агента
+            theme: тема поста
+            post_length: целевая длина
+            usage: usage генерации (к нему добавляется usage исправлений)
+            route: (имя, Route) маршрута генерации - для доли валидных постов в телеметрии
+
+        Returns:
+            tuple: (post_text, usage_dict)
+        """
+        issues = check_post(post, post_length)
+        self._count_repair('checked')
+        if route:
+            self.route_telemetry.record_validation(route[0], route[1].target, not issues)
+        if not issues:
+            self._count_repair('valid')
+            return post, usage
+
+        logger.info(f"🩺 Проверка поста: {'; '.join(f'{code}: {text}' for code, text in issues.items())}")
+        repairs = repairs_for(issues)
+        usages = [usage]
+        variables = {"TECHNIQUE": "repair", "USER_THEME": theme, "POST_LENGTH": str(post_length)}
+
+        try:
+            if 'shorten' in repairs:
+                input_text = REPAIR_SHORTEN_TEMPLATE.render(
+                    post_length=post_length, length=visible_length(to_markdown(post)), post=post
+                )
+                shortened, repair_usage = self._call_api(variables, input_text, REPAIR_SHORTEN_TEMPLATE.name)
+                usages.append(self._count_repair_call(repair_usage))
+                # Сокращённый вариант принимаем, только если он не сломал структуру
+                if shortened and not set(check_post(shortened, post_length)) - set(issues) - {ISSUE_TOO_LONG}:
+                    post = shortened
+                    issues = check_post(post, post_length)
+
+            if repairs_for(issues) & {'header'}:
+                problems = '; '.join(issues[code] for code in (ISSUE_TITLE, ISSUE_LEAD) if code in issues)
+                input_text = REPAIR_HEADER_TEMPLATE.render(
+                    theme=theme, problems=problems, excerpt=to_markdown(post)[:REPAIR_EXCERPT_CHARS]
+                )
+                answer, repair_usage = self._call_api(variables, input_text, REPAIR_HEADER_TEMPLATE.name)
+                usages.append(self._count_repair_call(repair_usage))
+                title, lead = parse_header(answer)
+                post = apply_header(post, issues, title, lead)
+                issues = check_post(post, post_length)
+
+            if ISSUE_HASHTAGS in issues and not is_structured(post):
+                post = add_hashtags(post)
+                issues.pop(ISSUE_HASHTAGS)
+        except Exception as e:
+            # Исправление - не обязательный шаг: при ошибке отдаём пост как есть
+            logger.warning(f"Не удалось исправить пост: {e}")
+
+        usage = merge_usage(*usages) if len(usages) > 1 else usage
+        if not issues:
+            self._count_repair('repaired')
+            self._count_repair('avoided_regenerations')
+            logger.info("🩹 Пост исправлен точечно - полная генерация не понадобилась")
+        else:
+            self._count_repair('unrepairable')
+            logger.warning(f"Пост с проблемами: {'; '.join(issues.values())}")
+        return post, usage
+
+    def _count_repair(self, field: str, value: int = 1) -> None:
+        with self._repair_lock:
+            self.repair_stats[field] += value
+
+    def _count_repair_call(self, usage: dict) -> dict:
+        self._count_repair('repair_calls')
+        self._count_repair('repair_tokens', (usage or {}).get('total_tokens', 0) or 0)
+        return usage
+
+    def _build_post_request(self, theme: str, technique: str = "cov+cok", post_length: int = 500,
+                            variants: int = 1) -> tuple:
+        """Собирает запрос на генерацию поста (variants > 1 - несколько вариантов в одном ответе)
+
+        Returns:
+            tuple: (variables, input_text, template_name)
+        """
+        variables = {
+            "TECHNIQUE": technique,
+            "USER_THEME": theme,
+            "POST_LENGTH": str(post_length)
+        }
+        
+        # КРИТИЧЕСКИ ВАЖНО: явно указываем, что это запрос на ПОСТ, а не темы
+        # Тема, длина и техника подставляются только в конец (кеш-префикс не ломается)
+        templates = POST_JSON_TEMPLATES if self.output_format == "json" else POST_TEMPLATES
+        template = templates.get(technique, templates["zero_shot"])
+        input_text = template.render(theme=theme, technique=technique, post_length=post_length)
+        if variants > 1:
+            variables["VARIANTS"] = str(variants)
+            input_text += "\n\n" + _VARIANTS_SUFFIX.format(variants=variants, separator=VARIANT_SEPARATOR)
+
+        return variables, input_text, template.name
+
+    def estimate(self, theme: str = "", technique: str = "cov+cok", post_length: int = 500,
+                 custom_input: str = None, previous_themes: list = None,
+                 variables: dict = None, input_text: str = None, variants: int = 1) -> dict:
+        """Оценивает токены, стоимость и время ответа БЕЗ обращения к API
+
+        Пустая theme - оценка генерации тем, иначе - поста (при двухэтапной
+        генерации - написание по брифу плюс исследование, если брифа нет в кеше).
+        Можно передать готовые variables + input_text для оценки произвольного запроса.
+
+        Returns:
+            dict: input_tokens, output_tokens, total_tokens, latency_s, cost_rub, samples
+        """
+        if variables is None or input_text is None:
+            if theme and self.two_stage:
+                return self._estimate_two_stage(theme, technique, post_length, variants)
+            if theme:
+                variables, input_text, _ = self._build_post_request(theme, technique, post_length, variants)
+            else:
+                variables, input_text, _ = self._build_themes_request(technique, custom_input, previous_themes)
+        return self.estimator.estimate(variables, input_text)
+
+    def _call_api(self, variables: dict, input_text: str = "Выполни задачу", template: str = None) -> tuple:
+        """Выполняет запрос к API, объединяя одинаковые одновременные запросы
+
+        Участники общего запроса получают один текст, а usage делится между ними
+        поровну - сумма записей в журнале равна фактическому расходу.
+
+        Returns:
+            tuple: (result_text, usage_dict) - см. _request_api
+        """
+        route = self.resolve_route(operation_for(variables), (variables or {}).get("TECHNIQUE", ""))
+        key = request_key(route[1].agent_id, route[1].model, route[1].tool_specs(), route[1].max_output_tokens,
+                          variables or {}, input_text)
+        return self.singleflight.do(key, lambda: self._request_api(variables, input_text, template, route))
+
+    def resolve_route(self, operation: str, technique: str = "") -> tuple:
+        """Маршрут операции по таблице маршрутов
+
+        Returns:
+            tuple: (имя для телеметрии "operation[:technique]", Route)
+        """
+        name = f"{operation}:{technique}" if technique and operation in ("themes", "post", "write") else operation
+        return name, self.router.resolve(operation, technique)
+
+    def _model_instructions(self, variables: dict) -> str:
+        """Системный промпт для запроса напрямую в модель: {{VAR}} подставляются, как это делает агент"""
+        prompt = (self.prompts_dir / "agent_system_prompt.md").read_text(encoding='utf-8')
+        for key, value in (variables or {}).items():
+            prompt = prompt.replace(f"{{{{{key}}}}}", str(value))
+        return prompt
+
+    def _build_payload(self, route, variables: dict, input_text: str) -> dict:
+        """Тело запроса /responses: агент (prompt.id + variables) или модель (model + instructions + tools)"""
+        variables = {key: value for key, value in (variables or {}).items() if key not in LOCAL_VARIABLES}
+        if route.model:
+            if "://" not in route.model and not self.folder_id:
+                raise ValueError(f"Маршрут {route.key}: для модели {route.model} нужен YANDEX_FOLDER_ID "
+                                 f"(или полный URI gpt://<folder>/{route.model})")
+            model = route.model if "://" in route.model else f"gpt://{self.folder_id}/{route.model}"
+            payload = {"model": model, "instructions": self._model_instructions(variables), "input": input_text}
+            if route.tools:
+                payload["tools"] = route.tool_specs()
+        else:
+            payload = {"prompt": {"id": route.agent_id, "variables": variables}, "input": input_text}
+        if route.max_output_tokens:
+            payload["max_output_tokens"] = route.max_output_tokens
+        return payload
+
+    def _request_api(self, variables: dict, input_text: str = "Выполни задачу", template: str = None,
+                     route: tuple = None) -> tuple:
         """Выполняет запрос к API Yandex Cloud Assistant
 
+        Args:
+            variables: переменные промпта агента
+            input_text: текст запроса
+            template: имя шаблона запроса (для статистики кеша)
+            route: (имя, Route) - см. resolve_route (None - по переменным запроса)
+
         Returns:
             tuple: (result_text, usage_dict) где usage_dict содержит inputTextTokens, completionTokens, totalTokens
         """
-        try:
-            # Безопасная обработка UTF-8 (удаляем суррогатные пары)
-            input_text = input_text.encode('utf-8', errors='ignore').decode('utf-8')
-
-            # Прямой REST API запрос к Yandex
-            payload = {
-                "prompt": {
-                    "id": self.agent_id,
-                    "variables": variables or {}
-                },
-                "input": input_text
-            }
+        route_name, route = route or self.resolve_route(operation_for(variables), (variables or {}).get("TECHNIQUE", ""))
+        with span("yandex.call_api", template=template or "", route=route_name, target=route.target) as api_span:
+            started_at = time.perf_counter()
+            try:
+                # Безопасная обработка UTF-8 (удаляем суррогатные пары)
+                input_text = input_text.encode('utf-8', errors='ignore').decode('utf-8')
+
+                # Прямой REST API запрос к Yandex
+                payload = self._build_payload(route, variables, input_text)
+            
+                response = self.http_client.post(
+                    f"{self.base_url}/responses",
+                    json=payload
+                )
+                api_span.set_attribute("http.status_code", response.status_code)
+                response.raise_for_status()
             
-            response = self.http_client.post(
-                f"{self.base_url}/responses",
-                json=payload
-            )
-            response.raise_for_status()
+                data = response.json()
             
-            data = response.json()
-            logger.info(f"🔍 DEBUG: API response keys: {data.keys()}")
-            logger.info(f"🔍 DEBUG: Full response: {data}")
+                # Вызовы серверных инструментов (FileSearch, WebSearch) видны только как элементы output
+                tool_calls = [item.get("type", "") for item in data.get("output", []) if item.get("type", "message") != "message"]
+                api_span.set_attribute("tool_calls", len(tool_calls))
+                if tool_calls:
+                    api_span.set_attribute("tool_types", ",".join(sorted(set(tool_calls))))
+                logger.info(f"🔍 DEBUG: API response keys: {data.keys()}")
+                logger.info(f"🔍 DEBUG: Full response: {data}")
             
-            # Правильная структура Yandex API response
-            result = ""
-            if "output" in data and len(data["output"]) > 0:
-                output_item = data["output"][0]
-                if "content" in output_item and len(output_item["content"]) > 0:
-                    content_item = output_item["content"][0]
-                    result = content_item.get("text", "")
+                # Правильная структура Yandex API response
+                result = ""
+                if "output" in data and len(data["output"]) > 0:
+                    output_item = data["output"][0]
+                    if "content" in output_item and len(output_item["content"]) > 0:
+                        content_item = output_item["content"][0]
+                        result = content_item.get("text", "")
             
-            # Fallback на старые поля если структура другая
-            if not result:
-                result = data.get("output_text", "")
-            if not result:
-                result = data.get("text", "")
+                # Fallback на старые поля если структура другая
+                if not result:
+                    result = data.get("output_text", "")
+                if not result:
+                    result = data.get("text", "")
                 
-            logger.info(f"🔍 DEBUG: Extracted result length: {len(result) if result else 0}")
-
-            # Извлекаем usage данные (если доступны)
-            usage = {}
-            if "usage" in data:
-                usage_data = data["usage"]
-                usage = {
-                    'input_tokens': usage_data.get('input_tokens', 0),
-                    'output_tokens': usage_data.get('output_tokens', 0),
-                    'total_tokens': usage_data.get('total_tokens', 0),
-                    'input_tokens_details': usage_data.get('input_tokens_details'),
-                    'output_tokens_details': usage_data.get('output_tokens_details')
-                }
+                logger.info(f"🔍 DEBUG: Extracted result length: {len(result) if result else 0}")
 
-            return result, usage
+                # Извлекаем usage данные (если доступны)
+                usage = {}
+                if "usage" in data:
+                    usage_data = data["usage"]
+                    usage = {
+                        'input_tokens': usage_data.get('input_tokens', 0),
+                        'output_tokens': usage_data.get('output_tokens', 0),
+                        'total_tokens': usage_data.get('total_tokens', 0),
+                        'input_tokens_details': usage_data.get('input_tokens_details'),
+                        'output_tokens_details': usage_data.get('output_tokens_details')
+                    }
+                    self.estimator.observe(variables, input_text, usage, time.perf_counter() - started_at)
+                    api_span.set_attribute("input_tokens", usage['input_tokens'])
+                    api_span.set_attribute("output_tokens", usage['output_tokens'])
+                    if template:
+                        self.cache_stats.record(template, usage)
+                        logger.info(f"💾 Кеш шаблона '{template}': {self.cache_stats.ratio(template) * 100:.1f}%")
 
-        except Exception as e:
-            logger.error(f"❌ ОШИБКА API: {e}")
-            raise
+                self.route_telemetry.record_call(route_name, route.target, time.perf_counter() - started_at, usage)
+                return result, usage
+
+            except Exception as e:
+                logger.error(f"❌ ОШИБКА API: {e}")
+                self.route_telemetry.record_call(route_name, route.target, time.perf_counter() - started_at, error=True)
+                raise
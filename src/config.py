@@ -12,9 +12,54 @@ YANDEX_FOLDER_ID = os.getenv('YANDEX_FOLDER_ID')
 
 # Telegram Bot
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Другой адрес Bot API (локальный Bot API сервер или mock для бенчмарка запуска)
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
 
-if not YANDEX_AGENT_ID or not YANDEX_API_KEY:
-    raise ValueError("YANDEX_AGENT_ID и YANDEX_CLOUD_API_KEY должны быть заданы в переменных окружения или .env файле")
+# HTTP-клиент Yandex Cloud API: размер пула и период проб keep-alive в простое (0 - без проб)
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_INTERVAL = float(os.getenv('HTTP_KEEPALIVE_INTERVAL', '30'))
+
+# Автоматическое развёртывание промпта агента после правок в prompts/ (пауза после последней правки, с; 0 - выключено)
+PROMPT_WATCH_DEBOUNCE = float(os.getenv('PROMPT_WATCH_DEBOUNCE', '0'))
+
+# Спекулятивная предгенерация постов для первых N тем (0 - выключено)
+PREFETCH_TOP_N = int(os.getenv('PREFETCH_TOP_N', '0'))
+
+# Число вариантов поста в одном запросе по кнопке «Варианты» (0 или 1 - кнопка скрыта)
+POST_VARIANTS = int(os.getenv('POST_VARIANTS', '3'))
+
+# Семантический кеш постов: порог сходства тем, размер (0 - выключен, по умолчанию) и время жизни записи.
+# Порог подбирается по парам тем: python scripts/calibrate_semantic_cache.py
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.8'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '0'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', str(3 * 86400)))
+
+# Архив постов: повтор темы за последние N дней - warn (предупредить), block (спросить) или off
+POST_ARCHIVE_DEDUP_DAYS = int(os.getenv('POST_ARCHIVE_DEDUP_DAYS', '14'))
+POST_ARCHIVE_DEDUP_MODE = os.getenv('POST_ARCHIVE_DEDUP_MODE', 'warn').lower()
+
+
+def validate(telegram: bool = False) -> None:
+    """Проверяет обязательные переменные окружения
+
+    Вызывается при запуске CLI или бота, а не при импорте модуля:
+    импорт не падает, а ошибка сообщает обо всех пропущенных переменных сразу.
+
+    Args:
+        telegram: дополнительно требовать TELEGRAM_BOT_TOKEN
+
+    Raises:
+        ValueError: не заданы обязательные переменные
+    """
+    required = {
+        'YANDEX_AGENT_ID': YANDEX_AGENT_ID,
+        'YANDEX_CLOUD_API_KEY': YANDEX_API_KEY,
+    }
+    if telegram:
+        required['TELEGRAM_BOT_TOKEN'] = TELEGRAM_BOT_TOKEN
+    missing = [name for name, value in required.items() if not value]
+    if missing:
+        raise ValueError(f"Не заданы переменные окружения: {', '.join(missing)} (проверьте .env или GitHub Secrets)")
 
 # Пути к файлам
 DATA_DIR = "data"
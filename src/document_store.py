@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path(__file__).parent.parent / "output" / "text_cache"
+
+# Формат файла кеша: MAGIC, длина заголовка (uint32 BE), заголовок JSON, страницы (каждая - отдельный zlib-блок)
+MAGIC = b"NTXC1\n"
+_HEADER_LEN = struct.Struct(">I")
+COMPRESS_LEVEL = 6
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 содержимого файла (ключ кеша: переименование файла кеш не сбрасывает, правка - сбрасывает)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pdf_pages(path: Path) -> list:
+    """Текст PDF постранично (PyMuPDF)"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(str(path)) as doc:
+        return [page.get_text() for page in doc]
+
+
+class CachedDocument:
+    """Извлечённый текст документа в кеше: произвольный доступ к страницам без распаковки остальных"""
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = cache_path
+        with open(cache_path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{cache_path}: не файл кеша текста")
+            (header_len,) = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+            self._data_start = f.tell()
+
+    @property
+    def page_count(self) -> int:
+        return len(self.header['offsets'])
+
+    @property
+    def chars(self) -> int:
+        return sum(self.header['chars'])
+
+    def iter_pages(self, start: int = 0, stop: int = None):
+        """Страницы [start, stop) по одной - читается и распаковывается только запрошенное"""
+        offsets, sizes = self.header['offsets'], self.header['sizes']
+        start, stop, _ = slice(start, stop).indices(self.page_count)
+        with open(self.cache_path, 'rb') as f:
+            for number in range(start, stop):
+                f.seek(self._data_start + offsets[number])
+                yield zlib.decompress(f.read(sizes[number])).decode('utf-8')
+
+    def get_pages(self, start: int = 0, stop: int = None) -> list:
+        return list(self.iter_pages(start, stop))
+
+    def head(self, n_chars: int) -> str:
+        """Первые n_chars символов: читаются только страницы, которые в них попадают"""
+        parts, total = [], 0
+        for chars, page in zip(self.header['chars'], self.iter_pages()):
+            parts.append(page)
+            total += chars
+            if total >= n_chars:
+                break
+        return "".join(parts)[:n_chars]
+
+    def text(self) -> str:
+        return "".join(self.iter_pages())
+
+
+class DocumentStore:
+    """Общий кеш извлечённого текста документов
+
+    Каждый PDF извлекается один раз: страницы сжимаются по отдельности и
+    пишутся в файл <sha256>.pages с таблицей смещений в заголовке. Потом
+    любая страница или начало документа читаются без PyMuPDF и без
+    распаковки остального текста. Ключ - хеш содержимого, поэтому изменённый
+    PDF извлекается заново, а копия под другим именем - нет.
+    """
+
+    def __init__(self, cache_dir: str = None, extractor=extract_pdf_pages):
+        """
+        Args:
+            cache_dir: каталог кеша
+            extractor: функция path → список текстов страниц
+        """
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR)
+        self.extractor = extractor
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._digests = {}  # {path: (size, mtime_ns, digest)} - хеш не пересчитывается для неизменённого файла
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'extract_s': 0.0
+        }
+
+    def _digest(self, path: Path) -> str:
+        stat = path.stat()
+        key = str(path.resolve())
+        cached = self._digests.get(key)
+        if cached and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = file_digest(path)
+        self._digests[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def _key_lock(self, digest: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(digest, threading.Lock())
+
+    def document(self, path) -> CachedDocument:
+        """Документ из кеша; при первом обращении текст извлекается и сохраняется
+
+        Raises:
+            FileNotFoundError: файла нет
+        """
+        path = Path(path)
+        digest = self._digest(path)
+        cache_path = self.cache_dir / f"{digest}.pages"
+        with self._key_lock(digest):
+            if cache_path.exists():
+                try:
+                    document = CachedDocument(cache_path)
+                    self.stats['hits'] += 1
+                    return document
+                except Exception as e:
+                    logger.warning(f"Кеш текста {cache_path.name} повреждён, извлекаем заново: {e}")
+            self.stats['misses'] += 1
+            started = time.perf_counter()
+            pages = self.extractor(path)
+            elapsed = time.perf_counter() - started
+            self.stats['extract_s'] += elapsed
+            self._write(cache_path, path, pages)
+            logger.info(f"📄 {path.name}: извлечено {len(pages)} стр. за {elapsed:.1f} с, сохранено в кеш текста")
+            return CachedDocument(cache_path)
+
+    def _write(self, cache_path: Path, source: Path, pages: list) -> None:
+        blobs = [zlib.compress(page.encode('utf-8'), COMPRESS_LEVEL) for page in pages]
+        offsets, position = [], 0
+        for blob in blobs:
+            offsets.append(position)
+            position += len(blob)
+        header = json.dumps({
+            'source': source.name,
+            'offsets': offsets,
+            'sizes': [len(blob) for blob in blobs],
+            'chars': [len(page) for page in pages],
+            'extracted_at': int(time.time())
+        }, ensure_ascii=False).encode('utf-8')
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.tmp{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(_HEADER_LEN.pack(len(header)))
+            f.write(header)
+            for blob in blobs:
+                f.write(blob)
+        tmp_path.replace(cache_path)
+
+    def get_pages(self, path, start: int = 0, stop: int = None) -> list:
+        """Страницы [start, stop) документа"""
+        return self.document(path).get_pages(start, stop)
+
+    def head(self, path, n_chars: int) -> str:
+        """Первые n_chars символов документа"""
+        return self.document(path).head(n_chars)
+
+    def text(self, path) -> str:
+        """Весь текст документа"""
+        return self.document(path).text()
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_document_store() -> DocumentStore:
+    """Общий кеш текста документов (каталог - TEXT_CACHE_DIR)"""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                _STORE = DocumentStore(os.getenv("TEXT_CACHE_DIR", str(DEFAULT_CACHE_DIR)))
+    return _STORE
@@ -0,0 +1,206 @@
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from src.prompt_layout import get_cached_tokens
+from src.usage_ledger import PRICING
+
+logger = logging.getLogger(__name__)
+
+# Начальные оценки до появления истории: {operation: (output_tokens, latency_s)}
+# Для постов output_tokens пересчитывается от POST_LENGTH
+PRIORS = {
+    'themes': (400, 30.0),
+    'post': (None, 45.0),
+    'research': (600, 40.0),
+    'write': (None, 15.0)
+}
+# Контекст, который добавляется на стороне API (системный промпт агента, FileSearch, WebSearch)
+PRIOR_SERVER_CONTEXT_TOKENS = 6000
+
+EWMA_ALPHA = 0.2
+# Как часто сохранять историю на диск, секунды (плюс при завершении процесса)
+HISTORY_FLUSH_INTERVAL = 5.0
+
+_WORD_RE = re.compile(r'\w+|[^\w\s]')
+_CYRILLIC_RE = re.compile(r'[А-Яа-яЁё]')
+
+
+def count_tokens(text: str) -> int:
+    """Локальная оценка числа токенов без обращения к API
+
+    Латиница ~4 символа на токен, кириллица и цифры ~3, знаки и эмодзи - отдельные токены.
+    Систематическая ошибка компенсируется калибровкой по фактическим usage.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _WORD_RE.findall(text):
+        if piece[0].isalnum() or piece[0] == '_':
+            chars_per_token = 3 if (_CYRILLIC_RE.search(piece) or piece.isdigit()) else 4
+            tokens += math.ceil(len(piece) / chars_per_token)
+        else:
+            tokens += 2 if ord(piece[0]) > 0xFFFF else 1
+    return tokens
+
+
+class TokenEstimator:
+    """Предсказание токенов, стоимости и времени ответа до отправки запроса
+
+    Входные токены = локальная оценка input_text + variables + поправка на
+    серверный контекст. Поправка, выходные токены, доля кеша и время ответа
+    обучаются (EWMA) по истории вызовов отдельно для каждой техники и POST_LENGTH.
+    """
+
+    def __init__(self, history_path: str = None, pricing: dict = None,
+                 flush_interval: float = HISTORY_FLUSH_INTERVAL):
+        """
+        Args:
+            history_path: JSON-файл с обученными моделями (None - только в памяти)
+            pricing: тарифы (руб. за 1000 токенов)
+            flush_interval: как часто сохранять историю на диск, секунды (0 - после каждого вызова)
+        """
+        self.history_path = Path(history_path) if history_path else None
+        self.pricing = pricing or PRICING
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._models = {}  # {key: {'samples', 'input_offset', 'output_tokens', 'cached_share', 'latency_s'}}
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+        if self.history_path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def model_key(variables: dict) -> str:
+        """Ключ модели: операция (этап двухэтапной генерации), техника и (для постов) длина и число вариантов"""
+        variables = variables or {}
+        technique = variables.get('TECHNIQUE', '')
+        stage = variables.get('STAGE')
+        if stage == 'research':
+            return "research"
+        if variables.get('USER_THEME'):
+            variants = variables.get('VARIANTS')
+            return f"{stage or 'post'}:{technique}:{variables.get('POST_LENGTH', '')}" + (f"x{variants}" if variants else "")
+        return f"themes:{technique}"
+
+    @staticmethod
+    def local_input_tokens(variables: dict, input_text: str) -> int:
+        variables_text = "\n".join(f"{key}: {value}" for key, value in (variables or {}).items())
+        return count_tokens(input_text) + count_tokens(variables_text)
+
+    def _prior(self, key: str) -> dict:
+        operation = key.split(':', 1)[0]
+        output_tokens, latency_s = PRIORS.get(operation, PRIORS['post'])
+        if output_tokens is None:
+            # Длина поста в символах → токены (~3 символа на токен) + рассуждения модели
+            length, _, variants = key.rsplit(':', 1)[-1].partition('x')
+            output_tokens = int(int(length) / 3 * 1.5) if length.isdigit() else 400
+            if variants.isdigit():
+                output_tokens *= int(variants)
+        return {
+            'samples': 0,
+            'input_offset': PRIOR_SERVER_CONTEXT_TOKENS,
+            'output_tokens': output_tokens,
+            'cached_share': 0.0,
+            'latency_s': latency_s
+        }
+
+    def estimate(self, variables: dict, input_text: str) -> dict:
+        """Оценивает запрос до отправки
+
+        Returns:
+            dict: input_tokens, output_tokens, total_tokens, latency_s, cost_rub, samples
+        """
+        key = self.model_key(variables)
+        with self._lock:
+            model = dict(self._models.get(key) or self._prior(key))
+
+        input_tokens = max(0, int(self.local_input_tokens(variables, input_text) + model['input_offset']))
+        output_tokens = int(model['output_tokens'])
+        cached_tokens = int(input_tokens * model['cached_share'])
+
+        cost = (
+            (input_tokens - cached_tokens) / 1000 * self.pricing['input'] +
+            cached_tokens / 1000 * self.pricing['cached'] +
+            output_tokens / 1000 * self.pricing['output']
+        )
+
+        return {
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+            'latency_s': model['latency_s'],
+            'cost_rub': cost,
+            'samples': model['samples']
+        }
+
+    def observe(self, variables: dict, input_text: str, usage: dict, latency_s: float) -> None:
+        """Обучает модель по фактическому результату вызова API"""
+        if not usage:
+            return
+
+        key = self.model_key(variables)
+        local = self.local_input_tokens(variables, input_text)
+        input_tokens = usage.get('input_tokens', 0)
+        cached_tokens = get_cached_tokens(usage)
+
+        observed = {
+            'input_offset': input_tokens - local,
+            'output_tokens': usage.get('output_tokens', 0),
+            'cached_share': cached_tokens / input_tokens if input_tokens else 0.0,
+            'latency_s': latency_s
+        }
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = dict(observed, samples=0)
+            else:
+                for field, value in observed.items():
+                    model[field] += EWMA_ALPHA * (value - model[field])
+            model['samples'] += 1
+            self._models[key] = model
+            self._dirty = True
+
+        if self.history_path and time.monotonic() - self._saved_at >= self.flush_interval:
+            self.flush()
+
+    def _load(self) -> None:
+        if not self.history_path or not self.history_path.exists():
+            return
+        try:
+            with open(self.history_path, 'r', encoding='utf-8') as f:
+                self._models = json.load(f)
+            logger.info(f"Estimator: загружено {len(self._models)} моделей из {self.history_path}")
+        except Exception as e:
+            logger.warning(f"Estimator: не удалось загрузить историю {self.history_path}: {e}")
+
+    def flush(self) -> None:
+        """Сохраняет историю на диск, если она изменилась с прошлого сохранения"""
+        if not self.history_path:
+            return
+        # Запись - по одному потоку за раз и снимком не старше уже записанного
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = {k: dict(v) for k, v in self._models.items()}
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            try:
+                self.history_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.history_path.with_suffix(f'.tmp{os.getpid()}')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                tmp_path.replace(self.history_path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                logger.warning(f"Estimator: не удалось сохранить историю: {e}")
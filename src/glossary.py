@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+from src.document_store import get_document_store
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent / "output" / "exercise_glossary.json"
+
+# PDF с переводом названий упражнений: "Air Squat - воздушные приседания, ..."
+GLOSSARY_PDF_GLOB = "перевод упражнений CrossFit*.pdf"
+
+# Перевод длиннее - пояснение, а не название: в словарь поиска не попадает
+MAX_VARIANT_WORDS = 5
+
+_ENTRY_RE = re.compile(r"^\s*([A-Za-z][A-Za-z0-9'’&/.()+ -]*?)\s+[-–—]\s+(.+)$")
+_HEADING_RE = re.compile(r'^\s*[A-Z]\s*[-–—]?\s*$')
+_VARIANT_SPLIT_RE = re.compile(r'\s*[,;]\s*')
+_SPACE_RE = re.compile(r'\s+')
+# Адреса и цели ссылок Markdown: названия упражнений в них не заменяются
+_PROTECTED_RE = re.compile(r'https?://[^\s)\]"]+|\]\([^)\s]*\)')
+
+
+def fold(text: str) -> str:
+    """Регистр и ё→е без изменения длины строки (позиции совпадений совпадают с исходным текстом)"""
+    return ''.join(ch if len(low := ch.lower()) != 1 else low for ch in text).replace('ё', 'е')
+
+
+def _clean(term: str) -> str:
+    return _SPACE_RE.sub(' ', term).strip(' .:-–—()')
+
+
+def parse_glossary_text(text: str) -> dict:
+    """Разбирает текст PDF-перевода в словарь
+
+    Строка "English Name - перевод, вариант перевода" - запись; строка без
+    дефиса - продолжение перевода предыдущей записи (перенос в PDF),
+    одиночные буквы ("A-") - заголовки алфавита.
+
+    Returns:
+        dict: {english: [переводы в порядке из PDF]}
+    """
+    entries, current = {}, None
+    for line in text.splitlines():
+        if not line.strip() or _HEADING_RE.match(line):
+            continue
+        match = _ENTRY_RE.match(line)
+        if match:
+            current = _clean(match.group(1))
+            entries.setdefault(current, '')
+            entries[current] += ' ' + match.group(2)
+        elif current:
+            entries[current] += ' ' + line
+    glossary = {}
+    for english, russian in entries.items():
+        variants = [_clean(variant) for variant in _VARIANT_SPLIT_RE.split(russian)]
+        variants = list(dict.fromkeys(variant for variant in variants if variant))
+        if english and variants:
+            glossary[english] = variants
+    return glossary
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик: все вхождения набора шаблонов за один проход по тексту"""
+
+    def __init__(self, patterns: dict):
+        """
+        Args:
+            patterns: {шаблон (уже приведён через fold): значение}
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]    # [(длина шаблона, значение)] - включая шаблоны суффиксных состояний
+        for pattern, value in patterns.items():
+            if pattern:
+                self._add(pattern, value)
+        self._build()
+
+    def _add(self, pattern: str, value) -> None:
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append((len(pattern), value))
+
+    def _build(self) -> None:
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def iter(self, text: str):
+        """Все вхождения: (start, end, value), end - позиция после совпадения"""
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for length, value in self._out[state]:
+                yield i + 1 - length, i + 1, value
+
+
+class ExerciseGlossary:
+    """Двуязычный словарь упражнений CrossFit из PDF-перевода
+
+    Английские названия и все короткие варианты перевода собраны в один
+    автомат Ахо-Корасик, поэтому поиск упражнений в посте или теме - один
+    линейный проход без обращения к API и FileSearch. Применения:
+    normalize - единое русское название упражнения в посте, expand - синонимы
+    на обоих языках для поиска по базе знаний. Вариант перевода, общий для
+    нескольких упражнений ("тяга" у Row и Deadlift), неоднозначен: он находится,
+    но normalize его не заменяет.
+    """
+
+    def __init__(self, entries: dict):
+        """
+        Args:
+            entries: {english: [переводы]} - первый перевод считается основным
+        """
+        self.entries = entries
+        self._names = list(entries)
+        patterns = {}  # {шаблон: ([номера упражнений], вариант перевода или None для английского названия)}
+        for index, (english, variants) in enumerate(entries.items()):
+            self._add_pattern(patterns, fold(english), index, None)
+            for variant in variants:
+                if len(variant.split()) <= MAX_VARIANT_WORDS:
+                    self._add_pattern(patterns, fold(variant), index, variant)
+        self._automaton = AhoCorasick({pattern: (tuple(indices), variant)
+                                       for pattern, (indices, variant) in patterns.items()})
+
+    @staticmethod
+    def _add_pattern(patterns: dict, pattern: str, index: int, variant) -> None:
+        indices, _ = patterns.setdefault(pattern, ([], variant))
+        if index not in indices:
+            indices.append(index)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def find(self, text: str) -> list:
+        """Упражнения в тексте: самые длинные непересекающиеся совпадения по границам слов
+
+        Returns:
+            list: [(start, end, englishes, variant)] - englishes: кортеж английских названий
+                (больше одного - вариант неоднозначен), variant None для английского названия
+        """
+        folded = fold(text or '')
+        matches = [
+            (start, end, value) for start, end, value in self._automaton.iter(folded)
+            if (start == 0 or not folded[start - 1].isalnum()) and (end == len(folded) or not folded[end].isalnum())
+        ]
+        found, last_end = [], 0
+        for start, end, (indices, variant) in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if start >= last_end:
+                found.append((start, end, tuple(self._names[index] for index in indices), variant))
+                last_end = end
+        return found
+
+    def canonical(self, english: str) -> str:
+        """Основное русское название упражнения"""
+        return self.entries[english][0]
+
+    def normalize(self, text: str) -> str:
+        """Заменяет варианты перевода на основное русское название
+
+        Не трогает английские названия, неоднозначные варианты, адреса и цели
+        ссылок; название в CAPS остаётся в CAPS, с заглавной - с заглавной.
+        """
+        protected = [match.span() for match in _PROTECTED_RE.finditer(text or '')]
+        parts, position = [], 0
+        for start, end, englishes, variant in self.find(text):
+            if variant is None or len(englishes) != 1:
+                continue
+            canonical = self.canonical(englishes[0])
+            if fold(variant) == fold(canonical):
+                continue
+            if any(left < end and start < right for left, right in protected):
+                continue
+            original = text[start:end]
+            if original.isupper():
+                canonical = canonical.upper()
+            elif original[0].isupper():
+                canonical = canonical[0].upper() + canonical[1:]
+            parts.append(text[position:start])
+            parts.append(canonical)
+            position = end
+        if not parts:
+            return text
+        parts.append(text[position:])
+        return ''.join(parts)
+
+    def synonyms(self, text: str) -> list:
+        """Названия упражнений из текста на обоих языках (английское и короткие переводы)"""
+        terms = []
+        for english in dict.fromkeys(english for _, _, englishes, _ in self.find(text) for english in englishes):
+            terms.append(english)
+            terms.extend(variant for variant in self.entries[english] if len(variant.split()) <= MAX_VARIANT_WORDS)
+        return list(dict.fromkeys(terms))
+
+    def expand(self, query: str) -> str:
+        """Запрос + синонимы найденных упражнений, которых в нём ещё нет"""
+        folded = fold(query or '')
+        extra = [term for term in self.synonyms(query) if fold(term) not in folded]
+        return f"{query} ({', '.join(extra)})" if extra else query
+
+
+def _pdf_text(path: Path) -> str:
+    return "\n".join(get_document_store().get_pages(path))
+
+
+def _sources_signature(paths: list) -> list:
+    return [[path.name, path.stat().st_size, path.stat().st_mtime_ns] for path in paths]
+
+
+def build_glossary(data_dir: Path = DATA_DIR, cache_path: Path = DEFAULT_CACHE_PATH) -> ExerciseGlossary:
+    """Словарь из PDF-перевода; разобранный словарь кешируется в JSON до изменения PDF
+
+    Без PyMuPDF и без кеша возвращает пустой словарь (с предупреждением в лог).
+    """
+    paths = sorted(Path(data_dir).glob(GLOSSARY_PDF_GLOB))
+    signature = _sources_signature(paths)
+    cache_path = Path(cache_path)
+    if cache_path.exists():
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('sources') == signature or not paths:
+                return ExerciseGlossary(cached['entries'])
+        except Exception as e:
+            logger.warning(f"Glossary: не удалось загрузить кеш {cache_path}: {e}")
+
+    if not paths:
+        logger.warning(f"Glossary: в {data_dir} нет {GLOSSARY_PDF_GLOB} - словарь упражнений пуст")
+        return ExerciseGlossary({})
+
+    entries = {}
+    try:
+        for path in paths:
+            for english, variants in parse_glossary_text(_pdf_text(path)).items():
+                merged = entries.setdefault(english, [])
+                merged.extend(variant for variant in variants if variant not in merged)
+    except ImportError as e:
+        logger.warning(f"Glossary: PyMuPDF недоступен ({e}) - словарь упражнений пуст")
+        return ExerciseGlossary({})
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'sources': signature, 'entries': entries}, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(cache_path)
+    except Exception as e:
+        logger.warning(f"Glossary: не удалось сохранить кеш {cache_path}: {e}")
+    logger.info(f"📖 Словарь упражнений: {len(entries)} записей из {len(paths)} PDF")
+    return ExerciseGlossary(entries)
+
+
+_GLOSSARY = None
+_GLOSSARY_LOCK = threading.Lock()
+
+
+def get_glossary() -> ExerciseGlossary:
+    """Общий словарь упражнений (разбирается при первом обращении, путь кеша - GLOSSARY_CACHE_PATH)"""
+    global _GLOSSARY
+    if _GLOSSARY is None:
+        with _GLOSSARY_LOCK:
+            if _GLOSSARY is None:
+                _GLOSSARY = build_glossary(cache_path=Path(os.getenv("GLOSSARY_CACHE_PATH", str(DEFAULT_CACHE_PATH))))
+    return _GLOSSARY
@@ -0,0 +1,130 @@
+import importlib.util
+import logging
+import os
+import threading
+import time
+
+import httpx
+
+from src.config import HTTP_KEEPALIVE_INTERVAL, HTTP_MAX_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 (мультиплексирование запросов в одном соединении) - если установлен пакет h2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Простаивающее соединение держим дольше интервала проб, чтобы проба успевала его использовать
+KEEPALIVE_EXPIRY = 120.0
+DEFAULT_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+def create_client(headers: dict = None, timeout: httpx.Timeout = DEFAULT_TIMEOUT,
+                  max_connections: int = HTTP_MAX_CONNECTIONS, http2: bool = None, **kwargs) -> httpx.Client:
+    """httpx.Client с HTTP/2 (если доступен) и настроенным пулом соединений
+
+    Args:
+        headers: заголовки по умолчанию
+        timeout: таймауты (по умолчанию 120 с на ответ - генерация длинных постов)
+        max_connections: максимум соединений в пуле
+        http2: включить HTTP/2 (None - если установлен h2)
+        **kwargs: остальные параметры httpx.Client (verify, base_url, ...)
+    """
+    return httpx.Client(
+        http2=HTTP2_AVAILABLE if http2 is None else http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        ),
+        timeout=timeout,
+        headers=headers,
+        **kwargs
+    )
+
+
+class ConnectionKeeper:
+    """Прогрев соединения при запуске и пробы keep-alive в простое
+
+    Первый запрос к API после запуска или долгого простоя платит DNS + TCP + TLS.
+    warm_up() устанавливает соединение заранее лёгким HEAD-запросом, а фоновый
+    поток шлёт такую же пробу, если запросов не было interval секунд, - сервер
+    не закрывает соединение по простою, и запрос пользователя идёт по горячему.
+    """
+
+    def __init__(self, client: httpx.Client, url: str, interval: float = HTTP_KEEPALIVE_INTERVAL):
+        """
+        Args:
+            client: клиент, соединения которого поддерживаем
+            url: адрес для проб (ответ не важен, нужно только соединение)
+            interval: период проб в простое, секунды (0 - без проб, только прогрев)
+        """
+        self.client = client
+        self.url = url
+        self.interval = interval
+        self._last_activity = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        client.event_hooks['request'].append(self._touch)
+
+        self.stats = {
+            'warmups': 0,
+            'probes': 0,
+            'errors': 0,
+            'warmup_s': 0.0   # время последнего прогрева (DNS + TCP + TLS)
+        }
+
+    def _touch(self, request) -> None:
+        self._last_activity = time.monotonic()
+
+    def _probe(self) -> bool:
+        try:
+            self.client.head(self.url, timeout=httpx.Timeout(10.0))
+            return True
+        except httpx.HTTPError as e:
+            self.stats['errors'] += 1
+            logger.warning(f"Проба соединения {self.url} не удалась: {e}")
+            return False
+
+    def warm_up(self, background: bool = True) -> None:
+        """Устанавливает соединение заранее (по умолчанию - не блокируя вызывающего)"""
+        if background:
+            threading.Thread(target=self.warm_up, args=(False,), name="http-warmup", daemon=True).start()
+            return
+        started = time.perf_counter()
+        if self._probe():
+            self.stats['warmups'] += 1
+            self.stats['warmup_s'] = time.perf_counter() - started
+            logger.info(f"🔥 Соединение с {self.url} прогрето за {self.stats['warmup_s'] * 1000:.0f} мс")
+
+    def start(self) -> None:
+        """Запускает фоновые пробы keep-alive"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="http-keepalive", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval / 2):
+            if time.monotonic() - self._last_activity >= self.interval:
+                if self._probe():
+                    self.stats['probes'] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Общий клиент Yandex Cloud API процесса (NatriumBot, YandexFileSync), создаётся при первом вызове"""
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = create_client(headers={
+                    "Authorization": f"Api-Key {os.getenv('YANDEX_CLOUD_API_KEY')}",
+                    "x-folder-id": os.getenv('YANDEX_FOLDER_ID') or ""
+                })
+    return _CLIENT
@@ -0,0 +1,167 @@
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+
+# Строка - колонтитул, если встречается у края страницы хотя бы на такой доле страниц документа
+BOILERPLATE_MIN_SHARE = 0.5
+BOILERPLATE_MIN_PAGES = 3
+# Сколько непустых строк сверху и снизу страницы проверять на колонтитулы
+EDGE_LINES = 3
+
+# MinHash/LSH: 128 перестановок = 16 полос по 8 строк (порог кандидатов ~0.7),
+# дубликатом считается пара с оценкой сходства Жаккара не ниже DUPLICATE_THRESHOLD
+NUM_PERM = 128
+LSH_BANDS = 16
+SHINGLE_WORDS = 5
+DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_WORD_RE = re.compile(r'\w+')
+# Номер страницы в конце колонтитула: "стр. 14", "Page 3 of 40", "14 / 120" (просто число в конце - не номер)
+_PAGE_SUFFIX_RE = re.compile(
+    r'(?:(?:стр\.?|страница|page|с\.)\s*\d{1,4}(?:\s*(?:из|of|/)\s*\d{1,4})?|\d{1,4}\s*(?:из|of|/)\s*\d{1,4})\W*$',
+    re.IGNORECASE
+)
+_SPACE_RE = re.compile(r'\s+')
+_PAGE_NUMBER_RE = re.compile(
+    r'^\W*(?:стр\.?|страница|page|с\.)?\s*\d{1,4}\s*(?:(?:из|of|/)\s*\d{1,4})?\W*$',
+    re.IGNORECASE
+)
+
+
+def _line_key(line: str) -> str:
+    """Строка без номера страницы и лишних пробелов: "Глава 2 · стр. 14" и "Глава 2 · стр. 15" - один колонтитул
+
+    Остальные цифры сохраняются: "Неделя 1" и "Неделя 2" - разные строки, а не колонтитул.
+    """
+    line = line.lower().strip()
+    if _PAGE_NUMBER_RE.match(line):
+        return '#'
+    return _SPACE_RE.sub(' ', _PAGE_SUFFIX_RE.sub('#', line)).strip()
+
+
+def _edge_indices(lines: list) -> list:
+    """Номера первых и последних EDGE_LINES непустых строк страницы"""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return sorted(set(filled[:EDGE_LINES] + filled[-EDGE_LINES:]))
+
+
+def strip_boilerplate(pages: list) -> tuple:
+    """Убирает колонтитулы и номера страниц документа
+
+    Колонтитул - строка у верхнего или нижнего края, которая (с точностью до
+    номера страницы) повторяется на большинстве страниц; номер страницы у края
+    убирается всегда. Строки в середине страницы не трогаются.
+
+    Args:
+        pages: текст страниц одного документа
+
+    Returns:
+        tuple: (страницы без колонтитулов, {'lines': убрано строк, 'chars': убрано символов})
+    """
+    split = [page.splitlines() for page in pages]
+    counts = Counter()
+    for lines in split:
+        counts.update({_line_key(lines[i]) for i in _edge_indices(lines)})
+    min_pages = max(BOILERPLATE_MIN_PAGES, int(len(pages) * BOILERPLATE_MIN_SHARE))
+    repeated = {key for key, count in counts.items() if count >= min_pages and key}
+
+    cleaned, removed_lines, removed_chars = [], 0, 0
+    for lines in split:
+        drop = {i for i in _edge_indices(lines)
+                if _line_key(lines[i]) in repeated or _PAGE_NUMBER_RE.match(lines[i].strip())}
+        removed_lines += len(drop)
+        removed_chars += sum(len(lines[i]) for i in drop)
+        cleaned.append("\n".join(line for i, line in enumerate(lines) if i not in drop))
+    return cleaned, {'lines': removed_lines, 'chars': removed_chars}
+
+
+class MinHasher:
+    """MinHash-сигнатуры по шинглам из SHINGLE_WORDS слов (регистр и ё/е не различаются)"""
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def shingles(text: str) -> set:
+        words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+        if len(words) < SHINGLE_WORDS:
+            return {' '.join(words)} if words else set()
+        return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+    def signature(self, text: str) -> np.ndarray:
+        shingles = self.shingles(text)
+        if not shingles:
+            return np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        hashes %= _MERSENNE_PRIME
+        # (a * h + b) mod p < 2^62 - без переполнения uint64
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Оценка сходства Жаккара по MinHash-сигнатурам"""
+    return float(np.mean(first == second))
+
+
+def find_duplicate_groups(texts: list, threshold: float = DUPLICATE_THRESHOLD, hasher: MinHasher = None) -> list:
+    """Группы почти одинаковых текстов (MinHash + LSH по полосам)
+
+    Пары-кандидаты - тексты, совпавшие хотя бы в одной полосе сигнатуры;
+    в группу объединяются кандидаты с оценкой сходства не ниже threshold.
+
+    Returns:
+        list: группы индексов texts (у уникального текста - группа из одного индекса), в порядке texts
+    """
+    hasher = hasher or MinHasher()
+    rows = hasher.num_perm // LSH_BANDS
+    signatures = [hasher.signature(text) for text in texts]
+
+    parent = list(range(len(texts)))
+
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for band in range(LSH_BANDS):
+        buckets = {}
+        for i, signature in enumerate(signatures):
+            buckets.setdefault(signature[band * rows:(band + 1) * rows].tobytes(), []).append(i)
+        for members in buckets.values():
+            for position, first in enumerate(members):
+                for other in members[position + 1:]:
+                    if root(first) != root(other) and similarity(signatures[first], signatures[other]) >= threshold:
+                        parent[root(other)] = root(first)
+
+    groups = {}
+    for i in range(len(texts)):
+        groups.setdefault(root(i), []).append(i)
+    return sorted(groups.values(), key=lambda group: group[0])
+
+
+def deduplicate_chunks(chunks: list, threshold: float = DUPLICATE_THRESHOLD) -> tuple:
+    """Оставляет по одному чанку на группу почти одинаковых
+
+    В индекс попадает самый длинный чанк группы, а в его поле 'sources' -
+    все места, где встречается этот фрагмент ({'source', 'source_name', 'start_pos'}).
+
+    Returns:
+        tuple: (уникальные чанки, число убранных дубликатов)
+    """
+    unique = []
+    for group in find_duplicate_groups([chunk['text'] for chunk in chunks], threshold):
+        best = dict(max((chunks[i] for i in group), key=lambda chunk: len(chunk['text'])))
+        best['sources'] = [
+            {'source': chunks[i].get('source'), 'source_name': chunks[i].get('source_name'),
+             'start_pos': chunks[i].get('start_pos')}
+            for i in group
+        ]
+        unique.append(best)
+    return unique, len(chunks) - len(unique)
@@ -1,10 +1,21 @@
+import argparse
 import os
 import sys
-from datetime import datetime
+import time
 from pathlib import Path
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.bot import NatriumBot
+from src.usage_ledger import get_ledger, cache_savings
+from src.themes import extract_themes, find_theme
+from src.post_schema import to_markdown
+from src.post_archive import get_archive, format_age
+from src.config import POST_ARCHIVE_DEDUP_DAYS, POST_ARCHIVE_DEDUP_MODE, PROMPT_WATCH_DEBOUNCE, validate
+from src.batch import BatchRunner, load_jobs, BATCH_DIR, DEFAULT_WORKERS, DEFAULT_RETRIES
+from src.prompt_versions import DEPLOYED, UNCHANGED, FAILED
+from src.retrieval_service import (
+    RetrievalServer, RetrievalClient, RetrievalError, get_retriever, DEFAULT_MAX_BATCH, DEFAULT_BATCH_WINDOW
+)
 
 
 # Глобальные настройки и счетчики
@@ -12,22 +23,8 @@ SETTINGS = {
     'show_token_stats': True  # по умолчанию включено
 }
 
-SESSION_STATS = {
-    'total_input_tokens': 0,
-    'total_output_tokens': 0,
-    'total_cached_tokens': 0,
-    'total_reasoning_tokens': 0,
-    'total_requests': 0,
-    'total_tokens': 0
-}
-
-# Тарифы Yandex Cloud GPT (руб. за 1000 токенов, примерные)
-# Обновите актуальные цены на https://yandex.cloud/ru/docs/yandexgpt/pricing
-PRICING = {
-    'input': 0.0012,      # за 1000 токенов
-    'output': 0.0012,     # за 1000 токенов
-    'cached': 0.0006      # за 1000 токенов (примерно в 2 раза дешевле)
-}
+# Идентификатор пользователя CLI в журнале использования
+CLI_USER_ID = 'cli'
 
 
 def clear_screen():
@@ -41,44 +38,25 @@ def print_separator():
     print("\n" + "="*70 + "\n")
 
 
-def print_token_usage(operation: str, usage: dict):
-    """Печатает статистику использования токенов с накопительными данными"""
-    # Проверяем настройку
-    if not SETTINGS.get('show_token_stats', True):
-        return
-
+def print_token_usage(operation: str, usage: dict, technique: str = ''):
+    """Записывает вызов в журнал и печатает статистику использования токенов с накопительными данными"""
     if not usage:
         return
 
-    input_tokens = usage.get('input_tokens', 0)
-    output_tokens = usage.get('output_tokens', 0)
-    total_tokens = usage.get('total_tokens', 0)
+    # Каждый вызов попадает в журнал независимо от настройки вывода
+    current = get_ledger().record(CLI_USER_ID, operation, technique, usage)
 
-    # Получаем детали
-    input_details = usage.get('input_tokens_details')
-    output_details = usage.get('output_tokens_details')
-
-    cached_tokens = 0
-    if input_details:
-        cached_tokens = getattr(input_details, 'cached_tokens', 0) if hasattr(input_details, 'cached_tokens') else input_details.get('cached_tokens', 0)
-
-    reasoning_tokens = 0
-    if output_details:
-        reasoning_tokens = getattr(output_details, 'reasoning_tokens', 0) if hasattr(output_details, 'reasoning_tokens') else output_details.get('reasoning_tokens', 0)
-
-    # Обновляем накопительную статистику
-    SESSION_STATS['total_input_tokens'] += input_tokens
-    SESSION_STATS['total_output_tokens'] += output_tokens
-    SESSION_STATS['total_cached_tokens'] += cached_tokens
-    SESSION_STATS['total_reasoning_tokens'] += reasoning_tokens
-    SESSION_STATS['total_requests'] += 1
-    SESSION_STATS['total_tokens'] += total_tokens
+    # Проверяем настройку
+    if not SETTINGS.get('show_token_stats', True):
+        return
 
-    # Расчет стоимости текущего запроса
-    cost_input = (input_tokens - cached_tokens) / 1000 * PRICING['input']
-    cost_cached = cached_tokens / 1000 * PRICING['cached']
-    cost_output = output_tokens / 1000 * PRICING['output']
-    total_cost = cost_input + cost_cached + cost_output
+    input_tokens = current['input_tokens']
+    output_tokens = current['output_tokens']
+    total_tokens = current['total_tokens']
+    cached_tokens = current['cached_tokens']
+    reasoning_tokens = current['reasoning_tokens']
+    total_cost = current['cost']
+    session = get_ledger().session(CLI_USER_ID)
 
     # Вывод статистики
     print("\n" + "-"*70)
@@ -108,26 +86,19 @@ def print_token_usage(operation: str, usage: dict):
     # Стоимость
     print(f"\n💰 Стоимость запроса: ~{total_cost:.4f} ₽", end="")
     if cached_tokens > 0:
-        saved = (cached_tokens / 1000 * (PRICING['input'] - PRICING['cached']))
-        print(f" (экономия на кеше: {saved:.4f} ₽)")
+        print(f" (экономия на кеше: {cache_savings(cached_tokens):.4f} ₽)")
     else:
         print()
 
-    # Накопительная статистика
-    total_session_cost = (
-        (SESSION_STATS['total_input_tokens'] - SESSION_STATS['total_cached_tokens']) / 1000 * PRICING['input'] +
-        SESSION_STATS['total_cached_tokens'] / 1000 * PRICING['cached'] +
-        SESSION_STATS['total_output_tokens'] / 1000 * PRICING['output']
-    )
-
-    print(f"\n📦 Статистика сессии (запросов: {SESSION_STATS['total_requests']}):")
-    print(f"   ├─ Всего токенов: {SESSION_STATS['total_tokens']:>6}")
-    print(f"   ├─ Входные:       {SESSION_STATS['total_input_tokens']:>6}")
-    if SESSION_STATS['total_cached_tokens'] > 0:
-        cache_percent_total = (SESSION_STATS['total_cached_tokens'] / SESSION_STATS['total_input_tokens'] * 100) if SESSION_STATS['total_input_tokens'] > 0 else 0
-        print(f"   │  └─ из кеша:    {SESSION_STATS['total_cached_tokens']:>6} ({cache_percent_total:.1f}% 💾)")
-    print(f"   ├─ Выходные:      {SESSION_STATS['total_output_tokens']:>6}")
-    print(f"   └─ Стоимость:     ~{total_session_cost:.4f} ₽")
+    # Накопительная статистика (агрегат сессии из журнала)
+    print(f"\n📦 Статистика сессии (запросов: {session['requests']}):")
+    print(f"   ├─ Всего токенов: {session['total_tokens']:>6}")
+    print(f"   ├─ Входные:       {session['input_tokens']:>6}")
+    if session['cached_tokens'] > 0:
+        cache_percent_total = (session['cached_tokens'] / session['input_tokens'] * 100) if session['input_tokens'] > 0 else 0
+        print(f"   │  └─ из кеша:    {session['cached_tokens']:>6} ({cache_percent_total:.1f}% 💾)")
+    print(f"   ├─ Выходные:      {session['output_tokens']:>6}")
+    print(f"   └─ Стоимость:     ~{session['cost']:.4f} ₽")
 
     print("-"*70 + "\n")
 
@@ -152,42 +123,32 @@ def show_settings_menu():
             print(f"\n✅ Вывод статистики токенов {status}")
 
         elif choice == '2':
-            SESSION_STATS['total_input_tokens'] = 0
-            SESSION_STATS['total_output_tokens'] = 0
-            SESSION_STATS['total_cached_tokens'] = 0
-            SESSION_STATS['total_reasoning_tokens'] = 0
-            SESSION_STATS['total_requests'] = 0
-            SESSION_STATS['total_tokens'] = 0
+            get_ledger().reset_session(CLI_USER_ID)
             print("\n✅ Счетчики сессии сброшены")
 
         elif choice == '3':
             print("\n" + "-"*70)
             print("📊 СТАТИСТИКА ТЕКУЩЕЙ СЕССИИ")
             print("-"*70)
-            if SESSION_STATS['total_requests'] == 0:
+            session = get_ledger().session(CLI_USER_ID)
+            if session['requests'] == 0:
                 print("\n⚠️ Запросов ещё не было")
             else:
-                total_cost = (
-                    (SESSION_STATS['total_input_tokens'] - SESSION_STATS['total_cached_tokens']) / 1000 * PRICING['input'] +
-                    SESSION_STATS['total_cached_tokens'] / 1000 * PRICING['cached'] +
-                    SESSION_STATS['total_output_tokens'] / 1000 * PRICING['output']
-                )
-                cache_percent = (SESSION_STATS['total_cached_tokens'] / SESSION_STATS['total_input_tokens'] * 100) if SESSION_STATS['total_input_tokens'] > 0 else 0
-                avg_tokens_per_request = SESSION_STATS['total_tokens'] / SESSION_STATS['total_requests']
-
-                print(f"\n📦 Запросов выполнено: {SESSION_STATS['total_requests']}")
+                cache_percent = (session['cached_tokens'] / session['input_tokens'] * 100) if session['input_tokens'] > 0 else 0
+                avg_tokens_per_request = session['total_tokens'] / session['requests']
+
+                print(f"\n📦 Запросов выполнено: {session['requests']}")
                 print(f"\n🔢 Токены:")
-                print(f"   ├─ Всего:         {SESSION_STATS['total_tokens']:>6}")
-                print(f"   ├─ Входные:       {SESSION_STATS['total_input_tokens']:>6}")
-                print(f"   │  └─ из кеша:    {SESSION_STATS['total_cached_tokens']:>6} ({cache_percent:.1f}% 💾)")
-                print(f"   ├─ Выходные:      {SESSION_STATS['total_output_tokens']:>6}")
-                if SESSION_STATS['total_reasoning_tokens'] > 0:
-                    print(f"   │  └─ reasoning:   {SESSION_STATS['total_reasoning_tokens']:>6}")
+                print(f"   ├─ Всего:         {session['total_tokens']:>6}")
+                print(f"   ├─ Входные:       {session['input_tokens']:>6}")
+                print(f"   │  └─ из кеша:    {session['cached_tokens']:>6} ({cache_percent:.1f}% 💾)")
+                print(f"   ├─ Выходные:      {session['output_tokens']:>6}")
+                if session['reasoning_tokens'] > 0:
+                    print(f"   │  └─ reasoning:   {session['reasoning_tokens']:>6}")
                 print(f"   └─ Средне/запрос: {avg_tokens_per_request:>6.0f}")
-                print(f"\n💰 Общая стоимость: ~{total_cost:.4f} ₽")
-                if SESSION_STATS['total_cached_tokens'] > 0:
-                    saved = (SESSION_STATS['total_cached_tokens'] / 1000 * (PRICING['input'] - PRICING['cached']))
-                    print(f"   └─ Экономия на кеше: ~{saved:.4f} ₽")
+                print(f"\n💰 Общая стоимость: ~{session['cost']:.4f} ₽")
+                if session['cached_tokens'] > 0:
+                    print(f"   └─ Экономия на кеше: ~{cache_savings(session['cached_tokens']):.4f} ₽")
             print("-"*70)
             input("\nНажмите Enter для продолжения...")
 
@@ -243,45 +204,35 @@ def generate_themes(bot, technique, focus=None):
 
     # Выводим статистику токенов
     if usage:
-        print_token_usage("Генерация тем", usage)
+        print_token_usage("Генерация тем", usage, technique)
 
-    return themes
+    # Разбираем ответ один раз - дальше выбор темы берётся из списка
+    return themes, extract_themes(themes)
 
 
-def parse_theme_from_list(theme_choice: str, themes_text: str) -> str:
+def parse_theme_from_list(theme_choice: str, themes: list) -> str:
     """
     Парсит выбор темы и возвращает название темы.
 
     Args:
         theme_choice: ввод пользователя (номер или название)
-        themes_text: текст со списком тем
+        themes: темы, извлечённые из ответа агента (extract_themes)
 
     Returns:
         Название темы для генерации поста
     """
-    # Если это номер (1-10), извлекаем тему из списка
+    # Если это номер (1-10), берём тему из уже разобранного списка
     if theme_choice.isdigit():
         theme_num = int(theme_choice)
         if 1 <= theme_num <= 10:
-            # Ищем строку с номером темы (например: "3️⃣ Тема [источник]")
-            import re
-            # Паттерн: цифра с эмодзи + текст до [источник]
-            patterns = [
-                rf"{theme_num}️⃣\s+([^\[]+)",  # "3️⃣ Тема [источник]"
-                rf"{theme_num}\.\s+([^\[]+)",   # "3. Тема [источник]"
-                rf"^{theme_num}[\.)\s]+([^\[]+)", # "3) Тема [источник]"
-            ]
-
-            for pattern in patterns:
-                match = re.search(pattern, themes_text, re.MULTILINE)
-                if match:
-                    theme_name = match.group(1).strip()
-                    # Убираем лишние символы в конце
-                    theme_name = re.sub(r'\s*[\[\(].*$', '', theme_name).strip()
-                    print(f"✅ Извлечена тема #{theme_num}: '{theme_name}'")
-                    return theme_name
-
-            # Если не нашли паттерн, возвращаем номер (агент попробует разобраться)
+            theme = find_theme(themes, theme_num)
+            if theme:
+                print(f"✅ Извлечена тема #{theme_num}: '{theme.title}'")
+                if theme.sources:
+                    print(f"📚 Источники: {', '.join(theme.sources)}")
+                return theme.title
+
+            # Если темы с таким номером нет, возвращаем номер (агент попробует разобраться)
             print(f"⚠️ Не удалось извлечь тему #{theme_num} из списка, передаю номер")
             return theme_choice
 
@@ -363,28 +314,33 @@ def get_regenerate_focus():
     return focus_map.get(choice, None)
 
 
-def save_post(post, theme, technique):
-    """Сохраняет пост в файл"""
-    output_dir = Path(__file__).parent.parent / "output" / "posts"
-    output_dir.mkdir(parents=True, exist_ok=True)
+def save_post(post, theme, technique, post_length=0, usage=None):
+    """Сохраняет пост в архив (output/posts.sqlite3) и возвращает путь к архиву"""
+    archive = get_archive()
+    archive.add(post, theme, technique, post_length, usage, source='cli', user_id=CLI_USER_ID)
+    return archive.db_path
+
+
+def confirm_new_theme(theme_name, technique):
+    """Проверяет архив на недавний пост с той же темой
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    # Безопасное имя файла из темы
-    safe_theme = "".join(c if c.isalnum() or c in (' ', '_') else '_' for c in theme[:30])
-    safe_theme = safe_theme.strip().replace(' ', '_')
+    Returns:
+        bool: True - генерировать (повтора нет, режим warn/off или пользователь подтвердил)
+    """
+    if POST_ARCHIVE_DEDUP_MODE == 'off':
+        return True
 
-    filename = f"post_{technique}_{safe_theme}_{timestamp}.md"
-    filepath = output_dir / filename
+    recent = get_archive().find_recent(theme_name, POST_ARCHIVE_DEDUP_DAYS)
+    if recent is None:
+        return True
 
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(f"# {theme}\n\n")
-        f.write(f"**Техника**: {technique}\n")
-        f.write(f"**Дата**: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n")
-        f.write(f"**Длина**: {len(post)} символов\n\n")
-        f.write("---\n\n")
-        f.write(post)
+    print(f"\n⚠️ Пост на похожую тему уже был {format_age(recent['ts'])}: "
+          f"'{recent['theme']}' ({recent['technique']})")
+    if POST_ARCHIVE_DEDUP_MODE != 'block':
+        return True
 
-    return filepath
+    answer = input("Всё равно сгенерировать? (да/нет): ").strip().lower()
+    return answer in ('да', 'д', 'y', 'yes')
 
 
 def get_next_action():
@@ -419,12 +375,19 @@ def main():
 
     # Инициализация бота
     try:
+        validate()
         bot = NatriumBot()
     except ValueError as e:
         print(f"\n❌ Ошибка инициализации: {e}")
         print("💡 Проверьте файл .env (YANDEX_AGENT_ID, YANDEX_CLOUD_API_KEY, YANDEX_FOLDER_ID)")
         return
 
+    # Соединение с API устанавливается, пока пользователь выбирает технику
+    bot.warm_up()
+
+    # Сессия CLI = один запуск программы (дневные и общие агрегаты журнала сохраняются)
+    get_ledger().reset_session(CLI_USER_ID)
+
     # 1. Выбор техники промптинга
     print_separator()
     technique = get_technique_choice()
@@ -432,7 +395,7 @@ def main():
 
     # 2. Генерация тем
     print_separator()
-    themes = generate_themes(bot, technique)
+    themes, parsed_themes = generate_themes(bot, technique)
 
     # Основной цикл работы
     while True:
@@ -443,17 +406,20 @@ def main():
             # Перегенерация тем с фокусом
             focus = get_regenerate_focus()
             print_separator()
-            themes = generate_themes(bot, technique, focus)
+            themes, parsed_themes = generate_themes(bot, technique, focus)
             continue
 
         # Парсим тему (для красивого вывода и имени файла)
-        theme_name = parse_theme_from_list(theme_choice, themes)
+        theme_name = parse_theme_from_list(theme_choice, parsed_themes)
 
         # 4. Длина поста
         print_separator()
         post_length = get_post_length()
         print(f"\n✅ Длина поста: {post_length} символов")
 
+        if not confirm_new_theme(theme_name, technique):
+            continue
+
         # 5. Генерация поста
         print_separator()
         print(f"\n✍️ Генерация поста на тему: '{theme_name}'")
@@ -467,6 +433,7 @@ def main():
                 technique=technique,
                 post_length=post_length
             )
+            post = to_markdown(post)  # JSON-пост (POST_OUTPUT_FORMAT=json) → Markdown
 
             print_separator()
             print("📄 СГЕНЕРИРОВАННЫЙ ПОСТ:\n")
@@ -474,12 +441,12 @@ def main():
             print_separator()
 
             # Сохранение поста
-            filepath = save_post(post, theme_name, technique)
-            print(f"\n💾 Пост сохранён: {filepath.relative_to(Path.cwd())}")
+            filepath = save_post(post, theme_name, technique, post_length, usage)
+            print(f"\n💾 Пост сохранён в архив: {filepath.name}")
 
             # Выводим статистику токенов
             if usage:
-                print_token_usage("Генерация поста", usage)
+                print_token_usage("Генерация поста", usage, technique)
 
         except Exception as e:
             print(f"\n❌ Ошибка при генерации поста: {e}")
@@ -516,6 +483,7 @@ def main():
                         technique=technique,
                         post_length=post_length
                     )
+                    post = to_markdown(post)
 
                     print_separator()
                     print("📄 СГЕНЕРИРОВАННЫЙ ПОСТ:\n")
@@ -523,12 +491,12 @@ def main():
                     print_separator()
 
                     # Сохраняем
-                    filepath = save_post(post, theme_name, technique)
-                    print(f"\n💾 Пост сохранён: {filepath.relative_to(Path.cwd())}")
+                    filepath = save_post(post, theme_name, technique, post_length, usage)
+                    print(f"\n💾 Пост сохранён в архив: {filepath.name}")
 
                     # Выводим статистику токенов
                     if usage:
-                        print_token_usage("Генерация поста", usage)
+                        print_token_usage("Генерация поста", usage, technique)
 
                 except Exception as e:
                     print(f"\n❌ Ошибка при генерации поста: {e}")
@@ -548,7 +516,7 @@ def main():
                 # Новый список тем — выходим из внутреннего цикла
                 focus = get_regenerate_focus()
                 print_separator()
-                themes = generate_themes(bot, technique, focus)
+                themes, parsed_themes = generate_themes(bot, technique, focus)
                 break  # выход из внутреннего цикла while True
 
             elif next_action == '5':
@@ -557,6 +525,186 @@ def main():
                 # Остаёмся в внутреннем цикле — покажем меню снова
 
 
+def run_batch(args):
+    """Пакетная генерация постов по плану (CSV/JSONL) без интерактивного меню"""
+    try:
+        jobs = load_jobs(args.plan)
+    except (OSError, ValueError) as e:
+        print(f"❌ Ошибка чтения плана: {e}")
+        return 1
+
+    try:
+        validate()
+        bot = NatriumBot()
+    except ValueError as e:
+        print(f"❌ Ошибка инициализации: {e}")
+        return 1
+
+    bot.warm_up(keep_alive=False)
+    state_path = Path(args.state) if args.state else BATCH_DIR / f"{Path(args.plan).stem}.jsonl"
+    runner = BatchRunner(bot, state_path, workers=args.workers, retries=args.retries,
+                         archive=not args.no_archive)
+
+    print(f"📦 Пакетная генерация: {len(jobs)} заданий, потоков: {runner.workers}")
+    try:
+        runner.run(jobs)
+    except KeyboardInterrupt:
+        print("\n⚠️ Остановлено. Повторный запуск продолжит с невыполненных заданий")
+
+    print_separator()
+    print(runner.summary())
+    return 1 if runner.stats['failed'] else 0
+
+
+def run_prompt(args):
+    """Управление системным промптом агента: развёртывание, история, откат, отслеживание правок"""
+    try:
+        validate()
+        bot = NatriumBot()
+    except ValueError as e:
+        print(f"❌ Ошибка инициализации: {e}")
+        return 1
+
+    if args.action == "history":
+        history = bot.prompt_versions.history(limit=args.limit)
+        if not history:
+            print("⚠️ Промпт ещё не развёртывался")
+        for number, version in enumerate(history):
+            marker = "*" if number == 0 else str(number)
+            print(f"{marker:>3} {version['hash'][:8]}  {version['deployed_at']}  {version['length']:>6} симв.  {version['source']}")
+        return 0
+
+    if args.action == "rollback":
+        try:
+            status, version = bot.rollback_prompt(args.target)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        print({DEPLOYED: f"⏪ Промпт откатан к версии {version['hash'][:8]} ({version['source']})",
+               UNCHANGED: f"ℹ️ Версия {version['hash'][:8]} уже развёрнута",
+               FAILED: "❌ Ошибка отката промпта (см. лог)"}[status])
+        return 1 if status == FAILED else 0
+
+    status = bot.sync_agent_prompt(args.file, force=args.force)
+    print({DEPLOYED: f"✅ Промпт развёрнут: {bot.prompt_versions.current_hash()[:8]}",
+           UNCHANGED: "ℹ️ Промпт не изменился - обновление пропущено (--force для принудительного)",
+           FAILED: "❌ Ошибка обновления промпта (см. лог)"}[status])
+    if args.action == "watch":
+        bot.watch_prompts(debounce=args.debounce, prompt_file=args.file)
+        print(f"👀 Отслеживание {bot.prompts_dir} (debounce {args.debounce:.0f} с), Ctrl+C - выход")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            bot.prompt_watcher.stop()
+    return 1 if status == FAILED else 0
+
+
+def run_retrieval(args):
+    """Локальный сервис поиска по базе знаний: запуск, поиск (через сервис, если он запущен), статистика"""
+    from src.pdf_indexer import PDFIndexer
+
+    if args.action == "serve":
+        indexer = PDFIndexer(rerank=True if args.rerank else None)
+        try:
+            indexer.load_index(mmap=not args.no_mmap)
+        except FileNotFoundError as e:
+            print(f"❌ {e}. Постройте индекс: PDFIndexer().build_index()")
+            return 1
+        # Модель загружается до первого запроса, чтобы он не ждал несколько секунд
+        indexer.encode_queries(["прогрев"], expand=False)
+        if indexer.reranker is not None:
+            indexer.reranker.model
+        try:
+            server = RetrievalServer(indexer, args.socket, max_batch=args.batch, window=args.window_ms / 1000)
+        except RetrievalError as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"🔎 Сервис поиска: {server.socket_path} ({len(indexer.doc_chunks)} чанков), Ctrl+C - выход")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    if args.action == "stats":
+        try:
+            stats = RetrievalClient(args.socket).stats()
+        except (OSError, RetrievalError) as e:
+            print(f"❌ Сервис поиска недоступен ({e}). Запустите: python src/main.py retrieval serve")
+            return 1
+        stats.update({f"rerank.{key}": value for key, value in stats.pop('rerank', {}).items()})
+        for key, value in stats.items():
+            print(f"{key:>22}: {value:.2f}" if isinstance(value, float) else f"{key:>22}: {value}")
+        return 0
+
+    if not args.query:
+        print("❌ Укажите запрос: main.py retrieval search \"текст запроса\"")
+        return 1
+    retriever = get_retriever(args.socket)
+    try:
+        results = retriever.search(args.query, k=args.k)
+    except FileNotFoundError as e:
+        print(f"❌ {e}. Постройте индекс: PDFIndexer().build_index()")
+        return 1
+    except (OSError, RetrievalError) as e:
+        print(f"❌ Сервис поиска недоступен ({e}). Запустите: python src/main.py retrieval serve")
+        return 1
+    for number, chunk in enumerate(results, 1):
+        rerank = f", rerank {chunk['rerank_score']:.2f}" if 'rerank_score' in chunk else ""
+        print(f"{number}. [{chunk['similarity']:.3f}{rerank}] {chunk.get('source_name', '')} "
+              f"(источников: {len(chunk.get('sources') or ()) or 1})")
+        print(f"   {chunk['text'][:200].replace(chr(10), ' ')}")
+    timings = getattr(retriever, 'last_timings', None)
+    if timings:
+        print(f"\n⏱ {timings['roundtrip_ms']:.1f} мс: очередь {timings['queue_ms']:.1f}, "
+              f"модель {timings['embed_ms']:.1f}, поиск {timings['search_ms']:.1f} (пакет из {timings['batch_size']})")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Natrium Fitness — генератор постов")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="пакетная генерация постов по плану")
+    batch.add_argument("plan", help="план публикаций .csv или .jsonl (theme, technique, post_length)")
+    batch.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="одновременных запросов к API")
+    batch.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="повторов при 429/5xx/сетевых ошибках")
+    batch.add_argument("--state", help="файл результатов и состояния (по умолчанию output/batch/<план>.jsonl)")
+    batch.add_argument("--no-archive", action="store_true", help="не сохранять посты в архив")
+
+    prompt = subparsers.add_parser("prompt", help="системный промпт агента: развёртывание, история, откат")
+    prompt.add_argument("action", choices=["deploy", "history", "rollback", "watch"])
+    prompt.add_argument("target", nargs="?", default="1", help="для rollback: N версий назад или префикс хеша")
+    prompt.add_argument("--file", default="agent_system_prompt.md", help="файл промпта в prompts/")
+    prompt.add_argument("--force", action="store_true", help="развернуть даже без изменений")
+    prompt.add_argument("--debounce", type=float, default=PROMPT_WATCH_DEBOUNCE or 5.0,
+                        help="для watch: пауза после последней правки, секунды")
+    prompt.add_argument("--limit", type=int, default=10, help="для history: сколько версий показать")
+
+    retrieval = subparsers.add_parser("retrieval", help="локальный сервис поиска по базе знаний (PDF)")
+    retrieval.add_argument("action", choices=["serve", "search", "stats"])
+    retrieval.add_argument("query", nargs="?", help="для search: текст запроса")
+    retrieval.add_argument("-k", type=int, default=5, help="для search: число результатов")
+    retrieval.add_argument("--socket", help="Unix-сокет сервиса (по умолчанию RETRIEVAL_SOCKET или output/retrieval.sock)")
+    retrieval.add_argument("--rerank", action="store_true",
+                           help="для serve: переранжировать кандидатов кросс-энкодером (как RERANK_ENABLED=1)")
+    retrieval.add_argument("--batch", type=int, default=DEFAULT_MAX_BATCH, help="для serve: максимум запросов в пакете")
+    retrieval.add_argument("--window-ms", type=float, default=DEFAULT_BATCH_WINDOW * 1000,
+                           help="для serve: окно сбора пакета, мс")
+    retrieval.add_argument("--no-mmap", action="store_true", help="для serve: читать индекс в память, а не через mmap")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "batch":
+        sys.exit(run_batch(args))
+    if args.command == "prompt":
+        sys.exit(run_prompt(args))
+    if args.command == "retrieval":
+        sys.exit(run_retrieval(args))
     main()
 
@@ -1,21 +1,21 @@
-import fitz  # PyMuPDF
 from pathlib import Path
 
+from src.document_store import get_document_store
+
 def parse_bogachev(pdf_path):
     """
     Парсит PDF файл с материалами Богачева и возвращает текст.
     
+    Текст берётся из общего кеша (src/document_store.py): PDF извлекается
+    один раз, дальше читаются только первые страницы.
+    
     Args:
         pdf_path (str): Путь к PDF файлу
     
     Returns:
         str: Текст из первых 5000 символов документа
     """
-    doc = fitz.open(pdf_path)
-    text = ""
-    for page in doc:
-        text += page.get_text()
-    return text[:5000]  # для тестов промптов
+    return get_document_store().head(pdf_path, 5000)  # для тестов промптов
 
 def get_document_text(filename="Богачев - периодизация подготовки_compressed.pdf"):
     """
@@ -33,4 +33,4 @@ def get_document_text(filename="Богачев - периодизация под
     if not pdf_path.exists():
         raise FileNotFoundError(f"Файл {pdf_path} не найден")
     
-    return parse_bogachev(str(pdf_path))
\ No newline at end of file
+    return parse_bogachev(str(pdf_path))
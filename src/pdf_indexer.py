@@ -1,26 +1,52 @@
+import importlib
+import json
 import os
-import fitz  # PyMuPDF
-import faiss
-import numpy as np
+import time
 from pathlib import Path
 from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
+
+from src.document_store import get_document_store
+from src.rerank import get_reranker, rerank_enabled
+
+# Тяжёлые зависимости (PyMuPDF, FAISS, sentence-transformers) импортируются
+# при первом использовании - импорт модуля и запуск бота их не ждут
+_MODULES = {}
+
+
+def _lazy(name: str):
+    """Импортирует модуль при первом обращении"""
+    module = _MODULES.get(name)
+    if module is None:
+        module = _MODULES[name] = importlib.import_module(name)
+    return module
+
 
 class PDFIndexer:
-    def __init__(self, data_dir: str = "data", index_path: str = "data/pdf_index.faiss"):
+    def __init__(self, data_dir: str = "data", index_path: str = "data/pdf_index.faiss", rerank: bool = None):
         """
         Инициализация индексатора PDF документов.
         
         Args:
             data_dir: Путь к директории с PDF файлами
             index_path: Путь к файлу индекса FAISS
+            rerank: Переранжировать результаты поиска кросс-энкодером
+                (по умолчанию - RERANK_ENABLED, см. src/rerank.py)
         """
         self.data_dir = Path(data_dir)
         self.index_path = Path(index_path)
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')  # Легкая модель для эмбеддингов
+        self._model = None  # модель загружается при первом обращении (см. model)
         self.index = None
         self.doc_chunks = []  # Список чанков документов с метаданными
+        self.ingest_report = {}  # Что убрал этап подготовки текста при последнем build_index
+        self.reranker = get_reranker() if (rerank_enabled() if rerank is None else rerank) else None
         
+    @property
+    def model(self):
+        """Легкая модель для эмбеддингов (загрузка - несколько секунд, поэтому по требованию)"""
+        if self._model is None:
+            self._model = _lazy('sentence_transformers').SentenceTransformer('all-MiniLM-L6-v2')
+        return self._model
+
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """
         Извлекает текст из PDF файла.
@@ -31,15 +57,24 @@ class PDFIndexer:
         Returns:
             Извлеченный текст
         """
+        return "".join(self.extract_pages(pdf_path))
+
+    def extract_pages(self, pdf_path: str) -> List[str]:
+        """
+        Извлекает текст PDF файла постранично.
+        
+        Args:
+            pdf_path: Путь к PDF файлу
+            
+        Returns:
+            Текст страниц (пустой список при ошибке чтения)
+        """
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-            return text
+            # Извлекается один раз, дальше - из общего кеша текста (src/document_store.py)
+            return get_document_store().get_pages(pdf_path)
         except Exception as e:
             print(f"Ошибка при чтении PDF {pdf_path}: {e}")
-            return ""
+            return []
     
     def chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[Dict[str, Any]]:
         """
@@ -81,7 +116,7 @@ class PDFIndexer:
         
         return chunks
     
-    def create_embeddings(self, texts: List[str]) -> np.ndarray:
+    def create_embeddings(self, texts: List[str]) -> "np.ndarray":
         """
         Создает эмбеддинги для текстов с помощью SentenceTransformer.
         
@@ -94,24 +129,39 @@ class PDFIndexer:
         embeddings = self.model.encode(texts, convert_to_numpy=True)
         return embeddings
     
-    def build_index(self) -> None:
+    def build_index(self, deduplicate: bool = True) -> None:
         """
         Строит индекс FAISS из всех PDF файлов в директории data.
+        
+        Args:
+            deduplicate: Убрать колонтитулы и номера страниц, а почти одинаковые
+                чанки (MinHash/LSH по всем документам) индексировать один раз
+                со списком всех источников в поле 'sources'
         """
-        pdf_files = list(self.data_dir.glob("*.pdf"))
+        from src.ingest import strip_boilerplate, deduplicate_chunks
+        
+        pdf_files = sorted(self.data_dir.glob("*.pdf"))
         
         if not pdf_files:
             raise ValueError(f"Не найдено PDF файлов в директории {self.data_dir}")
         
         all_chunks = []
+        report = {'documents': 0, 'pages': 0, 'boilerplate_lines': 0, 'boilerplate_chars': 0}
         
         for pdf_file in pdf_files:
             print(f"Обработка файла: {pdf_file.name}")
             
             # Извлекаем текст
-            text = self.extract_text_from_pdf(str(pdf_file))
-            if not text:
+            pages = self.extract_pages(str(pdf_file))
+            if deduplicate:
+                pages, removed = strip_boilerplate(pages)
+                report['boilerplate_lines'] += removed['lines']
+                report['boilerplate_chars'] += removed['chars']
+            text = "\n".join(pages)
+            if not text.strip():
                 continue
+            report['documents'] += 1
+            report['pages'] += len(pages)
             
             # Разбиваем на чанки
             chunks = self.chunk_text(text)
@@ -125,11 +175,19 @@ class PDFIndexer:
         if not all_chunks:
             raise ValueError("Не удалось извлечь текст из PDF файлов")
         
+        report['chunks'] = len(all_chunks)
+        if deduplicate:
+            all_chunks, report['duplicate_chunks'] = deduplicate_chunks(all_chunks)
+        else:
+            report['duplicate_chunks'] = 0
+        report['unique_chunks'] = len(all_chunks)
+        
         # Создаем эмбеддинги
         texts = [chunk['text'] for chunk in all_chunks]
         embeddings = self.create_embeddings(texts)
         
         # Нормализуем эмбеддинги для косинусного сходства
+        faiss = _lazy('faiss')
         faiss.normalize_L2(embeddings)
         
         # Создаем индекс FAISS
@@ -146,11 +204,35 @@ class PDFIndexer:
             pickle.dump(all_chunks, f)
         
         self.doc_chunks = all_chunks
+        
+        # IndexFlatIP - полный перебор: размер и время поиска пропорциональны числу векторов
+        vector_bytes = dimension * embeddings.dtype.itemsize
+        report['index_bytes'] = len(all_chunks) * vector_bytes
+        report['index_bytes_saved'] = report['duplicate_chunks'] * vector_bytes
+        report['search_time_saved_share'] = report['duplicate_chunks'] / report['chunks']
+        started = time.perf_counter()
+        self.index.search(embeddings[:min(len(embeddings), 32)], 5)
+        report['search_ms'] = (time.perf_counter() - started) * 1000 / min(len(embeddings), 32)
+        self.ingest_report = report
+        with open(str(self.index_path) + "_ingest.json", 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        
         print(f"Индекс построен: {len(all_chunks)} чанков из {len(pdf_files)} PDF файлов")
+        if deduplicate:
+            print(
+                f"Подготовка текста: убрано {report['boilerplate_lines']} строк колонтитулов и номеров страниц, "
+                f"{report['duplicate_chunks']} дублирующихся чанков из {report['chunks']} - "
+                f"индекс меньше на {report['index_bytes_saved'] / 1024:.0f} КБ, "
+                f"поиск быстрее на {report['search_time_saved_share'] * 100:.0f}%"
+            )
     
-    def load_index(self) -> None:
+    def load_index(self, mmap: bool = False) -> None:
         """
         Загружает сохраненный индекс из файлов.
+        
+        Args:
+            mmap: Отобразить файл индекса в память (IO_FLAG_MMAP) вместо чтения:
+                страницы индекса общие для всех процессов и подгружаются по требованию
         """
         if not self.index_path.exists():
             raise FileNotFoundError(f"Файл индекса не найден: {self.index_path}")
@@ -159,7 +241,16 @@ class PDFIndexer:
         if not Path(index_path_chunks).exists():
             raise FileNotFoundError(f"Файл метаданных чанков не найден: {index_path_chunks}")
         
-        self.index = faiss.read_index(str(self.index_path))
+        faiss = _lazy('faiss')
+        self.index = None
+        if mmap:
+            try:
+                self.index = faiss.read_index(str(self.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except Exception as e:
+                # Не все типы индексов FAISS поддерживают mmap - читаем целиком
+                print(f"mmap индекса недоступен ({e}), индекс читается в память")
+        if self.index is None:
+            self.index = faiss.read_index(str(self.index_path))
         
         import pickle
         with open(index_path_chunks, 'rb') as f:
@@ -167,32 +258,74 @@ class PDFIndexer:
         
         print(f"Индекс загружен: {len(self.doc_chunks)} чанков")
     
-    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, k: int = 5, expand: bool = True, rerank: bool = None) -> List[Dict[str, Any]]:
         """
         Выполняет поиск по индексу.
         
         Args:
             query: Поисковый запрос
             k: Количество возвращаемых результатов
+            expand: Дополнить запрос названиями упражнений на другом языке (словарь из PDF-перевода)
+            rerank: Переранжировать top-N кандидатов кросс-энкодером (по умолчанию - как задано
+                при создании индексатора); не уложившись в бюджет времени, возвращает порядок FAISS
             
         Returns:
-            Список релевантных чанков с оценкой релевантности
+            Список релевантных чанков с оценкой релевантности (после переранжирования - ещё и 'rerank_score')
+        """
+        return self.search_batch([query], k, expand, rerank)[0]
+
+    def search_batch(self, queries: List[str], k: int = 5, expand: bool = True,
+                     rerank: bool = None) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск по нескольким запросам: один вызов модели и один поиск FAISS на все запросы.
+        
+        Returns:
+            Для каждого запроса - список чанков, как у search
+        """
+        reranker = self.reranker if rerank is None else ((self.reranker or get_reranker()) if rerank else None)
+        if reranker is None:
+            return self.search_vectors(self.encode_queries(queries, expand), k)
+        candidates = self.search_vectors(self.encode_queries(queries, expand), max(k, reranker.candidates))
+        return reranker.rerank_batch(queries, candidates, k)
+
+    def encode_queries(self, queries: List[str], expand: bool = True) -> "np.ndarray":
+        """
+        Эмбеддинги запросов, нормализованные для косинусного сходства.
+        
+        Args:
+            queries: Поисковые запросы
+            expand: Дополнить запросы названиями упражнений на другом языке (словарь из PDF-перевода)
+        """
+        if expand:
+            from src.glossary import get_glossary
+            glossary = get_glossary()
+            queries = [glossary.expand(query) for query in queries]
+        
+        embeddings = self.model.encode(list(queries), convert_to_numpy=True)
+        _lazy('faiss').normalize_L2(embeddings)
+        return embeddings
+
+    def search_vectors(self, embeddings: "np.ndarray", k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск по готовым эмбеддингам запросов (см. encode_queries).
+        
+        Returns:
+            Для каждого эмбеддинга - список чанков; в chunk['chunk_id'] - номер чанка в индексе
         """
         if self.index is None:
             self.load_index()
         
-        # Создаем эмбеддинг запроса
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        faiss.normalize_L2(query_embedding)
-        
-        # Выполняем поиск
-        similarities, indices = self.index.search(query_embedding, k)
+        similarities, indices = self.index.search(embeddings, k)
         
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx != -1:  # Проверяем валидность индекса
-                chunk = self.doc_chunks[idx].copy()
-                chunk['similarity'] = float(similarities[0][i])
-                results.append(chunk)
+        batch = []
+        for row, row_indices in enumerate(indices):
+            results = []
+            for i, idx in enumerate(row_indices):
+                if idx != -1:  # Проверяем валидность индекса
+                    chunk = self.doc_chunks[idx].copy()
+                    chunk['chunk_id'] = int(idx)
+                    chunk['similarity'] = float(similarities[row][i])
+                    results.append(chunk)
+            batch.append(results)
         
-        return results
\ No newline at end of file
+        return batch
\ No newline at end of file
@@ -0,0 +1,317 @@
+import atexit
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent / "output" / "posts.sqlite3"
+
+# Вставки копятся в памяти и пишутся одной транзакцией
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+# Длина основы слова в поисковом запросе: "гребля" → "гребл*" (найдёт "гребле", "греблей")
+STEM_LENGTH = 5
+
+_WORD_RE = re.compile(r'\w+')
+# Заголовок файлов, которые раньше писал main.save_post в output/posts
+_LEGACY_HEADER_RE = re.compile(
+    r'^# (?P<theme>.*)\n\n\*\*Техника\*\*: (?P<technique>.*)\n\*\*Дата\*\*: (?P<date>[\d.]+ [\d:]+)\n'
+    r'(?:\*\*Длина\*\*: \d+ символов\n)?\n---\n\n'
+)
+
+COLUMNS = ('ts', 'source', 'user_id', 'theme', 'technique', 'post_length', 'length', 'post',
+           'input_tokens', 'cached_tokens', 'output_tokens', 'total_tokens')
+
+
+def _detail(details, field: str) -> int:
+    if not details:
+        return 0
+    if hasattr(details, field):
+        return getattr(details, field) or 0
+    return details.get(field, 0) or 0
+
+
+def _match_query(text: str) -> str:
+    """Запрос FTS5 из свободного текста: все слова (по основе, с префиксным поиском)"""
+    terms = []
+    for word in _WORD_RE.findall((text or '').lower().replace('ё', 'е')):
+        if len(word) < 3 and not word.isdigit():
+            continue
+        terms.append(f'"{word[:STEM_LENGTH]}"*' if len(word) > STEM_LENGTH else f'"{word}"*')
+    return ' '.join(terms)
+
+
+class PostArchive:
+    """Архив сгенерированных постов (SQLite + полнотекстовый индекс FTS5)
+
+    Посты из CLI и Telegram-бота пишутся в таблицу posts вместе с темой,
+    техникой, длиной и usage. Поиск по теме и тексту идёт по индексу
+    posts_fts; если SQLite собран без FTS5, поиск откатывается на LIKE.
+    Вставки буферизуются и сбрасываются пачкой (по размеру пачки,
+    по таймеру, перед поиском и при закрытии).
+    """
+
+    def __init__(self, db_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """
+        Args:
+            db_path: путь к файлу базы
+            batch_size: сколько постов копить до записи
+            flush_interval: через сколько секунд записывать неполную пачку
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Встроенный lower() SQLite не понимает кириллицу - нужен для поиска через LIKE
+        self._conn.create_function("fold", 1, lambda value: (value or '').lower().replace('ё', 'е'), deterministic=True)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                source TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                theme TEXT NOT NULL,
+                technique TEXT NOT NULL,
+                post_length INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                post TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS posts_ts ON posts (ts);
+        """)
+        self.fts = self._create_fts()
+        self._conn.commit()
+
+        self.stats = {
+            'added': 0,       # постов передано в архив
+            'flushes': 0,     # транзакций записи
+            'searches': 0
+        }
+
+    def _create_fts(self) -> bool:
+        """Создаёт индекс FTS5 с триггерами синхронизации; False - FTS5 недоступен"""
+        try:
+            self._conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+                    theme, post, content='posts', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN
+                    INSERT INTO posts_fts (rowid, theme, post) VALUES (new.id, new.theme, new.post);
+                END;
+                CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN
+                    INSERT INTO posts_fts (posts_fts, rowid, theme, post) VALUES ('delete', old.id, old.theme, old.post);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"FTS5 недоступен, поиск по архиву через LIKE: {e}")
+            return False
+
+    def add(self, post: str, theme: str, technique: str, post_length: int = 0,
+            usage: dict = None, source: str = 'cli', user_id='', ts: float = None) -> None:
+        """Ставит пост в очередь на запись в архив"""
+        if not post:
+            return
+        usage = usage or {}
+        row = (
+            ts or time.time(), source, str(user_id), theme or '', technique or '', int(post_length or 0),
+            len(post), post,
+            usage.get('input_tokens', 0) or 0,
+            _detail(usage.get('input_tokens_details'), 'cached_tokens'),
+            usage.get('output_tokens', 0) or 0,
+            usage.get('total_tokens', 0) or 0
+        )
+        with self._lock:
+            self._pending.append(row)
+            self.stats['added'] += 1
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+            elif self._timer is None and self.flush_interval > 0:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _flush_locked(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO posts ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows
+            )
+        self.stats['flushes'] += 1
+
+    def flush(self) -> None:
+        """Записывает накопленные посты одной транзакцией"""
+        with self._lock:
+            try:
+                self._flush_locked()
+            except sqlite3.Error as e:
+                logger.error(f"Не удалось записать посты в архив: {e}")
+
+    def search(self, query: str, limit: int = 10, days: int = None, technique: str = None) -> list:
+        """Ищет посты по теме и тексту
+
+        Args:
+            query: слова для поиска (все должны встретиться, регистр и окончания не важны)
+            limit: максимум результатов
+            days: только посты за последние N дней
+            technique: только посты этой техники
+
+        Returns:
+            list: dict с id, ts, theme, technique, post_length, source, snippet (свежие и релевантные первыми)
+        """
+        match = _match_query(query)
+        if not match:
+            return []
+
+        conditions, params = [], []
+        if days:
+            conditions.append("p.ts >= ?")
+            params.append(time.time() - days * 86400)
+        if technique:
+            conditions.append("p.technique = ?")
+            params.append(technique)
+        extra = ''.join(f" AND {condition}" for condition in conditions)
+
+        if self.fts:
+            sql = (
+                "SELECT p.id, p.ts, p.theme, p.technique, p.post_length, p.source,"
+                " snippet(posts_fts, 1, '', '', '…', 12)"
+                " FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid"
+                f" WHERE posts_fts MATCH ?{extra} ORDER BY bm25(posts_fts, 5.0, 1.0), p.ts DESC LIMIT ?"
+            )
+            params = [match] + params + [limit]
+        else:
+            words = [term.strip('"*') for term in match.split()]
+            like = " AND ".join("(fold(p.theme) LIKE ? OR fold(p.post) LIKE ?)" for _ in words)
+            sql = (
+                "SELECT p.id, p.ts, p.theme, p.technique, p.post_length, p.source, substr(p.post, 1, 120)"
+                f" FROM posts p WHERE {like}{extra} ORDER BY p.ts DESC LIMIT ?"
+            )
+            params = [value for word in words for value in (f"%{word}%", f"%{word}%")] + params + [limit]
+
+        self.flush()
+        with self._lock:
+            self.stats['searches'] += 1
+            rows = self._conn.execute(sql, params).fetchall()
+        keys = ('id', 'ts', 'theme', 'technique', 'post_length', 'source', 'snippet')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def find_recent(self, theme: str, days: int, technique: str = None):
+        """Последний пост на ту же тему (все слова темы в названии) за N дней, None - не было"""
+        match = _match_query(theme)
+        if not match or days <= 0:
+            return None
+
+        since = time.time() - days * 86400
+        self.flush()
+        with self._lock:
+            if self.fts:
+                # Ищем только по колонке theme: совпадение слов в тексте поста - ещё не повтор
+                found = self._conn.execute(
+                    "SELECT p.id, p.ts, p.theme, p.technique FROM posts_fts JOIN posts p ON p.id = posts_fts.rowid"
+                    " WHERE posts_fts MATCH ? AND p.ts >= ? AND (? IS NULL OR p.technique = ?)"
+                    " ORDER BY p.ts DESC LIMIT 1",
+                    (f"theme : ({match})", since, technique, technique)
+                ).fetchone()
+            else:
+                words = [term.strip('"*') for term in match.split()]
+                found = self._conn.execute(
+                    "SELECT id, ts, theme, technique FROM posts WHERE "
+                    + " AND ".join("fold(theme) LIKE ?" for _ in words)
+                    + " AND ts >= ? AND (? IS NULL OR technique = ?) ORDER BY ts DESC LIMIT 1",
+                    [f"%{word}%" for word in words] + [since, technique, technique]
+                ).fetchone()
+        return dict(zip(('id', 'ts', 'theme', 'technique'), found)) if found else None
+
+    def get(self, post_id: int):
+        """Пост целиком по id, None - не найден"""
+        self.flush()
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT id, {', '.join(COLUMNS)} FROM posts WHERE id = ?", (post_id,)
+            ).fetchone()
+        return dict(zip(('id',) + COLUMNS, found)) if found else None
+
+    def import_markdown(self, directory) -> int:
+        """Импортирует посты-файлы из output/posts (формат прежнего save_post)
+
+        Уже импортированные файлы (та же тема и время) пропускаются.
+
+        Returns:
+            int: сколько постов добавлено
+        """
+        self.flush()
+        imported = 0
+        for path in sorted(Path(directory).rglob("*.md")):
+            text = path.read_text(encoding='utf-8')
+            header = _LEGACY_HEADER_RE.match(text)
+            if not header:
+                logger.warning(f"Пропущен файл без заголовка поста: {path}")
+                continue
+            ts = datetime.strptime(header.group('date'), '%d.%m.%Y %H:%M').timestamp()
+            with self._lock:
+                exists = self._conn.execute(
+                    "SELECT 1 FROM posts WHERE theme = ? AND ts = ?", (header.group('theme'), ts)
+                ).fetchone()
+            if exists:
+                continue
+            self.add(text[header.end():], header.group('theme'), header.group('technique'), ts=ts)
+            imported += 1
+        self.flush()
+        return imported
+
+    def count(self) -> int:
+        self.flush()
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM posts").fetchone()[0]
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+def format_age(ts: float) -> str:
+    """'сегодня' / 'вчера' / 'N дн. назад' для даты поста"""
+    days = (datetime.now().date() - datetime.fromtimestamp(ts).date()).days
+    if days <= 0:
+        return "сегодня"
+    if days == 1:
+        return "вчера"
+    return f"{days} дн. назад"
+
+
+_ARCHIVE = None
+
+
+def get_archive() -> PostArchive:
+    """Общий архив процесса (путь - POST_ARCHIVE_PATH или output/posts.sqlite3)"""
+    global _ARCHIVE
+    if _ARCHIVE is None:
+        _ARCHIVE = PostArchive(os.getenv("POST_ARCHIVE_PATH", str(DEFAULT_DB_PATH)))
+        # Неполная пачка не должна теряться при выходе
+        atexit.register(_ARCHIVE.close)
+    return _ARCHIVE
@@ -0,0 +1,251 @@
+import html
+import json
+import re
+from src.telegram_html import escape
+
+# Структура поста в режиме POST_OUTPUT_FORMAT=json
+# {поле: (тип, обязательное, мин, макс)}; для строк мин/макс - длина, для списков - число элементов
+POST_FIELDS = {
+    'emoji': (str, False, 1, 4),
+    'title': (str, True, 3, 120),
+    'lead': (str, True, 10, 600),
+    'sections': (list, True, 1, 4),
+    'cta': (str, True, 3, 300),
+    'slogan': (str, False, 1, 120),
+    'hashtags': (list, True, 1, 8),
+}
+SECTION_FIELDS = {
+    'emoji': (str, False, 1, 4),
+    'heading': (str, True, 2, 80),
+    'text': (str, False, 1, 800),
+    'facts': (list, False, 0, 5),
+}
+FACT_FIELDS = {
+    'text': (str, True, 3, 400),
+    'source': (str, True, 2, 60),
+    'url': (str, False, 8, 500),
+}
+
+# Пример для промпта (компактный JSON - одинаковый байт-в-байт между запросами)
+POST_JSON_EXAMPLE = json.dumps({
+    'emoji': '🔥',
+    'title': 'РЕГЕНЕРАЦИЯ: СЕКРЕТ ПОСТОЯННОГО ПРОГРЕССА',
+    'lead': 'Знакомо: после убойной тренировки не можешь пошевелиться два дня? Дело не в нагрузке.',
+    'sections': [
+        {
+            'emoji': '📊',
+            'heading': 'ФАКТЫ',
+            'facts': [
+                {'text': 'Сон 7-9 часов ускоряет восстановление мышц', 'source': 'PubMed',
+                 'url': 'https://pubmed.ncbi.nlm.nih.gov/12345678/'}
+            ]
+        },
+        {'emoji': '💓', 'heading': 'ПРАКТИКА', 'text': 'Как применить это в Натриуме.'},
+        {'emoji': '✅', 'heading': 'ВЫВОДЫ', 'text': 'Восстановление - часть тренировки.'}
+    ],
+    'cta': 'Приходи на тренировку в Натриум!',
+    'slogan': 'Натриум - сила в движении',
+    'hashtags': ['#натриумфитнес', '#кроссфит']
+}, ensure_ascii=False)
+
+_URL_RE = re.compile(r'^https?://\S+$')
+# Обёртка ответа в блок кода: ```язык ... ``` (агент так оформляет и обычные посты)
+_FENCE_OPEN_RE = re.compile(r'^\s*```[ \t]*(\w*)[ \t]*(?:\n|$)')
+_FENCE_CLOSE_RE = re.compile(r'\n?[ \t]*```\s*$')
+
+# Разделитель вариантов в ответе на запрос нескольких вариантов поста
+VARIANT_SEPARATOR = "===ВАРИАНТ==="
+# Строка-разделитель: "===ВАРИАНТ===" (в т.ч. "=== ВАРИАНТ 2 ===") или отдельная строка "ВАРИАНТ 2" / "**Вариант 2:**"
+_VARIANT_SPLIT_RE = re.compile(
+    r'^[ \t]*(?:={3,}[^\n]*|\**(?:ВАРИАНТ|Вариант)\s*№?\s*\d+\s*:?\**:?)[ \t]*$',
+    re.MULTILINE
+)
+
+
+class PostValidationError(ValueError):
+    """Ответ не является корректным JSON-постом"""
+
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+def strip_fences(text: str) -> str:
+    """Снимает обёртку ``` ... ``` вокруг всего ответа; текст без обёртки возвращается как есть"""
+    match = _FENCE_OPEN_RE.match(text or '')
+    if not match:
+        return text
+    return _FENCE_CLOSE_RE.sub('', text[match.end():]).strip()
+
+
+def is_structured(text: str) -> bool:
+    """JSON-ответ: блок ```json или текст (в том числе в блоке ```), который начинается с { и разбирается"""
+    match = _FENCE_OPEN_RE.match(text or '')
+    if match and match.group(1).lower() == 'json':
+        return True
+    body = strip_fences(text or '').strip()
+    if not body.startswith('{'):
+        return False
+    try:
+        return isinstance(json.loads(body[:body.rfind('}') + 1]), dict)
+    except ValueError:
+        return False
+
+
+def split_variants(text: str, count: int) -> list:
+    """Делит ответ с несколькими вариантами поста на отдельные посты
+
+    Текст перед первым разделителем (рассуждения, сводка фактов) отбрасывается,
+    если без него вариантов не меньше count.
+
+    Args:
+        text: ответ агента
+        count: запрошенное число вариантов
+
+    Returns:
+        list: тексты вариантов (ответ без разделителей - один вариант)
+    """
+    parts = _VARIANT_SPLIT_RE.split(text or '')
+    preamble, variants = parts[0].strip(), [part.strip() for part in parts[1:] if part.strip()]
+    if preamble and (len(variants) < count or not variants):
+        variants.insert(0, preamble)
+    return variants or [text]
+
+
+def _check(obj, fields: dict, path: str, errors: list) -> None:
+    if not isinstance(obj, dict):
+        errors.append(f"{path or 'пост'}: ожидался объект")
+        return
+    for name, (kind, required, low, high) in fields.items():
+        value = obj.get(name)
+        where = f"{path}.{name}" if path else name
+        if value is None or value == '':
+            if required:
+                errors.append(f"{where}: обязательное поле")
+            continue
+        if not isinstance(value, kind):
+            errors.append(f"{where}: ожидался {'текст' if kind is str else 'список'}")
+            continue
+        if not low <= len(value) <= high:
+            errors.append(f"{where}: длина {len(value)} вне [{low}, {high}]")
+
+
+def validate_post(post) -> list:
+    """Проверяет пост по POST_FIELDS/SECTION_FIELDS/FACT_FIELDS
+
+    Returns:
+        list: описания ошибок (пустой, если пост корректен)
+    """
+    errors = []
+    _check(post, POST_FIELDS, '', errors)
+    if errors and not isinstance(post, dict):
+        return errors
+
+    for i, section in enumerate(post.get('sections') or []):
+        _check(section, SECTION_FIELDS, f"sections[{i}]", errors)
+        if not isinstance(section, dict):
+            continue
+        if not section.get('text') and not section.get('facts'):
+            errors.append(f"sections[{i}]: нужен text или facts")
+        for j, fact in enumerate(section.get('facts') or []):
+            _check(fact, FACT_FIELDS, f"sections[{i}].facts[{j}]", errors)
+            if isinstance(fact, dict) and fact.get('url') and not _URL_RE.match(str(fact['url'])):
+                errors.append(f"sections[{i}].facts[{j}].url: не http(s) ссылка")
+
+    for i, tag in enumerate(post.get('hashtags') or []):
+        if not isinstance(tag, str) or not tag.strip().lstrip('#'):
+            errors.append(f"hashtags[{i}]: пустой хештег")
+    return errors
+
+
+def parse_post(text: str) -> dict:
+    """Извлекает и проверяет JSON-пост из ответа агента
+
+    Допускает обёртку ```json ... ``` и текст вокруг объекта.
+
+    Raises:
+        PostValidationError: JSON не найден, не разбирается или не проходит проверку
+    """
+    text = text or ''
+    start = text.find('{')
+    end = text.rfind('}')
+    if start < 0 or end <= start:
+        raise PostValidationError(["JSON-объект не найден"])
+    try:
+        post = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise PostValidationError([f"некорректный JSON: {e}"])
+
+    errors = validate_post(post)
+    if errors:
+        raise PostValidationError(errors)
+    return post
+
+
+def _hashtags(post: dict) -> str:
+    tags = []
+    for tag in post['hashtags']:
+        tag = tag.strip().replace(' ', '')
+        tags.append(tag if tag.startswith('#') else f"#{tag}")
+    return ' '.join(tags)
+
+
+def _heading(emoji: str, text: str) -> str:
+    return f"{emoji} {text}" if emoji else text
+
+
+def render_telegram_html(post: dict) -> str:
+    """Детерминированный рендер проверенного поста в HTML для Telegram"""
+    blocks = [
+        _heading(post.get('emoji'), f"<b>{escape(post['title'])}</b>"),
+        escape(post['lead'])
+    ]
+
+    for section in post['sections']:
+        lines = [_heading(section.get('emoji'), f"<b>{escape(section['heading'])}</b>")]
+        if section.get('text'):
+            lines.append(escape(section['text']))
+        for fact in section.get('facts') or []:
+            source = escape(fact['source'])
+            if fact.get('url'):
+                source = f'<a href="{html.escape(fact["url"], quote=True)}">{source}</a>'
+            lines.append(f"• {escape(fact['text'])} ({source})")
+        blocks.append('\n'.join(lines))
+
+    ending = escape(post['cta'])
+    if post.get('slogan'):
+        ending += f"\n{escape(post['slogan'])}"
+    blocks.append(ending)
+    blocks.append(escape(_hashtags(post)))
+    return '\n\n'.join(blocks)
+
+
+def render_markdown(post: dict) -> str:
+    """Рендер проверенного поста в Markdown (CLI и сохранение в output/posts)"""
+    blocks = [_heading(post.get('emoji'), f"**{post['title']}**"), post['lead']]
+
+    for section in post['sections']:
+        lines = [_heading(section.get('emoji'), f"**{section['heading']}**")]
+        if section.get('text'):
+            lines.append(section['text'])
+        for fact in section.get('facts') or []:
+            source = f"[{fact['source']}]({fact['url']})" if fact.get('url') else fact['source']
+            lines.append(f"• {fact['text']} ({source})")
+        blocks.append('\n'.join(lines))
+
+    ending = post['cta']
+    if post.get('slogan'):
+        ending += f"\n{post['slogan']}"
+    blocks.append(ending)
+    blocks.append(_hashtags(post))
+    return '\n\n'.join(blocks)
+
+
+def to_markdown(text: str) -> str:
+    """JSON-пост → Markdown; свободный текст возвращается без изменений"""
+    if not is_structured(text):
+        return text
+    try:
+        return render_markdown(parse_post(text))
+    except PostValidationError:
+        return text
@@ -0,0 +1,247 @@
+import json
+import re
+
+from src.post_schema import is_structured, parse_post, render_markdown, strip_fences, PostValidationError
+
+# Допустимое отклонение длины поста от POST_LENGTH (доля от цели)
+LENGTH_MIN_RATIO = 0.5
+LENGTH_MAX_RATIO = 1.5
+
+MIN_TITLE_LETTERS = 5
+# Доля заглавных среди букв заголовка (допускает "CrossFit", "Concept2" в CAPS-заголовке)
+TITLE_UPPER_SHARE = 0.8
+MIN_LEAD_LENGTH = 20
+MIN_SECTIONS = 1
+
+# Хештеги, которые добавляются локально, если агент их забыл
+DEFAULT_HASHTAGS = "#натриумфитнес #кроссфит"
+
+# Коды проблем → способ исправления:
+#   header  - короткий запрос только заголовка и лида
+#   shorten - запрос на сокращение готового поста
+#   local   - исправление без обращения к API
+#   None    - исправить можно только полной генерацией (недостающие факты и источники)
+ISSUE_TITLE = 'title'
+ISSUE_LEAD = 'lead'
+ISSUE_SECTIONS = 'sections'
+ISSUE_SOURCES = 'sources'
+ISSUE_HASHTAGS = 'hashtags'
+ISSUE_TOO_LONG = 'too_long'
+ISSUE_TOO_SHORT = 'too_short'
+ISSUE_FORMAT = 'format'
+
+REPAIRS = {
+    ISSUE_TITLE: 'header',
+    ISSUE_LEAD: 'header',
+    ISSUE_TOO_LONG: 'shorten',
+    ISSUE_HASHTAGS: 'local',
+    ISSUE_SECTIONS: None,
+    ISSUE_SOURCES: None,
+    ISSUE_TOO_SHORT: None,
+    ISSUE_FORMAT: None,
+}
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+_HEADING_RE = re.compile(r'^[^\w*]*\*\*[^*\n]+\*\*:?\s*$')
+_BULLET_RE = re.compile(r'^\s*(?:[•\-–*]|\d+[.)])\s')
+_HASHTAG_RE = re.compile(r'(?<![\w#])#\w+')
+_HEADER_LINE_RE = re.compile(r'^[\s*]*(ЗАГОЛОВОК|ЛИД)[\s*]*:[\s*]*(.*)$', re.IGNORECASE)
+_TITLE_PARTS_RE = re.compile(r'^([^\w"«]*)(.*)$')
+_LINK_RE = re.compile(r'\[([^\]]+)\]\(https?://[^)\s]+\)')
+_SOURCE_RE = re.compile(
+    r'\((?:[^()\n]*?(?:ВОЗ|WHO|PubMed|CrossFit|Исследовани|исследовани|https?://)[^()\n]*)\)'
+    r'|\[[^\]]+\]\(https?://'
+    r'|\([^()\n]{2,60}\)[.;]?\s*$',
+    re.MULTILINE
+)
+
+
+def _strip_markup(text: str) -> str:
+    return _LINK_RE.sub(r'\1', text).replace('**', '').replace('__', '')
+
+
+def visible_length(text: str) -> int:
+    """Длина поста, как её видит читатель (без ** и адресов ссылок)"""
+    return len(_strip_markup(text).strip())
+
+
+def _paragraphs(text: str) -> list:
+    """Абзацы поста; первая строка всегда отдельный абзац (заголовок без пустой строки после него)"""
+    paragraphs = [p.strip() for p in _PARAGRAPH_RE.split(text.strip()) if p.strip()]
+    if paragraphs and '\n' in paragraphs[0]:
+        first, rest = paragraphs[0].split('\n', 1)
+        paragraphs[0:1] = [first.strip(), rest.strip()]
+    return paragraphs
+
+
+def title_problem(title: str) -> str:
+    """Причина, по которой строка не годится в заголовок (None - годится)"""
+    plain = _strip_markup(title).strip()
+    letters = [c for c in plain if c.isalpha()]
+    if len(letters) < MIN_TITLE_LETTERS:
+        return "нет заголовка"
+    if sum(c.isupper() for c in letters) / len(letters) < TITLE_UPPER_SHARE:
+        return "заголовок не в CAPS"
+    if plain.endswith(':'):
+        return "пост начинается с заголовка секции, а не с заголовка темы"
+    return None
+
+
+def lead_problem(lead: str) -> str:
+    """Причина, по которой абзац не годится в лид (None - годится)"""
+    if not lead:
+        return "нет лида"
+    first_line = lead.splitlines()[0]
+    if _HEADING_RE.match(first_line) or _BULLET_RE.match(first_line):
+        return "после заголовка сразу идут секции - нет лида"
+    if first_line.lstrip().startswith('#'):
+        return "нет лида"
+    if len(_strip_markup(lead)) < MIN_LEAD_LENGTH:
+        return "лид слишком короткий"
+    return None
+
+
+def _check_length(length: int, post_length: int, issues: dict) -> None:
+    if not post_length:
+        return
+    if length > post_length * LENGTH_MAX_RATIO:
+        issues[ISSUE_TOO_LONG] = f"длина {length} при цели {post_length}"
+    elif length < post_length * LENGTH_MIN_RATIO:
+        issues[ISSUE_TOO_SHORT] = f"длина {length} при цели {post_length}"
+
+
+def check_text_post(text: str, post_length: int = 0) -> dict:
+    """Проверяет пост в свободном формате (Markdown)
+
+    Returns:
+        dict: {код проблемы: описание}, пустой - пост корректен
+    """
+    issues = {}
+    paragraphs = _paragraphs(text or '')
+    if not paragraphs:
+        return {ISSUE_FORMAT: "пустой пост"}
+
+    problem = title_problem(paragraphs[0])
+    if problem:
+        issues[ISSUE_TITLE] = problem
+    # Без заголовка первый абзац - кандидат в лид
+    lead = paragraphs[0] if problem and not _HEADING_RE.match(paragraphs[0]) \
+        else (paragraphs[1] if len(paragraphs) > 1 else '')
+    problem = lead_problem(lead)
+    if problem:
+        issues[ISSUE_LEAD] = problem
+
+    body_lines = [line for p in paragraphs[1:] for line in p.splitlines()]
+    sections = sum(1 for line in body_lines if _HEADING_RE.match(line))
+    if sections < MIN_SECTIONS:
+        issues[ISSUE_SECTIONS] = f"секций: {sections}"
+    if not _SOURCE_RE.search(text):
+        issues[ISSUE_SOURCES] = "нет ни одного источника"
+    if not _HASHTAG_RE.search(paragraphs[-1]):
+        issues[ISSUE_HASHTAGS] = "нет хештегов в конце поста"
+    _check_length(visible_length(text), post_length, issues)
+    return issues
+
+
+def check_structured_post(text: str, post_length: int = 0) -> dict:
+    """Проверяет JSON-пост (POST_OUTPUT_FORMAT=json): схема, CAPS-заголовок, длина"""
+    try:
+        post = parse_post(text)
+    except PostValidationError as e:
+        return {ISSUE_FORMAT: str(e)}
+    issues = {}
+    problem = title_problem(post['title'])
+    if problem:
+        issues[ISSUE_TITLE] = problem
+    problem = lead_problem(post['lead'])
+    if problem:
+        issues[ISSUE_LEAD] = problem
+    _check_length(visible_length(render_markdown(post)), post_length, issues)
+    return issues
+
+
+def check_post(text: str, post_length: int = 0) -> dict:
+    """Локальная проверка поста без обращения к API
+
+    Args:
+        text: ответ агента (свободный текст или JSON)
+        post_length: целевая длина (0 - не проверять)
+
+    Returns:
+        dict: {код проблемы: описание}, пустой - пост корректен
+    """
+    if is_structured(text):
+        return check_structured_post(text, post_length)
+    return check_text_post(strip_fences(text), post_length)
+
+
+def repairs_for(issues: dict) -> set:
+    """Способы исправления найденных проблем (без None - их исправит только полная генерация)"""
+    return {REPAIRS[code] for code in issues if REPAIRS.get(code)}
+
+
+def add_hashtags(text: str) -> str:
+    """Локальное исправление: дописывает хештеги по умолчанию"""
+    return f"{strip_fences(text).rstrip()}\n\n{DEFAULT_HASHTAGS}"
+
+
+def _split_title(value: str) -> tuple:
+    """Заголовок из ответа агента → (эмодзи, текст без разметки)"""
+    match = _TITLE_PARTS_RE.match(value.replace('**', '').strip())
+    return match.group(1).strip(), match.group(2).strip()
+
+
+def parse_header(answer: str) -> tuple:
+    """Разбирает ответ на запрос исправления заголовка и лида
+
+    Returns:
+        tuple: (title, lead) - title в формате поста "эмодзи **ТЕКСТ**", None для отсутствующей части
+    """
+    title = lead = None
+    for line in (answer or '').splitlines():
+        match = _HEADER_LINE_RE.match(line)
+        if not match:
+            continue
+        label, value = match.group(1).upper(), match.group(2).strip()
+        if label == 'ЗАГОЛОВОК':
+            emoji, text = _split_title(value)
+            title = f"{emoji} **{text}**".strip() if text else None
+        else:
+            lead = _strip_markup(value).strip() or None
+    return title, lead
+
+
+def apply_header(text: str, issues: dict, title: str = None, lead: str = None) -> str:
+    """Вставляет исправленные заголовок и лид в пост, не трогая остальной текст"""
+    if is_structured(text):
+        post = parse_post(text)
+        if title and ISSUE_TITLE in issues:
+            emoji, post['title'] = _split_title(title)
+            post['emoji'] = post.get('emoji') or emoji
+        if lead and ISSUE_LEAD in issues:
+            post['lead'] = lead
+        return json.dumps(post, ensure_ascii=False)
+
+    paragraphs = [p.strip() for p in _PARAGRAPH_RE.split(strip_fences(text).strip()) if p.strip()]
+    if title and ISSUE_TITLE in issues:
+        first_line, _, rest = paragraphs[0].partition('\n')
+        # Жирная строка-попытка заголовка (не в CAPS) заменяется, заголовок секции остаётся
+        if _HEADING_RE.match(first_line) and not _strip_markup(first_line).strip().endswith(':'):
+            paragraphs[0:1] = [title] + ([rest.strip()] if rest.strip() else [])
+        else:
+            paragraphs.insert(0, title)
+    if lead and ISSUE_LEAD in issues:
+        first_line, _, rest = paragraphs[0].partition('\n')
+        paragraphs[0:1] = [first_line] + ([rest.strip()] if rest.strip() else [])
+        # Слабый лид заменяется; если после заголовка сразу секция, список или хештеги - лид вставляется
+        if len(paragraphs) > 1 and not _is_section_start(paragraphs[1]):
+            paragraphs[1] = lead
+        else:
+            paragraphs.insert(1, lead)
+    return '\n\n'.join(paragraphs)
+
+
+def _is_section_start(paragraph: str) -> bool:
+    """Абзац начинается с заголовка секции, пункта списка или хештегов - это не лид"""
+    first_line = paragraph.splitlines()[0]
+    return bool(_HEADING_RE.match(first_line) or _BULLET_RE.match(first_line) or first_line.lstrip().startswith('#'))
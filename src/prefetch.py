@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from src.prompt_layout import get_cached_tokens
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class PostPrefetcher:
+    """Спекулятивная предгенерация постов для первых N тем
+
+    Типичный сценарий: темы появились → пользователь выбирает одну из первых
+    тем → нажимает len_500. Сразу после парсинга тем запускаем генерацию постов
+    для top-N тем с длиной по умолчанию в фоновых потоках, а нажатие
+    пользователя подхватывает уже готовый (или ещё выполняющийся) результат.
+    """
+
+    def __init__(self, natrium_bot, top_n: int = 0, post_length: int = 500,
+                 max_workers: int = 3, ttl: int = 1800, ledger=None):
+        """
+        Args:
+            natrium_bot: экземпляр NatriumBot
+            top_n: сколько первых тем предгенерировать (0 - режим выключен)
+            post_length: длина поста по умолчанию для предгенерации
+            max_workers: максимум одновременных фоновых запросов
+            ttl: время жизни неиспользованного результата в секундах
+            ledger: UsageLedger для записи неиспользованных вызовов (опционально)
+        """
+        self.natrium_bot = natrium_bot
+        self.top_n = top_n
+        self.post_length = post_length
+        self.ttl = ttl
+        self.ledger = ledger
+        self._executor = None
+        if top_n > 0:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+
+        self._lock = threading.Lock()
+        # {user_id: {(theme, technique, post_length): (Future, created_at)}}
+        self._pending = {}
+
+        self.stats = {
+            'started': 0,          # запущено спекулятивных генераций
+            'hits': 0,             # нажатие пользователя попало в предгенерацию
+            'misses': 0,           # пост длины по умолчанию пришлось генерировать с нуля
+            'other_length': 0,     # нажатие с другой длиной - предгенерации быть не могло, в hit rate не входит
+            'cancelled': 0,        # отменено до начала выполнения (без затрат)
+            'wasted': 0,           # выполнено, но не использовано
+            'used_tokens': 0,      # токены использованных предгенераций
+            'wasted_input_tokens': 0,
+            'wasted_cached_tokens': 0,
+            'wasted_output_tokens': 0,
+            'wasted_tokens': 0     # лишний расход токенов
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def start(self, user_id: int, themes: list, technique: str) -> None:
+        """Запускает предгенерацию постов для первых top_n тем пользователя
+
+        Предыдущие спекулятивные запросы пользователя отменяются.
+        """
+        if not self.enabled:
+            return
+
+        self.discard(user_id)
+        self._evict_expired()
+
+        jobs = {}
+        now = time.monotonic()
+        for theme in themes[:self.top_n]:
+            key = (theme, technique, self.post_length)
+            future = self._executor.submit(self._generate, user_id, theme, technique)
+            jobs[key] = (future, now)
+
+        with self._lock:
+            self._pending[user_id] = jobs
+            self.stats['started'] += len(jobs)
+
+        logger.info(f"prefetch: user {user_id} - запущено {len(jobs)} спекулятивных генераций")
+
+    def _generate(self, user_id: int, theme: str, technique: str) -> tuple:
+        """Фоновая генерация - отдельная трасса (потоки пула не наследуют контекст обработчика)"""
+        with span("prefetch.generate_post", user_id=user_id, theme=theme, technique=technique):
+            return self.natrium_bot.generate_post(theme=theme, technique=technique, post_length=self.post_length)
+
+    def take(self, user_id: int, theme: str, technique: str, post_length: int):
+        """Забирает предгенерацию для выбранной темы
+
+        Returns:
+            Future с результатом generate_post или None, если предгенерации нет
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            if post_length != self.post_length:
+                self.stats['other_length'] += 1
+                return None
+            jobs = self._pending.get(user_id, {})
+            entry = jobs.pop((theme, technique, post_length), None)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+
+        future, _ = entry
+        future.add_done_callback(self._account_used)
+        logger.info(f"prefetch: user {user_id} - попадание для темы '{theme}' ({post_length})")
+        return future
+
+    def discard(self, user_id: int) -> None:
+        """Отменяет или помечает как неиспользованные все предгенерации пользователя"""
+        with self._lock:
+            jobs = self._pending.pop(user_id, {})
+
+        for key, (future, _) in jobs.items():
+            self._drop(user_id, key, future)
+
+        if jobs:
+            logger.info(f"prefetch: user {user_id} - сброшено {len(jobs)} предгенераций")
+
+    def _evict_expired(self) -> None:
+        """Удаляет предгенерации, которые никто не забрал за ttl секунд"""
+        deadline = time.monotonic() - self.ttl
+        expired = []
+        with self._lock:
+            for user_id, jobs in self._pending.items():
+                for key, (future, created_at) in list(jobs.items()):
+                    if created_at < deadline:
+                        expired.append((user_id, key, jobs.pop(key)[0]))
+            for user_id in [uid for uid, jobs in self._pending.items() if not jobs]:
+                del self._pending[user_id]
+
+        for user_id, key, future in expired:
+            self._drop(user_id, key, future)
+
+    def _drop(self, user_id: int, key: tuple, future) -> None:
+        if future.cancel():
+            with self._lock:
+                self.stats['cancelled'] += 1
+        else:
+            # Запрос уже выполняется - токены будут потрачены, учитываем их по завершении
+            _, technique, _ = key
+            future.add_done_callback(partial(self._account_wasted, user_id, technique))
+
+    def _account_used(self, future) -> None:
+        usage = self._usage_of(future)
+        with self._lock:
+            self.stats['used_tokens'] += usage.get('total_tokens', 0)
+
+    def _account_wasted(self, user_id: int, technique: str, future) -> None:
+        usage = self._usage_of(future)
+        if usage and self.ledger:
+            self.ledger.record(user_id, "Предгенерация (не использована)", technique, usage)
+        with self._lock:
+            self.stats['wasted'] += 1
+            self.stats['wasted_input_tokens'] += usage.get('input_tokens', 0)
+            self.stats['wasted_cached_tokens'] += get_cached_tokens(usage)
+            self.stats['wasted_output_tokens'] += usage.get('output_tokens', 0)
+            self.stats['wasted_tokens'] += usage.get('total_tokens', 0)
+
+    @staticmethod
+    def _usage_of(future) -> dict:
+        if future.cancelled() or future.exception() is not None:
+            return {}
+        _, usage = future.result()
+        return usage or {}
+
+    def hit_rate(self) -> float:
+        """Доля попаданий среди нажатий с длиной по умолчанию"""
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.0
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
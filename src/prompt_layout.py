@@ -0,0 +1,72 @@
+import hashlib
+import threading
+
+
+class PromptTemplate:
+    """Шаблон input_text: статический префикс + динамический суффикс
+
+    Префикс не содержит подстановок и одинаков байт-в-байт между запросами,
+    поэтому попадает в префиксный кеш API (cached_tokens). Все значения
+    конкретного запроса (тема, длина, предыдущие темы) подставляются только
+    в суффикс, который всегда идёт в самом конце.
+    """
+
+    def __init__(self, name: str, prefix: str, suffix: str):
+        """
+        Args:
+            name: имя шаблона (ключ статистики кеша)
+            prefix: статическая часть без подстановок
+            suffix: динамическая часть в формате str.format
+        """
+        self.name = name
+        self.prefix = prefix.strip()
+        self.suffix = suffix.strip()
+        self.prefix_hash = hashlib.sha256(self.prefix.encode('utf-8')).hexdigest()[:12]
+
+    def render(self, **values) -> str:
+        """Собирает input_text: префикс, затем суффикс с подставленными значениями"""
+        return f"{self.prefix}\n\n{self.suffix.format(**values)}"
+
+
+def get_cached_tokens(usage: dict) -> int:
+    """Достаёт cached_tokens из usage (input_tokens_details может быть dict или объектом)"""
+    input_details = (usage or {}).get('input_tokens_details')
+    if not input_details:
+        return 0
+    if hasattr(input_details, 'cached_tokens'):
+        return input_details.cached_tokens or 0
+    return input_details.get('cached_tokens', 0) or 0
+
+
+class PromptCacheStats:
+    """Доля входных токенов из кеша по каждому шаблону запроса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # {template: {'requests': 0, 'input_tokens': 0, 'cached_tokens': 0}}
+
+    def record(self, template: str, usage: dict) -> None:
+        if not usage:
+            return
+        with self._lock:
+            stats = self._stats.setdefault(template, {'requests': 0, 'input_tokens': 0, 'cached_tokens': 0})
+            stats['requests'] += 1
+            stats['input_tokens'] += usage.get('input_tokens', 0)
+            stats['cached_tokens'] += get_cached_tokens(usage)
+
+    def ratio(self, template: str) -> float:
+        with self._lock:
+            stats = self._stats.get(template)
+            if not stats or not stats['input_tokens']:
+                return 0.0
+            return stats['cached_tokens'] / stats['input_tokens']
+
+    def report(self) -> dict:
+        """Returns:
+            dict: {template: {'requests', 'input_tokens', 'cached_tokens', 'ratio'}}
+        """
+        with self._lock:
+            return {
+                name: dict(stats, ratio=(stats['cached_tokens'] / stats['input_tokens']) if stats['input_tokens'] else 0.0)
+                for name, stats in self._stats.items()
+            }
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Результаты развёртывания промпта
+DEPLOYED = 'deployed'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+# Сколько развёртываний хранить в истории (тексты промптов без ссылок из истории удаляются)
+MAX_HISTORY = 50
+
+
+def prompt_hash(text: str) -> str:
+    """Хеш содержимого промпта (различия в переводах строк CRLF/LF не считаются изменением)"""
+    normalized = text.replace('\r\n', '\n').strip()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class PromptVersions:
+    """История развёртываний системного промпта агента
+
+    Каждое развёртывание - запись {hash, source, length, deployed_at} в
+    versions.json; тексты хранятся рядом по хешу (<hash[:16]>.md), поэтому
+    откат к любой версии из истории не требует исходного файла.
+    Последняя запись - промпт, который сейчас стоит у агента.
+    """
+
+    def __init__(self, store_dir: str):
+        """
+        Args:
+            store_dir: каталог истории (versions.json и тексты версий)
+        """
+        self.store_dir = Path(store_dir)
+        self.index_path = self.store_dir / "versions.json"
+        self._lock = threading.Lock()
+        self._history = []
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._history = json.load(f)
+        except Exception as e:
+            logger.warning(f"PromptVersions: не удалось загрузить историю {self.index_path}: {e}")
+
+    def _save(self) -> None:
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._history, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(self.index_path)
+
+    def _text_path(self, digest: str) -> Path:
+        return self.store_dir / f"{digest[:16]}.md"
+
+    @property
+    def current(self) -> dict:
+        """Запись о текущем промпте агента (None - развёртываний ещё не было)"""
+        with self._lock:
+            return dict(self._history[-1]) if self._history else None
+
+    def current_hash(self) -> str:
+        current = self.current
+        return current['hash'] if current else None
+
+    def record(self, text: str, source: str) -> dict:
+        """Сохраняет развёрнутый промпт как текущую версию
+
+        Args:
+            text: текст промпта
+            source: откуда развёрнут (имя файла, rollback:<hash>, watch:<файл>)
+
+        Returns:
+            dict: запись о версии
+        """
+        digest = prompt_hash(text)
+        entry = {
+            'hash': digest,
+            'source': source,
+            'length': len(text),
+            'deployed_at': datetime.now().isoformat(timespec='seconds')
+        }
+        with self._lock:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            text_path = self._text_path(digest)
+            if not text_path.exists():
+                text_path.write_text(text, encoding='utf-8')
+            self._history.append(entry)
+            dropped = self._history[:-MAX_HISTORY]
+            self._history = self._history[-MAX_HISTORY:]
+            kept = {item['hash'] for item in self._history}
+            for item in dropped:
+                if item['hash'] not in kept:
+                    self._text_path(item['hash']).unlink(missing_ok=True)
+            self._save()
+        return dict(entry)
+
+    def history(self, limit: int = 10) -> list:
+        """Последние развёртывания, новые первыми"""
+        with self._lock:
+            return [dict(item) for item in reversed(self._history[-limit:])]
+
+    def resolve(self, target) -> dict:
+        """Находит версию для отката
+
+        Args:
+            target: число N - версия на N развёртываний раньше текущей (1 - предыдущая),
+                    строка - префикс хеша (не короче 4 символов)
+
+        Returns:
+            dict: запись о версии с текстом в поле 'text'
+
+        Raises:
+            ValueError: версия не найдена или её текст недоступен
+        """
+        with self._lock:
+            history = list(self._history)
+        target = str(target).strip()
+
+        if target.isdigit() and len(target) < 4:
+            steps = int(target)
+            if steps < 1 or steps >= len(history):
+                raise ValueError(f"В истории {len(history)} развёртываний - отката на {steps} назад нет")
+            entry = history[-1 - steps]
+        else:
+            if len(target) < 4:
+                raise ValueError("Префикс хеша должен быть не короче 4 символов")
+            matches = {item['hash']: item for item in history if item['hash'].startswith(target.lower())}
+            if not matches:
+                raise ValueError(f"Версия {target} не найдена в истории")
+            if len(matches) > 1:
+                raise ValueError(f"Префикс {target} неоднозначен: {len(matches)} версий")
+            entry = next(iter(matches.values()))
+
+        text_path = self._text_path(entry['hash'])
+        if not text_path.exists():
+            raise ValueError(f"Текст версии {entry['hash'][:8]} не сохранён")
+        return dict(entry, text=text_path.read_text(encoding='utf-8'))
+
+
+class PromptWatcher:
+    """Отслеживание изменений промптов с отложенным развёртыванием
+
+    Раз в interval секунд сравнивает mtime и размер файлов по маске; после
+    изменения ждёт debounce секунд без новых правок (сохранение редактором,
+    git pull с несколькими файлами) и только тогда вызывает on_change.
+    """
+
+    def __init__(self, directory, on_change, debounce: float = 5.0,
+                 pattern: str = "*.md", interval: float = 1.0):
+        """
+        Args:
+            directory: каталог промптов
+            on_change: функция без аргументов, вызывается после затихания правок
+            debounce: пауза после последнего изменения, секунды
+            pattern: маска отслеживаемых файлов
+            interval: период опроса, секунды
+        """
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.debounce = debounce
+        self.pattern = pattern
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'changes': 0,    # замеченных изменений файлов
+            'triggers': 0,   # вызовов on_change (после debounce)
+            'errors': 0
+        }
+
+    def _snapshot(self) -> dict:
+        snapshot = {}
+        for path in self.directory.glob(self.pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # файл удалён между glob и stat
+            snapshot[path.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="prompt-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"👀 Отслеживание промптов в {self.directory} (debounce {self.debounce:.0f} с)")
+
+    def _run(self) -> None:
+        seen = self._snapshot()
+        changed_at = None
+        while not self._stop.wait(self.interval):
+            snapshot = self._snapshot()
+            if snapshot != seen:
+                seen = snapshot
+                changed_at = time.monotonic()
+                self.stats['changes'] += 1
+                continue
+            if changed_at is not None and time.monotonic() - changed_at >= self.debounce:
+                changed_at = None
+                self.stats['triggers'] += 1
+                try:
+                    self.on_change()
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Ошибка развёртывания изменённого промпта: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
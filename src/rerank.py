@@ -0,0 +1,234 @@
+import hashlib
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Многоязычный кросс-энкодер (обучен на mMARCO, в т.ч. русский), ~120M параметров - работает на CPU
+DEFAULT_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+# Сколько кандидатов первого этапа (FAISS) переоценивать
+DEFAULT_CANDIDATES = 50
+# Жёсткий бюджет этапа переранжирования на запрос: не успели - порядок первого этапа
+DEFAULT_BUDGET_MS = 300
+DEFAULT_BATCH_SIZE = 16
+# Пар в первом пакете, пока скорость модели неизвестна: холодный вызов не съедает весь бюджет
+PROBE_PAIRS = 2
+DEFAULT_CACHE_SIZE = 20000
+MAX_LENGTH = 512
+LATENCY_WINDOW = 1000
+
+
+class Reranker:
+    """Второй этап поиска: переоценка кандидатов FAISS кросс-энкодером
+
+    Би-энкодер all-MiniLM-L6-v2 обучен на английском и на русских текстах
+    тренировок часто промахивается; кросс-энкодер читает запрос и чанк вместе
+    и точнее, но дороже - поэтому переоцениваются только top-N кандидатов,
+    пакетами, в пределах бюджета времени. Если оценить всех кандидатов в
+    бюджет не удалось или бюджет превышен, запрос остаётся в порядке первого этапа. Оценки пар (запрос, чанк)
+    кешируются (LRU), поэтому повторный запрос переранжируется без модели -
+    в том числе тот, что в прошлый раз не уложился в бюджет.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, candidates: int = DEFAULT_CANDIDATES,
+                 budget_ms: float = DEFAULT_BUDGET_MS, batch_size: int = DEFAULT_BATCH_SIZE,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        Args:
+            model_name: модель CrossEncoder (sentence-transformers)
+            candidates: сколько кандидатов первого этапа переоценивать
+            budget_ms: бюджет переранжирования на запрос, мс (0 - без ограничения)
+            batch_size: пар (запрос, чанк) на вызов модели
+            cache_size: сколько оценок пар хранить
+        """
+        self.model_name = model_name
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # {ключ пары: оценка}
+        self._pair_s = None  # скользящая оценка времени модели на одну пару, с
+        self._warmed = False  # первый вызов модели (прогрев) в оценку скорости не идёт
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+        self.stats = {
+            'queries': 0,
+            'reranked': 0,
+            'fallbacks': 0,
+            'pairs_scored': 0,
+            'cache_hits': 0
+        }
+
+    @property
+    def model(self):
+        """Кросс-энкодер (загружается при первом обращении, на CPU; одновременные первые запросы ждут одну загрузку)"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=MAX_LENGTH, device='cpu')
+        return self._model
+
+    def _key(self, query: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{self.model_name}\0{query}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def _cached(self, key: bytes):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _remember(self, keys: list, scores) -> None:
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = float(score)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, candidates: list, k: int) -> list:
+        """Переранжирует кандидатов одного запроса (см. rerank_batch)"""
+        return self.rerank_batch([query], [candidates], k)[0]
+
+    def rerank_batch(self, queries: list, candidates: list, k: int) -> list:
+        """Переранжирует кандидатов нескольких запросов, пары всех запросов идут в модель общими пакетами
+
+        Бюджет отсчитывается от начала вызова и общий для всех запросов (они
+        пришли одновременно). Пока скорость модели неизвестна, первый пакет -
+        PROBE_PAIRS пар; дальше пакет укорачивается до числа пар, которое по
+        текущей оценке успеет до конца бюджета. Запросы, у которых остались
+        неоценённые пары, возвращаются в порядке первого этапа; если бюджет всё
+        же превышен (пакет оказался медленнее оценки) - все запросы вызова.
+
+        Args:
+            queries: исходные запросы (без расширения синонимами)
+            candidates: для каждого запроса - чанки первого этапа, по убыванию similarity
+            k: сколько результатов вернуть на запрос
+
+        Returns:
+            list: для каждого запроса - top-k чанков; у переранжированных есть 'rerank_score'
+        """
+        model = self.model  # загрузка модели - вне бюджета
+        started = time.perf_counter()
+        deadline = started + self.budget_ms / 1000 if self.budget_ms else None
+
+        scores = [{} for _ in queries]
+        pending = []  # (номер запроса, позиция кандидата, ключ, пара)
+        cache_hits = 0
+        for number, (query, chunks) in enumerate(zip(queries, candidates)):
+            for position, chunk in enumerate(chunks):
+                key = self._key(query, chunk['text'])
+                score = self._cached(key)
+                if score is None:
+                    pending.append((number, position, key, (query, chunk['text'])))
+                else:
+                    scores[number][position] = score
+                    cache_hits += 1
+
+        # Сначала запросы, которым осталось меньше всего пар: в бюджет уложится как можно больше запросов
+        missing = [len(chunks) - len(found) for chunks, found in zip(candidates, scores)]
+        pending.sort(key=lambda item: missing[item[0]])
+
+        scored, over_budget = 0, False
+        while scored < len(pending):
+            size = self.batch_size
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    over_budget = True
+                    break
+                # Пакет укорачивается до того, что успеет до конца бюджета
+                size = min(size, PROBE_PAIRS if self._pair_s is None else int(remaining / self._pair_s))
+                if size <= 0:
+                    break
+            batch = pending[scored:scored + size]
+            batch_started = time.perf_counter()
+            with self._model_lock:
+                batch_scores = model.predict([pair for *_, pair in batch], batch_size=len(batch),
+                                             show_progress_bar=False)
+            pair_s = (time.perf_counter() - batch_started) / len(batch)
+            if not self._warmed:
+                self._warmed = True
+            else:
+                self._pair_s = pair_s if self._pair_s is None else 0.8 * self._pair_s + 0.2 * pair_s
+            self._remember([key for _, _, key, _ in batch], batch_scores)
+            for (number, position, _, _), score in zip(batch, batch_scores):
+                scores[number][position] = float(score)
+            scored += len(batch)
+
+        # Оценки уже в кеше и пригодятся повтору, но ответ позже бюджета - порядок первого этапа
+        if deadline is not None and time.perf_counter() > deadline:
+            over_budget = True
+
+        results, reranked = [], 0
+        for number, chunks in enumerate(candidates):
+            if over_budget or len(scores[number]) < len(chunks):
+                results.append(chunks[:k])
+                continue
+            order = sorted(range(len(chunks)), key=lambda position: -scores[number][position])
+            ranked = []
+            for position in order[:k]:
+                chunk = dict(chunks[position])
+                chunk['rerank_score'] = scores[number][position]
+                chunk['first_stage_rank'] = position
+                ranked.append(chunk)
+            results.append(ranked)
+            reranked += 1
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats['queries'] += len(queries)
+            self.stats['reranked'] += reranked
+            self.stats['fallbacks'] += len(queries) - reranked
+            self.stats['pairs_scored'] += scored
+            self.stats['cache_hits'] += cache_hits
+            self._latencies.extend([elapsed_ms] * len(queries))
+        if reranked < len(queries):
+            logger.info(f"Rerank: {len(queries) - reranked} из {len(queries)} запросов не уложились "
+                        f"в {self.budget_ms:.0f} мс - порядок первого этапа")
+        return results
+
+    def report(self) -> dict:
+        """Счётчики и задержка этапа переранжирования (мс) по последним LATENCY_WINDOW запросам"""
+        with self._lock:
+            report = dict(self.stats)
+            latencies = sorted(self._latencies)
+            report['cache_size'] = len(self._cache)
+        report['fallback_rate'] = report['fallbacks'] / report['queries'] if report['queries'] else 0.0
+        if latencies:
+            report['latency_p50_ms'] = statistics.median(latencies)
+            report['latency_p95_ms'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return report
+
+
+def rerank_enabled() -> bool:
+    """Включено ли переранжирование по умолчанию (RERANK_ENABLED)"""
+    return os.getenv("RERANK_ENABLED", "0") == "1"
+
+
+_RERANKER = None
+_RERANKER_LOCK = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """Общий кросс-энкодер (модель - RERANK_MODEL, параметры - RERANK_CANDIDATES, RERANK_BUDGET_MS, RERANK_BATCH)"""
+    global _RERANKER
+    if _RERANKER is None:
+        with _RERANKER_LOCK:
+            if _RERANKER is None:
+                _RERANKER = Reranker(
+                    model_name=os.getenv("RERANK_MODEL", DEFAULT_MODEL),
+                    candidates=int(os.getenv("RERANK_CANDIDATES", str(DEFAULT_CANDIDATES))),
+                    budget_ms=float(os.getenv("RERANK_BUDGET_MS", str(DEFAULT_BUDGET_MS))),
+                    batch_size=int(os.getenv("RERANK_BATCH", str(DEFAULT_BATCH_SIZE)))
+                )
+    return _RERANKER
@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from src.semantic_cache import normalize_theme
+
+logger = logging.getLogger(__name__)
+
+# Бриф короче - скорее всего агент не нашёл фактов; такой не кешируем
+MIN_BRIEF_CHARS = 200
+
+
+class ResearchBriefCache:
+    """TTL-кеш брифов исследования по темам (этап 1 двухэтапной генерации)
+
+    Бриф - компактная сводка проверенных фактов с источниками. Он не зависит
+    от длины и техники поста, поэтому один бриф обслуживает генерации на 500,
+    700 и 1000 символов, «Новый пост на эту тему» и варианты. Ключ - тема после
+    normalize_theme. Кеш сохраняется в JSON-файл (переживает перезапуск бота и
+    переиспользуется пакетной генерацией).
+    """
+
+    def __init__(self, path: str = None, ttl: int = 3 * 86400, max_entries: int = 300):
+        """
+        Args:
+            path: JSON-файл кеша (None - только в памяти)
+            ttl: время жизни брифа в секундах
+            max_entries: максимум брифов (при переполнении вытесняется самый старый)
+        """
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = {}  # {normalized_theme: {'theme', 'brief', 'usage', 'latency_s', 'created_at', 'hits'}}
+        self._load()
+
+        self.stats = {
+            'lookups': 0,
+            'hits': 0,
+            'stored': 0,
+            'evicted': 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _evict_expired(self) -> None:
+        deadline = time.time() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry['created_at'] < deadline]:
+            del self._entries[key]
+            self.stats['evicted'] += 1
+
+    def get(self, theme: str) -> dict:
+        """Бриф темы или None (нет, устарел или кеш выключен)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self.stats['lookups'] += 1
+            self._evict_expired()
+            entry = self._entries.get(normalize_theme(theme))
+            if entry is None:
+                return None
+            entry['hits'] += 1
+            self.stats['hits'] += 1
+            return dict(entry)
+
+    def peek(self, theme: str) -> dict:
+        """Бриф темы без учёта в статистике (для оценки стоимости до запроса)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(normalize_theme(theme))
+            if entry is None or entry['created_at'] < time.time() - self.ttl:
+                return None
+            return dict(entry)
+
+    def put(self, theme: str, brief: str, usage: dict = None, latency_s: float = 0.0) -> bool:
+        """Сохраняет бриф; False - бриф слишком короткий и не сохранён"""
+        if not self.enabled or len((brief or '').strip()) < MIN_BRIEF_CHARS:
+            return False
+        with self._lock:
+            self._evict_expired()
+            key = normalize_theme(theme)
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                oldest = min(self._entries, key=lambda k: self._entries[k]['created_at'])
+                del self._entries[oldest]
+                self.stats['evicted'] += 1
+            self._entries[key] = {
+                'theme': theme,
+                'brief': brief.strip(),
+                'usage': usage or {},
+                'latency_s': round(latency_s, 3),
+                'created_at': time.time(),
+                'hits': 0
+            }
+            self.stats['stored'] += 1
+        self._save()
+        return True
+
+    def hit_rate(self) -> float:
+        return self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            logger.info(f"Research cache: загружено {len(self._entries)} брифов из {self.path}")
+        except Exception as e:
+            logger.warning(f"Research cache: не удалось загрузить {self.path}: {e}")
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        # Запись - по одному потоку за раз, снимок берётся внутри: более старый не перезапишет более новый
+        with self._save_lock:
+            with self._lock:
+                entries = {k: dict(v) for k, v in self._entries.items()}
+            self._write(entries)
+
+    def _write(self, entries: dict) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f'.tmp{os.getpid()}')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=2)
+            tmp_path.replace(self.path)
+        except Exception as e:
+            logger.warning(f"Research cache: не удалось сохранить {self.path}: {e}")
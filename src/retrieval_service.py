@@ -0,0 +1,464 @@
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import stat
+import statistics
+import struct
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = Path(__file__).parent.parent / "output" / "retrieval.sock"
+
+# Запросы, пришедшие в течение окна, объединяются в один вызов модели и FAISS
+DEFAULT_MAX_BATCH = 32
+DEFAULT_BATCH_WINDOW = 0.002
+MAX_K = 100
+LATENCY_WINDOW = 1000
+
+# =====================================================================
+# Бинарный протокол: кадр = uint32 BE длина + тело
+# Запрос:  "NR", версия, операция, k (uint16), число запросов (uint16), запросы (uint32 длина + UTF-8)
+# Ответ:   "NR", версия, статус (0 - ok, 1 - ошибка), далее
+#          SEARCH: число запросов (uint16), размер пакета (uint16), очередь/модель/поиск (3 × float32, мс),
+#                  для каждого запроса: число результатов (uint16), результаты
+#                  (chunk_id uint32, сходство float32, text uint32+UTF-8,
+#                   остальные поля чанка - source, start_pos, sources, rerank_score... - uint32+JSON)
+#          STATS, PING и ошибка: uint32 длина + UTF-8 (JSON или текст ошибки)
+# =====================================================================
+
+MAGIC = b"NR"
+VERSION = 2
+OP_SEARCH = 1
+OP_STATS = 2
+OP_PING = 3
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_FRAME = struct.Struct(">I")
+_REQUEST = struct.Struct(">2sBBHH")
+_RESPONSE = struct.Struct(">2sBB")
+_SEARCH_HEADER = struct.Struct(">HHfff")
+_RESULT = struct.Struct(">If")
+# Поля чанка, которые идут в бинарной части результата, а не в JSON
+_RESULT_FIELDS = ('chunk_id', 'similarity', 'text')
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+
+
+class RetrievalError(Exception):
+    """Ошибка сервиса поиска (передаётся клиенту в ответе)"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        block = sock.recv(size - len(data))
+        if not block:
+            raise ConnectionError("Соединение закрыто")
+        data.extend(block)
+    return bytes(data)
+
+
+def send_frame(sock: socket.socket, body: bytes) -> None:
+    sock.sendall(_FRAME.pack(len(body)) + body)
+
+
+def recv_frame(sock: socket.socket) -> bytes:
+    (size,) = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    return _recv_exact(sock, size)
+
+
+def _pack_str(text: str, length: struct.Struct = _U32) -> bytes:
+    data = (text or "").encode('utf-8')
+    return length.pack(len(data)) + data
+
+
+def _unpack_str(body: bytes, offset: int, length: struct.Struct = _U32) -> tuple:
+    (size,) = length.unpack_from(body, offset)
+    offset += length.size
+    return body[offset:offset + size].decode('utf-8'), offset + size
+
+
+def encode_request(op: int, queries: list = (), k: int = 5) -> bytes:
+    return _REQUEST.pack(MAGIC, VERSION, op, k, len(queries)) + b"".join(_pack_str(query) for query in queries)
+
+
+def decode_request(body: bytes) -> tuple:
+    """Тело запроса → (op, k, queries)"""
+    magic, version, op, k, count = _REQUEST.unpack_from(body, 0)
+    if magic != MAGIC or version != VERSION:
+        raise RetrievalError(f"Неподдерживаемый протокол: {magic!r} v{version}")
+    offset, queries = _REQUEST.size, []
+    for _ in range(count):
+        query, offset = _unpack_str(body, offset)
+        queries.append(query)
+    return op, k, queries
+
+
+def encode_text_response(text: str, status: int = STATUS_OK) -> bytes:
+    return _RESPONSE.pack(MAGIC, VERSION, status) + _pack_str(text)
+
+
+def encode_search_response(results: list, timings: dict) -> bytes:
+    parts = [
+        _RESPONSE.pack(MAGIC, VERSION, STATUS_OK),
+        _SEARCH_HEADER.pack(len(results), timings['batch_size'],
+                            timings['queue_ms'], timings['embed_ms'], timings['search_ms'])
+    ]
+    for chunks in results:
+        parts.append(_U16.pack(len(chunks)))
+        for chunk in chunks:
+            meta = {key: value for key, value in chunk.items() if key not in _RESULT_FIELDS}
+            parts.append(_RESULT.pack(chunk['chunk_id'], chunk['similarity']))
+            parts.append(_pack_str(chunk['text']))
+            parts.append(_pack_str(json.dumps(meta, ensure_ascii=False, default=str)))
+    return b"".join(parts)
+
+
+def decode_response(body: bytes, op: int = OP_SEARCH) -> tuple:
+    """Тело ответа на операцию op → (results, timings) для поиска или (text, None) для STATS/PING
+
+    Raises:
+        RetrievalError: сервис вернул ошибку
+    """
+    magic, version, status = _RESPONSE.unpack_from(body, 0)
+    if magic != MAGIC or version != VERSION:
+        raise RetrievalError(f"Неподдерживаемый протокол: {magic!r} v{version}")
+    offset = _RESPONSE.size
+    if status != STATUS_OK:
+        raise RetrievalError(_unpack_str(body, offset)[0])
+    if op != OP_SEARCH:
+        return _unpack_str(body, offset)[0], None
+
+    count, batch_size, queue_ms, embed_ms, search_ms = _SEARCH_HEADER.unpack_from(body, offset)
+    offset += _SEARCH_HEADER.size
+    results = []
+    for _ in range(count):
+        (found,) = _U16.unpack_from(body, offset)
+        offset += _U16.size
+        chunks = []
+        for _ in range(found):
+            chunk_id, similarity = _RESULT.unpack_from(body, offset)
+            offset += _RESULT.size
+            text, offset = _unpack_str(body, offset)
+            meta, offset = _unpack_str(body, offset)
+            chunk = json.loads(meta)
+            chunk.update(text=text, chunk_id=chunk_id, similarity=similarity)
+            chunks.append(chunk)
+        results.append(chunks)
+    timings = {'batch_size': batch_size, 'queue_ms': queue_ms, 'embed_ms': embed_ms, 'search_ms': search_ms}
+    return results, timings
+
+
+class _Pending:
+    __slots__ = ('queries', 'k', 'enqueued', 'done', 'results', 'timings', 'error')
+
+    def __init__(self, queries: list, k: int):
+        self.queries = queries
+        self.k = k
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.timings = None
+        self.error = None
+
+
+class QueryBatcher:
+    """Объединяет запросы всех соединений в пакеты: один encode и один index.search на пакет
+
+    Модель и индекс вызываются только из потока пакетов - параллельные
+    читатели не конкурируют за модель, а пакет из N запросов стоит почти как один.
+    """
+
+    def __init__(self, indexer, max_batch: int = DEFAULT_MAX_BATCH, window: float = DEFAULT_BATCH_WINDOW):
+        """
+        Args:
+            indexer: PDFIndexer (или объект с encode_queries и search_vectors)
+            max_batch: максимум запросов в пакете
+            window: сколько ждать остальные запросы пакета после первого, секунды
+        """
+        self.indexer = indexer
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # мс на запрос: очередь + модель + поиск
+
+        self.stats = {
+            'requests': 0,
+            'queries': 0,
+            'batches': 0,
+            'errors': 0
+        }
+        self._thread = threading.Thread(target=self._run, name="retrieval-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, queries: list, k: int) -> tuple:
+        """Ставит запросы в очередь и ждёт результат
+
+        Returns:
+            tuple: (results, timings) - см. encode_search_response
+        """
+        pending = _Pending(queries, k)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results, pending.timings
+
+    def _collect(self) -> list:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch, size = [first], len(first.queries)
+        deadline = time.perf_counter() + self.window
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._stop.set()
+                break
+            batch.append(item)
+            size += len(item.queries)
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            batch = self._collect()
+            if not batch:
+                break
+            started = time.perf_counter()
+            queries = [query for item in batch for query in item.queries]
+            try:
+                embeddings = self.indexer.encode_queries(queries)
+                embedded = time.perf_counter()
+                k = max(item.k for item in batch)
+                reranker = getattr(self.indexer, 'reranker', None)
+                found = self.indexer.search_vectors(embeddings, max(k, reranker.candidates) if reranker else k)
+                if reranker is not None:
+                    found = reranker.rerank_batch(queries, found, k)
+            except Exception as e:
+                logger.error(f"Ошибка поиска: {e}")
+                for item in batch:
+                    item.error = RetrievalError(str(e))
+                    item.done.set()
+                with self._lock:
+                    self.stats['errors'] += len(batch)
+                continue
+            finished = time.perf_counter()
+
+            embed_ms, search_ms = (embedded - started) * 1000, (finished - embedded) * 1000
+            position = 0
+            with self._lock:
+                self.stats['batches'] += 1
+                for item in batch:
+                    item.results = [chunks[:item.k] for chunks in found[position:position + len(item.queries)]]
+                    position += len(item.queries)
+                    queue_ms = (started - item.enqueued) * 1000
+                    item.timings = {'batch_size': len(queries), 'queue_ms': queue_ms,
+                                    'embed_ms': embed_ms, 'search_ms': search_ms}
+                    self.stats['requests'] += 1
+                    self.stats['queries'] += len(item.queries)
+                    per_query = queue_ms + (embed_ms + search_ms) / len(queries)
+                    self._latencies.extend([per_query] * len(item.queries))
+            for item in batch:
+                item.done.set()
+
+    def report(self) -> dict:
+        """Счётчики и задержка на запрос (мс) по последним LATENCY_WINDOW запросам"""
+        with self._lock:
+            report = dict(self.stats)
+            latencies = sorted(self._latencies)
+        report['avg_batch'] = report['queries'] / report['batches'] if report['batches'] else 0.0
+        if latencies:
+            report['latency_p50_ms'] = statistics.median(latencies)
+            report['latency_p95_ms'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return report
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._queue.put(None)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Соединение клиента: запросы читаются по одному, соединение живёт до закрытия клиентом"""
+
+    def handle(self) -> None:
+        server = self.server
+        while True:
+            try:
+                body = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                op, k, queries = decode_request(body)
+                if op == OP_SEARCH:
+                    if not 1 <= k <= MAX_K:
+                        raise RetrievalError(f"k должно быть от 1 до {MAX_K}")
+                    if not queries or not all(query.strip() for query in queries):
+                        raise RetrievalError("Пустой запрос")
+                    response = encode_search_response(*server.batcher.submit(queries, k))
+                elif op == OP_STATS:
+                    response = encode_text_response(json.dumps(server.report(), ensure_ascii=False))
+                elif op == OP_PING:
+                    response = encode_text_response("pong")
+                else:
+                    raise RetrievalError(f"Неизвестная операция {op}")
+            except Exception as e:
+                response = encode_text_response(str(e), STATUS_ERROR)
+            try:
+                send_frame(self.request, response)
+            except OSError:
+                return
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Локальный сервис поиска по базе знаний: один прогретый PDFIndexer на все процессы
+
+    Бот, CLI и пакетные задания подключаются по Unix-сокету (RetrievalClient)
+    вместо загрузки своей копии модели эмбеддингов и индекса FAISS. Каждое
+    соединение обслуживается своим потоком, поиск выполняет QueryBatcher.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, indexer, socket_path=None, max_batch: int = DEFAULT_MAX_BATCH,
+                 window: float = DEFAULT_BATCH_WINDOW):
+        self.socket_path = Path(socket_path or os.getenv("RETRIEVAL_SOCKET", str(DEFAULT_SOCKET_PATH)))
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._remove_stale_socket()
+        self.indexer = indexer
+        self.batcher = QueryBatcher(indexer, max_batch=max_batch, window=window)
+        self.started_at = time.time()
+        super().__init__(str(self.socket_path), _Handler)
+        os.chmod(self.socket_path, 0o660)
+
+    def _remove_stale_socket(self) -> None:
+        """Удаляет сокет завершившегося процесса
+
+        Raises:
+            RetrievalError: по пути уже отвечает сервис или лежит не сокет
+        """
+        try:
+            mode = self.socket_path.lstat().st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise RetrievalError(f"{self.socket_path} существует и не является сокетом")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        probe.settimeout(1.0)
+        try:
+            probe.connect(str(self.socket_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.socket_path.unlink(missing_ok=True)
+            return
+        finally:
+            probe.close()
+        raise RetrievalError(f"Сервис поиска уже запущен: {self.socket_path}")
+
+    def report(self) -> dict:
+        report = self.batcher.report()
+        report['chunks'] = len(getattr(self.indexer, 'doc_chunks', ()) or ())
+        reranker = getattr(self.indexer, 'reranker', None)
+        if reranker is not None:
+            report['rerank'] = reranker.report()
+        report['uptime_s'] = round(time.time() - self.started_at)
+        return report
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.batcher.stop()
+        self.socket_path.unlink(missing_ok=True)
+
+
+class RetrievalClient:
+    """Клиент сервиса поиска; соединение своё у каждого потока и переиспользуется между запросами"""
+
+    def __init__(self, socket_path=None, timeout: float = 30.0):
+        self.socket_path = str(socket_path or os.getenv("RETRIEVAL_SOCKET", str(DEFAULT_SOCKET_PATH)))
+        self.timeout = timeout
+        self._local = threading.local()
+        self.last_timings = None  # задержки последнего search_batch (очередь, модель, поиск, полный цикл)
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op: int, queries: list = (), k: int = 5) -> tuple:
+        body = encode_request(op, queries, k)
+        for attempt in range(2):
+            try:
+                sock = self._socket()
+                send_frame(sock, body)
+                return decode_response(recv_frame(sock), op)
+            except (OSError, struct.error, UnicodeDecodeError) as e:
+                # После таймаута или оборванного кадра в сокете может остаться чужой ответ -
+                # соединение закрывается при любой ошибке, следующий вызов откроет новое
+                self.close()
+                # Сервис перезапускался - одно переподключение (таймаут не повторяется)
+                if attempt or not isinstance(e, ConnectionError):
+                    raise
+
+    def search_batch(self, queries: list, k: int = 5) -> list:
+        """Поиск по нескольким запросам одним обращением
+
+        Returns:
+            list: для каждого запроса - чанки с теми же полями, что у PDFIndexer.search_batch
+                (text, source, source_name, start_pos, sources, rerank_score...), и latency_ms
+        """
+        started = time.perf_counter()
+        results, timings = self._call(OP_SEARCH, list(queries), k)
+        latency_ms = (time.perf_counter() - started) * 1000 / max(len(queries), 1)
+        for chunks in results:
+            for chunk in chunks:
+                chunk['latency_ms'] = latency_ms
+        self.last_timings = dict(timings, roundtrip_ms=latency_ms * max(len(queries), 1))
+        return results
+
+    def search(self, query: str, k: int = 5) -> list:
+        return self.search_batch([query], k)[0]
+
+    def stats(self) -> dict:
+        return json.loads(self._call(OP_STATS)[0])
+
+    def ping(self) -> bool:
+        try:
+            return self._call(OP_PING)[0] == "pong"
+        except (OSError, RetrievalError):
+            return False
+
+    def close(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+def get_retriever(socket_path=None):
+    """Поиск по базе знаний: клиент сервиса, если он запущен, иначе PDFIndexer в этом процессе
+
+    У обоих вариантов есть search(query, k) и search_batch(queries, k) с одинаковыми
+    полями чанков; у клиента дополнительно latency_ms и last_timings.
+    """
+    client = RetrievalClient(socket_path)
+    if Path(client.socket_path).exists() and client.ping():
+        return client
+    logger.info("Сервис поиска не запущен - индекс загружается в этом процессе")
+    from src.pdf_indexer import PDFIndexer
+    return PDFIndexer()
@@ -0,0 +1,323 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from src.prompt_layout import get_cached_tokens
+from src.usage_ledger import calc_cost
+
+logger = logging.getLogger(__name__)
+
+# Операции, для которых задаются маршруты
+OPERATIONS = ('themes', 'post', 'research', 'write', 'repair')
+
+# Поля маршрута, которые можно задать в конфиге
+ROUTE_FIELDS = ('agent_id', 'model', 'tools', 'max_output_tokens')
+
+DEFAULT_ROUTE = '*'
+
+# Телеметрия пишется на диск не чаще раза в столько секунд (и при выходе)
+TELEMETRY_FLUSH_INTERVAL = 5.0
+
+
+def operation_for(variables: dict) -> str:
+    """Операция запроса по переменным промпта (та же классификация, что у TokenEstimator.model_key)"""
+    variables = variables or {}
+    if variables.get('TECHNIQUE') == 'repair':
+        return 'repair'
+    stage = variables.get('STAGE')
+    if stage in ('research', 'write'):
+        return stage
+    return 'post' if variables.get('USER_THEME') else 'themes'
+
+
+@dataclass(frozen=True)
+class Route:
+    """Куда отправлять запрос операции
+
+    agent_id - агент Yandex AI Studio (None - YANDEX_AGENT_ID). Если задан model,
+    запрос идёт напрямую в модель (без агента): системный промпт передаётся в
+    instructions, инструменты - из tools. У агента набор инструментов задан в
+    его настройках и в запросе не меняется - для операций без поиска заводится
+    отдельный агент без инструментов.
+    """
+    key: str = DEFAULT_ROUTE
+    agent_id: str = None
+    model: str = None
+    tools: tuple = ()
+    max_output_tokens: int = None
+
+    @property
+    def target(self) -> str:
+        """Подпись цели маршрута для телеметрии"""
+        if self.model:
+            return f"model:{self.model}"
+        return f"agent:{self.agent_id[:8]}" if self.agent_id else "agent"
+
+    def tool_specs(self) -> list:
+        """tools в формате API: строка "web_search" → {"type": "web_search"}, словари - как есть"""
+        return [{"type": tool} if isinstance(tool, str) else dict(tool) for tool in self.tools]
+
+
+def _route_from_config(key: str, config: dict) -> Route:
+    unknown = set(config) - set(ROUTE_FIELDS)
+    if unknown:
+        raise ValueError(f"Маршрут {key}: неизвестные поля {', '.join(sorted(unknown))}")
+    tools = config.get('tools') or ()
+    if tools and not config.get('model'):
+        raise ValueError(f"Маршрут {key}: tools задаются только вместе с model - инструменты агента настраиваются у агента")
+    max_output_tokens = config.get('max_output_tokens')
+    return Route(
+        key=key,
+        agent_id=config.get('agent_id') or None,
+        model=config.get('model') or None,
+        tools=tuple(tools),
+        max_output_tokens=int(max_output_tokens) if max_output_tokens else None
+    )
+
+
+def _route_to_config(route: Route) -> dict:
+    config = {'agent_id': route.agent_id, 'model': route.model,
+              'tools': list(route.tools), 'max_output_tokens': route.max_output_tokens}
+    return {field: value for field, value in config.items() if value}
+
+
+class RoutingTable:
+    """Таблица маршрутов: операция × техника → агент или модель, инструменты, лимит токенов
+
+    Ключи в JSON-конфиге: "operation:technique" (post:zero_shot), "operation"
+    (themes) и "*" - по умолчанию. Выбирается самый точный ключ; без подходящего
+    маршрута запрос идёт в агент по умолчанию. Файл перечитывается при
+    изменении (правка без перезапуска бота), set_route/remove_route меняют
+    маршрут во время работы и сохраняют конфиг.
+    """
+
+    def __init__(self, path: str = None, default_agent_id: str = None):
+        """
+        Args:
+            path: JSON-файл маршрутов (None - только в памяти)
+            default_agent_id: агент для маршрутов без agent_id и model
+        """
+        self.path = Path(path) if path else None
+        self.default_agent_id = default_agent_id
+        self._lock = threading.Lock()
+        self._routes = {}   # {key: Route}
+        self._mtime = None
+        self._reload()
+
+    def _reload(self) -> None:
+        """Перечитывает конфиг, если файл изменился (при ошибке остаются прежние маршруты)"""
+        if not self.path:
+            return
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            return  # файла нет - все запросы идут в агент по умолчанию
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            routes = {key: _route_from_config(key, value) for key, value in config.items()}
+        except Exception as e:
+            logger.warning(f"Routing: не удалось загрузить {self.path}: {e}")
+            self._mtime = mtime  # не перечитываем битый файл на каждом запросе
+            return
+        self._routes = routes
+        self._mtime = mtime
+        logger.info(f"🧭 Routing: загружено маршрутов: {len(routes)} из {self.path}")
+
+    def resolve(self, operation: str, technique: str = "") -> Route:
+        """Маршрут запроса: operation:technique → operation → * → агент по умолчанию"""
+        with self._lock:
+            self._reload()
+            for key in (f"{operation}:{technique}", operation, DEFAULT_ROUTE):
+                route = self._routes.get(key)
+                if route is not None:
+                    break
+            else:
+                route = Route(key=operation)
+        if not route.agent_id and not route.model:
+            route = replace(route, agent_id=self.default_agent_id)
+        return route
+
+    def routes(self) -> dict:
+        """Заданные маршруты {key: Route}"""
+        with self._lock:
+            self._reload()
+            return dict(self._routes)
+
+    def set_route(self, key: str, **fields) -> Route:
+        """Задаёт маршрут во время работы и сохраняет конфиг
+
+        Args:
+            key: "operation", "operation:technique" или "*"
+            **fields: agent_id, model, tools, max_output_tokens
+
+        Raises:
+            ValueError: неизвестная операция или поле
+        """
+        operation = key.split(':', 1)[0]
+        if key != DEFAULT_ROUTE and operation not in OPERATIONS:
+            raise ValueError(f"Неизвестная операция {operation} (доступны: {', '.join(OPERATIONS)})")
+        route = _route_from_config(key, fields)
+        with self._lock:
+            self._reload()
+            self._routes[key] = route
+            self._save()
+        logger.info(f"🧭 Маршрут {key} → {route.target}")
+        return route
+
+    def remove_route(self, key: str) -> bool:
+        """Удаляет маршрут (запросы пойдут по более общему); False - маршрута не было"""
+        with self._lock:
+            self._reload()
+            if self._routes.pop(key, None) is None:
+                return False
+            self._save()
+        return True
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Вызывается под self._lock; свой временный файл у каждого процесса
+            tmp_path = self.path.with_suffix(f'.tmp{os.getpid()}')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({key: _route_to_config(route) for key, route in self._routes.items()},
+                          f, ensure_ascii=False, indent=2)
+            tmp_path.replace(self.path)
+            self._mtime = self.path.stat().st_mtime_ns
+        except Exception as e:
+            logger.warning(f"Routing: не удалось сохранить {self.path}: {e}")
+
+
+class RouteTelemetry:
+    """Телеметрия по маршрутам: время ответа, токены, стоимость, доля постов без замечаний валидатора
+
+    Счётчики ведутся по паре (операция:техника, цель маршрута), поэтому после
+    переноса операции на другую модель старые и новые цифры не смешиваются и
+    их можно сравнить.
+    """
+
+    def __init__(self, path: str = None, flush_interval: float = TELEMETRY_FLUSH_INTERVAL):
+        """
+        Args:
+            path: JSON-файл телеметрии (None - только в памяти)
+            flush_interval: как часто сохранять счётчики на диск, секунды (0 - после каждого вызова)
+        """
+        self.path = Path(path) if path else None
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._routes = {}  # {"operation:technique → target": counters}
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+        if self.path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _key(name: str, target: str) -> str:
+        return f"{name} → {target}"
+
+    def _counters(self, name: str, target: str) -> dict:
+        return self._routes.setdefault(self._key(name, target), {
+            'calls': 0,
+            'errors': 0,
+            'latency_s': 0.0,
+            'max_latency_s': 0.0,
+            'input_tokens': 0,
+            'cached_tokens': 0,
+            'output_tokens': 0,
+            'cost': 0.0,
+            'checked': 0,     # постов проверено валидатором
+            'passed': 0       # из них без замечаний
+        })
+
+    def record_call(self, name: str, target: str, latency_s: float, usage: dict = None, error: bool = False) -> None:
+        """Учитывает вызов API по маршруту"""
+        usage = usage or {}
+        input_tokens = usage.get('input_tokens', 0) or 0
+        cached_tokens = get_cached_tokens(usage)
+        output_tokens = usage.get('output_tokens', 0) or 0
+        with self._lock:
+            counters = self._counters(name, target)
+            counters['calls'] += 1
+            counters['errors'] += 1 if error else 0
+            counters['latency_s'] += latency_s
+            counters['max_latency_s'] = max(counters['max_latency_s'], latency_s)
+            counters['input_tokens'] += input_tokens
+            counters['cached_tokens'] += cached_tokens
+            counters['output_tokens'] += output_tokens
+            counters['cost'] += calc_cost(input_tokens, cached_tokens, output_tokens)
+            self._dirty = True
+        self._maybe_flush()
+
+    def record_validation(self, name: str, target: str, passed: bool) -> None:
+        """Учитывает результат локальной проверки поста, сгенерированного по маршруту"""
+        with self._lock:
+            counters = self._counters(name, target)
+            counters['checked'] += 1
+            counters['passed'] += 1 if passed else 0
+            self._dirty = True
+        self._maybe_flush()
+
+    def report(self) -> list:
+        """Сводка по маршрутам: средние на вызов и доля валидных постов, по убыванию числа вызовов"""
+        with self._lock:
+            routes = {k: dict(v) for k, v in self._routes.items()}
+        report = []
+        for key, counters in routes.items():
+            calls = counters['calls']
+            report.append(dict(
+                counters,
+                route=key,
+                avg_latency_s=counters['latency_s'] / calls if calls else 0.0,
+                avg_tokens=(counters['input_tokens'] + counters['output_tokens']) / calls if calls else 0.0,
+                avg_cost=counters['cost'] / calls if calls else 0.0,
+                error_rate=counters['errors'] / calls if calls else 0.0,
+                pass_rate=counters['passed'] / counters['checked'] if counters['checked'] else None
+            ))
+        return sorted(report, key=lambda item: item['calls'], reverse=True)
+
+    def _load(self) -> None:
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._routes = json.load(f)
+        except Exception as e:
+            logger.warning(f"Routing: не удалось загрузить телеметрию {self.path}: {e}")
+
+    def _maybe_flush(self) -> None:
+        if self.path and time.monotonic() - self._saved_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Сохраняет счётчики на диск, если они изменились с прошлого сохранения"""
+        if not self.path:
+            return
+        # Запись - по одному потоку за раз и снимком не старше уже записанного
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                snapshot = {k: dict(v) for k, v in self._routes.items()}
+                self._dirty = False
+                self._saved_at = time.monotonic()
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(f'.tmp{os.getpid()}')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=2)
+                tmp_path.replace(self.path)
+            except Exception as e:
+                with self._lock:
+                    self._dirty = True
+                logger.warning(f"Routing: не удалось сохранить телеметрию: {e}")
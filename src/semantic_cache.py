@@ -0,0 +1,176 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Размерность hashing-эмбеддинга тем (символьные n-граммы)
+EMBEDDING_DIM = 512
+# Длина основы слова: "атлета" / "атлетов" / "атлеты" → "атлет"
+STEM_LENGTH = 5
+STEM_WEIGHT = 4.0
+# Слова времени, отрицания и условия: "до" / "после", "с" / "без" меняют смысл темы,
+# а в косинусе почти не видны - у запроса и записи кеша они должны совпадать точно
+CONTRAST_WORDS = frozenset({
+    'до', 'после', 'перед', 'во', 'при', 'с', 'со', 'без', 'не', 'нет', 'ни', 'против', 'вместо', 'кроме',
+    'утром', 'вечером', 'ночью', 'натощак', 'зимой', 'летом',
+    'before', 'after', 'during', 'with', 'without', 'no', 'not', 'vs'
+})
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def normalize_theme(theme: str) -> str:
+    """Нормализует тему: регистр, ё→е, пунктуация и лишние пробелы"""
+    theme = (theme or '').lower().replace('ё', 'е')
+    return ' '.join(_WORD_RE.findall(theme))
+
+
+def _bucket(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=4).digest(), 'little') % EMBEDDING_DIM
+
+
+def theme_guard(theme: str) -> frozenset:
+    """Слова темы из CONTRAST_WORDS - должны совпасть у запроса и записи кеша"""
+    return frozenset(word for word in normalize_theme(theme).split() if word in CONTRAST_WORDS)
+
+
+def embed_theme(theme: str):
+    """Hashing-эмбеддинг темы: символьные триграммы всех слов, кроме чисел, + основы слов, L2-нормированный
+
+    Не требует модели: близкие по написанию и морфологии темы
+    ("Сон атлета" / "сон атлетов: 7-9 часов") получают высокий косинус.
+    """
+    import numpy as np  # ленивый импорт: numpy не замедляет запуск бота
+
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in normalize_theme(theme).split():
+        if word.isdigit():
+            continue
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            vector[_bucket(padded[i:i + 3])] += 1.0
+        # Основа слова весит больше отдельных триграмм
+        vector[_bucket(f"stem:{word[:STEM_LENGTH]}")] += STEM_WEIGHT
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticPostCache:
+    """Кеш готовых постов по смысловой близости темы
+
+    Эмбеддинги тем хранятся строками компактной матрицы float32; поиск -
+    одно умножение матрицы на вектор запроса. Техника, длина поста и слова
+    из CONTRAST_WORDS должны совпадать точно (пост на 500 символов не подходит
+    для запроса на 1000, пост "до тренировки" - для темы "после тренировки").
+    """
+
+    def __init__(self, threshold: float = 0.8, max_entries: int = 500, ttl: int = 3 * 86400):
+        """
+        Args:
+            threshold: минимальный косинус для попадания (0..1)
+            max_entries: максимум постов в кеше (0 - кеш выключен)
+            ttl: время жизни записи в секундах
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._matrix = None  # создаётся при первом сохранении
+        self._entries = []  # строка i матрицы ↔ self._entries[i]
+
+        self.stats = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'stored': 0,
+            'evicted': 0,
+            'saved_tokens': 0   # токены, которые потратила бы повторная генерация
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _remove(self, index: int) -> None:
+        # Последняя строка переезжает на место удалённой - матрица остаётся плотной
+        last = len(self._entries) - 1
+        if index != last:
+            self._matrix[index] = self._matrix[last]
+            self._entries[index] = self._entries[last]
+        self._entries.pop()
+        self.stats['evicted'] += 1
+
+    def _evict_expired(self) -> None:
+        deadline = time.time() - self.ttl
+        for index in range(len(self._entries) - 1, -1, -1):
+            if self._entries[index]['created_at'] < deadline:
+                self._remove(index)
+
+    def lookup(self, theme: str, technique: str, post_length: int):
+        """Ищет готовый пост на близкую тему
+
+        Returns:
+            tuple (entry, similarity) или None; entry - dict с theme, post, usage, created_at, hits
+        """
+        if not self.enabled:
+            return None
+
+        query = embed_theme(theme)
+        guard = theme_guard(theme)
+        with self._lock:
+            self.stats['lookups'] += 1
+            self._evict_expired()
+            count = len(self._entries)
+            if count:
+                scores = self._matrix[:count] @ query
+                for index, entry in enumerate(self._entries):
+                    if entry['technique'] != technique or entry['post_length'] != post_length \
+                            or entry['guard'] != guard:
+                        scores[index] = -1.0
+                best = int(scores.argmax())
+                similarity = float(scores[best])
+                if similarity >= self.threshold:
+                    entry = self._entries[best]
+                    entry['hits'] += 1
+                    self.stats['hits'] += 1
+                    self.stats['saved_tokens'] += entry['usage'].get('total_tokens', 0)
+                    logger.info(f"semantic cache: '{theme}' ≈ '{entry['theme']}' ({similarity:.2f})")
+                    return dict(entry), similarity
+            self.stats['misses'] += 1
+        return None
+
+    def store(self, theme: str, technique: str, post_length: int, post: str, usage: dict = None) -> None:
+        """Сохраняет сгенерированный пост (при переполнении вытесняется самый старый)"""
+        if not self.enabled or not post:
+            return
+
+        vector = embed_theme(theme)
+        with self._lock:
+            if self._matrix is None:
+                import numpy as np
+                self._matrix = np.zeros((self.max_entries, EMBEDDING_DIM), dtype=np.float32)
+            self._evict_expired()
+            if len(self._entries) >= self.max_entries:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]['created_at'])
+                self._remove(oldest)
+            self._matrix[len(self._entries)] = vector
+            self._entries.append({
+                'theme': theme,
+                'technique': technique,
+                'post_length': post_length,
+                'guard': theme_guard(theme),
+                'post': post,
+                'usage': usage or {},
+                'created_at': time.time(),
+                'hits': 0
+            })
+            self.stats['stored'] += 1
+
+    def hit_rate(self) -> float:
+        return self.stats['hits'] / self.stats['lookups'] if self.stats['lookups'] else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
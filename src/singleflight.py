@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Счётчики usage, которые делятся между участниками общего вызова
+USAGE_COUNTERS = ('input_tokens', 'output_tokens', 'total_tokens')
+USAGE_DETAILS = {
+    'input_tokens_details': ('cached_tokens',),
+    'output_tokens_details': ('reasoning_tokens',)
+}
+
+
+def request_key(*parts) -> str:
+    """Канонический ключ запроса: одинаковые запросы дают один ключ независимо от порядка полей"""
+    canonical = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _split_int(value: int, count: int) -> list:
+    """Делит целое на count долей, сумма долей равна исходному (остаток - первым)"""
+    base, remainder = divmod(int(value or 0), count)
+    return [base + (1 if i < remainder else 0) for i in range(count)]
+
+
+def split_usage(usage: dict, count: int) -> list:
+    """Делит usage общего вызова поровну между count участниками
+
+    Сумма долей по каждому счётчику равна исходному usage - журнал
+    использования не завышает и не теряет токены.
+
+    Returns:
+        list: count словарей usage (первый - инициатор вызова)
+    """
+    if not usage or count <= 1:
+        return [usage] * max(count, 1)
+
+    shares = [dict(usage) for _ in range(count)]
+    for field in USAGE_COUNTERS:
+        for share, part in zip(shares, _split_int(usage.get(field, 0), count)):
+            share[field] = part
+    for details_field, fields in USAGE_DETAILS.items():
+        details = usage.get(details_field)
+        if not isinstance(details, dict):
+            continue
+        for share in shares:
+            share[details_field] = dict(details)
+        for field in fields:
+            for share, part in zip(shares, _split_int(details.get(field, 0), count)):
+                share[details_field][field] = part
+    return shares
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters', 'shares')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 1      # инициатор + присоединившиеся
+        self.shares = None
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов (singleflight)
+
+    Первый вызов с ключом выполняет запрос; вызовы с тем же ключом, пришедшие
+    до его завершения, ждут и получают тот же результат (или то же исключение).
+    Завершённые вызовы не кешируются - следующий запрос после завершения идёт в API.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # {key: _Call}
+
+        self.stats = {
+            'calls': 0,          # обращений
+            'executed': 0,       # реально выполненных запросов
+            'coalesced': 0,      # обращений, получивших результат чужого запроса
+            'saved_tokens': 0    # токены, которые потратили бы дублирующие запросы
+        }
+
+    def do(self, key: str, fn) -> tuple:
+        """Выполняет fn() или присоединяется к уже выполняющемуся вызову с тем же ключом
+
+        Args:
+            key: ключ запроса (request_key)
+            fn: функция без аргументов, возвращающая (result, usage_dict)
+
+        Returns:
+            tuple: (result, usage) - usage участника: доля общего (split_usage)
+        """
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                index = call.waiters
+                call.waiters += 1
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                index = 0
+                leader = True
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            with self._lock:
+                # После удаления ключа новые участники не присоединяются - число долей окончательное
+                del self._calls[key]
+                self.stats['executed'] += 1
+                if call.error is None:
+                    result, usage = call.result
+                    call.shares = split_usage(usage, call.waiters)
+                    if call.waiters > 1:
+                        self.stats['saved_tokens'] += ((usage or {}).get('total_tokens', 0) or 0) * (call.waiters - 1)
+                        logger.info(f"🔗 Запрос объединён: {call.waiters} обращений, 1 вызов API")
+            call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result[0], call.shares[index]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
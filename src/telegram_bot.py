@@ -1,8 +1,11 @@
 import os
 import sys
+import asyncio
 import logging
 import atexit
 import fcntl
+import time
+from datetime import datetime
 from pathlib import Path
 
 # Добавляем корневую директорию в путь
@@ -11,30 +14,41 @@ sys.path.append(str(Path(__file__).parent.parent))
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
 from src.bot import NatriumBot
-from src.config import TELEGRAM_BOT_TOKEN
+from src.config import (TELEGRAM_BOT_TOKEN, PREFETCH_TOP_N, SEMANTIC_CACHE_THRESHOLD,
+                        SEMANTIC_CACHE_MAX_ENTRIES, SEMANTIC_CACHE_TTL, POST_ARCHIVE_DEDUP_DAYS,
+                        POST_ARCHIVE_DEDUP_MODE, TELEGRAM_API_BASE_URL, PROMPT_WATCH_DEBOUNCE, POST_VARIANTS, validate)
+from src.prefetch import PostPrefetcher
+from src.usage_ledger import get_ledger, calc_cost, cache_savings
+from src.tracing import span, traced, mark_error, install_log_filter
+from src.telegram_html import markdown_to_html, split_message, escape
+from src.themes import extract_themes, find_theme
+from src.post_schema import is_structured, parse_post, render_telegram_html, to_markdown, PostValidationError
+from src.telegram_sender import OutboundRateLimiter
+from src.semantic_cache import SemanticPostCache
+from src.post_archive import get_archive, format_age
+from src.prompt_versions import DEPLOYED, UNCHANGED
+from src.singleflight import split_usage
 
 # Настройка логирования
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s',
     level=logging.INFO
 )
+install_log_filter()
 logger = logging.getLogger(__name__)
 
 # PID файл для предотвращения множественных запусков
 PID_FILE = Path("/tmp/natrium-smm-bot.pid")
 LOCK_FILE = None
 
-# Глобальные настройки и счетчики (для каждого пользователя)
+# Глобальные настройки (для каждого пользователя)
 # ВАЖНО: USER_SETTINGS хранится в RAM и сбрасывается при перезапуске бота
+# Счетчики токенов хранятся в журнале использования (src/usage_ledger.py) и переживают перезапуск
 USER_SETTINGS = {}  # {user_id: {'show_token_stats': False}}  # по умолчанию выключено
-USER_SESSION_STATS = {}  # {user_id: {...}}
 
-# Тарифы Yandex Cloud GPT (руб. за 1000 токенов)
-PRICING = {
-    'input': 0.0012,
-    'output': 0.0012,
-    'cached': 0.0006
-}
+# Префикс callback_data у меню, прикреплённого к самому посту
+# (такой пост нельзя редактировать - следующий экран отправляется новым сообщением)
+POST_MENU_PREFIX = "post:"
 
 
 def acquire_lock():
@@ -124,41 +138,227 @@ def release_lock():
 atexit.register(release_lock)
 
 
-def convert_markdown_to_html(text: str) -> str:
+def render_post(post: str) -> str:
+    """Готовит ответ Яндекса к отправке в Telegram
+
+    JSON-пост (POST_OUTPUT_FORMAT=json) проверяется и рендерится локально без
+    эвристик очистки. Свободный текст или невалидный JSON идёт через clean_post().
     """
-    Конвертирует Markdown форматирование в HTML для Telegram
-    
-    Поддерживаемые преобразования:
-    - [текст](URL) → <a href="URL">текст</a>
-    - **текст** → <b>текст</b>
-    - *текст* → <i>текст</i>
-    
+    if is_structured(post):
+        try:
+            return render_telegram_html(parse_post(post))
+        except PostValidationError as e:
+            logger.warning(f"JSON-пост не прошёл проверку, используем очистку текста: {e}")
+    return clean_post(post)
+
+
+def clean_post(post: str) -> str:
+    """Постобработка ответа Яндекса перед отправкой в Telegram
+
+    Убирает шаги рассуждений модели, конвертирует Markdown в HTML,
+    оформляет источники и обрезает артефакты после хештегов.
+
     Args:
-        text: Текст с Markdown форматированием
-        
+        post: сырой текст поста от API
+
     Returns:
-        Текст с HTML форматированием
+        str: HTML для отправки с parse_mode='HTML'
     """
+    # КРИТИЧЕСКОЕ ЛОГИРОВАНИЕ: проверяем что пришло от Яндекса
+    logger.info(f"===== RAW POST FROM YANDEX (before processing) =====")
+    logger.info(f"Length: {len(post)} chars")
+    logger.info(f"First 200 chars: {post[:200]}")
+    logger.info(f"Contains **: {('**' in post)}")
+    if '**' in post:
+        # Найдем все вхождения **
+        import re
+        bold_markers = re.findall(r'\*\*[^*]+\*\*', post)
+        logger.info(f"Found {len(bold_markers)} bold markers: {bold_markers[:3]}")
+    logger.info(f"=============================================\n")
+    
+    # КРИТИЧЕСКИ ВАЖНО: Полное удаление всех символов цитирования
+    # Но НЕ трогаем содержимое поста!
+    
+    # КРИТИЧЕСКИ ВАЖНО: Удаляем шаги рассуждений модели
+    # МЕТОД 1: Ищем маркер "ГОТОВЫЙ ПОСТ:"
+    # МЕТОД 2: Ищем строку с эмодзи поста (💪🧠💤🔥⚡️💓🍽️) + ** + CAPS
+    # МЕТОД 3: Удаляем строки с артефактами рассуждений
+    
+    lines = post.split('\n')
+    post_start_index = None
+    
+    # Эмодзи заголовков постов (НЕ путать с 🔄 🏋️ из рассуждений)
+    post_emojis = ['💪', '🧠', '💤', '🔥', '⚡️', '💓', '🍽️', '🏃', '⚡', '📊', '🎯']
+    
+    # Артефакты рассуждений (удаляем эти строки ПОЛНОСТЬЮ)
+    reasoning_markers = [
+        '🔄 Сначала мне нужно',
+        '[Вызов функции',
+        'search_index',
+        'web_search',
+        'FileSearch',
+        'Web Search',
+        'ГЕНЕРИРУЮ',
+        'Шаг 1',
+        'Шаг 2',
+        'Шаг 3',
+        'для поиска',
+        'с запросом'
+    ]
+    
+    # МЕТОД 1: Ищем маркер "ГОТОВЫЙ ПОСТ:"
+    for i, line in enumerate(lines):
+        if 'ГОТОВЫЙ ПОСТ:' in line.strip():
+            post_start_index = i + 1  # Начало после маркера
+            logger.info(f"Found 'ГОТОВЫЙ ПОСТ:' marker at line {i}")
+            break
+    
+    # МЕТОД 2: Если маркера нет, ищем по эмодзи + ** + CAPS
+    if post_start_index is None:
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped or len(stripped) < 10:
+                continue
+            
+            # Пропускаем рассуждения
+            if any(marker in stripped for marker in reasoning_markers):
+                continue
+            if stripped.startswith('{'):
+                continue
+            
+            # Ищем: эмодзи поста в начале + ** + CAPS
+            starts_with_post_emoji = any(stripped.startswith(emoji) for emoji in post_emojis)
+            if starts_with_post_emoji and '**' in stripped and any(c.isupper() for c in stripped):
+                post_start_index = i
+                logger.info(f"Found post start by emoji+CAPS pattern at line {i}")
+                break
+    
+    # Если нашли начало поста, берем только с этого момента
+    if post_start_index is not None:
+        removed_count = post_start_index
+        lines = lines[post_start_index:]
+        logger.info(f"Removed {removed_count} lines of reasoning steps")
+    else:
+        logger.warning("No reasoning steps detected, using full response")
+    
+    # Удаляем ТОЛЬКО начальные пустые строки и строки с >
+    # Пропускаем пустые строки и строки с > В НАЧАЛЕ документа
+    while lines and (not lines[0].strip() or lines[0].strip().startswith('>')):
+        lines.pop(0)
+    
+    post = '\n'.join(lines).strip()
+    
+    # КРИТИЧЕСКИ ВАЖНО: Удаляем тройные обратные кавычки (```), которые конфликтуют с форматированием
+    post = post.replace('```', '')
+    logger.info(f"Removed ``` markers")
+    
+    # КРИТИЧЕСКОЕ ЛОГИРОВАНИЕ: проверяем что осталось после очистки
+    logger.info(f"===== POST AFTER CLEANING (before HTML conversion) =====")
+    logger.info(f"Length: {len(post)} chars")
+    logger.info(f"Contains **: {('**' in post)}")
+    logger.info(f"Contains [link]: {('[' in post and '](' in post)}")
+    if '**' in post:
+        import re
+        bold_markers = re.findall(r'\*\*[^*]+\*\*', post)
+        logger.info(f"Found {len(bold_markers)} bold markers after cleaning")
+    logger.info(f"=============================================\n")
+    
+    # НЕ проверяем парность ** - это сделает markdown_to_html()
+    # Удаляем старую валидацию для Markdown
+    
+    # Нормализация источников: WHO → ВОЗ для единообразия
+    post = post.replace('WHO', 'ВОЗ')
+    post = post.replace('(WHO)', '(ВОЗ)')
+    logger.info(f"Normalized WHO → ВОЗ for consistency")
+    
+    # КРИТИЧЕСКИ ВАЖНО: Конвертируем Markdown в HTML ДО обработки источников
+    # Это сохранит правильные ссылки [PubMed](URL) → <a href="URL">PubMed</a>
+    # Яндекс генерирует ссылки в формате [текст](URL)
+    # Telegram с parse_mode='HTML' требует <a href="URL">текст</a>
+    # Заодно экранируются &, <, > - иначе Telegram отклоняет сообщение целиком
+    post = markdown_to_html(post)
+    logger.info(f"Converted Markdown to HTML (links preserved)")
+    
+    # ПОСЛЕ конвертации в HTML обрабатываем источники
+    # Теперь ссылки в формате <a href="URL">PubMed</a> и мы их НЕ трогаем
     import re
     
-    # 1. Конвертируем ссылки: [текст](URL) → <a href="URL">текст</a>
-    # Паттерн для поиска Markdown ссылок
-    text = re.sub(
-        r'\[([^\]]+)\]\(([^)]+)\)',
-        r'<a href="\2">\1</a>',
-        text
-    )
+    # СНАЧАЛА обрабатываем crossfit.com (чтобы не превратить в (CrossFit).com)
+    # Обрабатываем разные случаи: с точкой, точкой с запятой, переносом строки, в конце
+    # НО НЕ трогаем если это внутри HTML тега <a>
+    # Паттерн: crossfit.com НЕ внутри <a>...</a>
+    post = re.sub(r'(?<!>)\s+crossfit\.com([\.;,!\?])', r' (crossfit.com)\1', post, flags=re.IGNORECASE)
+    post = re.sub(r'(?<!>)\s+crossfit\.com\n', r' (crossfit.com)\n', post, flags=re.IGNORECASE)
+    post = re.sub(r'(?<!>)\s+crossfit\.com$', r' (crossfit.com)', post, flags=re.IGNORECASE)
     
-    # 2. Конвертируем жирный текст: **текст** → <b>текст</b>
-    # Важно: делать это ПОСЛЕ конвертации ссылок, чтобы не сломать паттерны
-    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
+    # ПОТОМ обрабатываем остальные источники (но НЕ CrossFit без .com)
+    # Расширенная обработка: точка, точка с запятой, запятая, восклицательный знак, вопросительный знак
+    # ВАЖНО: НЕ трогаем источники внутри HTML тегов <a>источник</a>
+    sources = ['ВОЗ', 'PubMed', 'Исследования', 'Исследование']
+    for source in sources:
+        # Заменяем источник с разными знаками препинания ТОЛЬКО если он НЕ внутри <a>...</a>
+        # Negative lookbehind (?<!>) - НЕ после >
+        # Пример: "текст ВОЗ." → "текст (ВОЗ).", "текст PubMed;" → "текст (PubMed);"
+        # НО: "<a href='...'>PubMed</a>" остаётся без изменений
+        post = re.sub(rf'(?<!>)\s+{source}([\.;,!\?])', f' ({source})\\1', post)
+        post = re.sub(rf'(?<!>)\s+{source}\n', f' ({source})\n', post)
+        post = re.sub(rf'(?<!>)\s+{source}$', f' ({source})', post)
     
-    # 3. Конвертируем курсив: *текст* → <i>текст</i>
-    # Но НЕ трогаем одинарные * в начале строки (буллеты)
-    # Паттерн: * не в начале строки, окруженный текстом с обеих сторон
-    text = re.sub(r'(?<!^)(?<!\n)\*([^*\n]+?)\*', r'<i>\1</i>', text, flags=re.MULTILINE)
+    logger.info(f"Wrapped sources in parentheses (ВОЗ, PubMed, Исследования, crossfit.com)")
     
-    return text
+    # ДОПОЛНИТЕЛЬНО: Если остались артефакты типа (PubMed)(URL) - исправляем их
+    # Это происходит если Яндекс сгенерировал (Source)(URL) вместо [Source](URL)
+    # Конвертируем (Source)(URL) → <a href="URL">Source</a>
+    for source in sources + ['crossfit.com', 'ВОЗ']:
+        # Паттерн: (Источник)(http...)
+        pattern = rf'\({re.escape(source)}\)\((https?://[^\)]+)\)'
+        replacement = f'<a href="\\1">{source}</a>'
+        post = re.sub(pattern, replacement, post, flags=re.IGNORECASE)
+    
+    logger.info(f"Fixed malformed links (Source)(URL) → <a href>Source</a>")
+    
+    # КРИТИЧЕСКИ ВАЖНО: Удаляем артефакты рассуждений модели после хештегов
+    # Ищем последнюю строку с хештегами (начинается с #)
+    lines = post.split('\n')
+    last_hashtag_index = -1
+    for i in range(len(lines) - 1, -1, -1):
+        stripped = lines[i].strip()
+        if stripped and stripped.startswith('#'):
+            last_hashtag_index = i
+            break
+    
+    # Если нашли хештеги, обрезаем все что после них
+    if last_hashtag_index >= 0:
+        # Берем только строки до хештегов включительно
+        post = '\n'.join(lines[:last_hashtag_index + 1])
+        logger.info(f"Removed reasoning artifacts after hashtags (line {last_hashtag_index})")
+    
+    # HTML конвертация уже выполнена ВЫШЕ (до обработки источников)
+    # Это важно для сохранения правильных ссылок [text](URL) → <a href="URL">text</a>
+    
+    # ФИНАЛЬНОЕ ЛОГИРОВАНИЕ перед отправкой в Telegram
+    logger.info(f"===== FINAL TEXT SENT TO TELEGRAM =====")
+    logger.info(f"Length: {len(post)} chars")
+    logger.info(f"Contains <a href: {('<a href' in post)}")
+    logger.info(f"Contains <b>: {('<b>' in post)}")
+    logger.info(f"First 200 chars: {post[:200]}")
+    logger.info(f"Last 200 chars: {post[-200:]}")
+    logger.info(f"=====================================\n")
+
+    return post
+
+
+def format_estimate_hint(estimate: dict) -> str:
+    """Подсказка для UI по оценке NatriumBot.estimate(), например «≈ 40 с, ≈ 0.05 ₽»"""
+    cost = estimate['cost_rub']
+    cost_text = f"{cost:.2f}" if cost >= 0.01 else f"{cost:.3f}"
+    return f"≈ {estimate['latency_s']:.0f} с, ≈ {cost_text} ₽"
+
+
+def is_admin(user_id: int) -> bool:
+    """Проверка прав администратора (ADMIN_TELEGRAM_ID в .env, если не задан - доступно всем)"""
+    ADMIN_IDS = [int(os.getenv("ADMIN_TELEGRAM_ID", "0"))]
+    return user_id in ADMIN_IDS or ADMIN_IDS == [0]
 
 
 def get_user_settings(user_id: int) -> dict:
@@ -168,55 +368,23 @@ def get_user_settings(user_id: int) -> dict:
     return USER_SETTINGS[user_id]
 
 
-def get_user_stats(user_id: int) -> dict:
-    """Получить статистику сессии пользователя"""
-    if user_id not in USER_SESSION_STATS:
-        USER_SESSION_STATS[user_id] = {
-            'total_input_tokens': 0,
-            'total_output_tokens': 0,
-            'total_cached_tokens': 0,
-            'total_reasoning_tokens': 0,
-            'total_requests': 0,
-            'total_tokens': 0
-        }
-    return USER_SESSION_STATS[user_id]
-
+def format_token_stats(operation: str, current: dict, user_id: int) -> str:
+    """Форматирует статистику токенов для отправки в Telegram (HTML формат)
 
-def format_token_stats(operation: str, usage: dict, user_id: int) -> str:
-    """Форматирует статистику токенов для отправки в Telegram (HTML формат)"""
-    if not usage:
+    Args:
+        operation: название операции
+        current: запись о вызове из UsageLedger.record()
+        user_id: пользователь (для накопительной статистики сессии)
+    """
+    if not current:
         return ""
 
-    input_tokens = usage.get('input_tokens', 0)
-    output_tokens = usage.get('output_tokens', 0)
-    total_tokens = usage.get('total_tokens', 0)
-
-    # Получаем детали
-    input_details = usage.get('input_tokens_details')
-    output_details = usage.get('output_tokens_details')
-
-    cached_tokens = 0
-    if input_details:
-        cached_tokens = getattr(input_details, 'cached_tokens', 0) if hasattr(input_details, 'cached_tokens') else input_details.get('cached_tokens', 0)
-
-    reasoning_tokens = 0
-    if output_details:
-        reasoning_tokens = getattr(output_details, 'reasoning_tokens', 0) if hasattr(output_details, 'reasoning_tokens') else output_details.get('reasoning_tokens', 0)
-
-    # Обновляем накопительную статистику
-    stats = get_user_stats(user_id)
-    stats['total_input_tokens'] += input_tokens
-    stats['total_output_tokens'] += output_tokens
-    stats['total_cached_tokens'] += cached_tokens
-    stats['total_reasoning_tokens'] += reasoning_tokens
-    stats['total_requests'] += 1
-    stats['total_tokens'] += total_tokens
-
-    # Расчет стоимости текущего запроса
-    cost_input = (input_tokens - cached_tokens) / 1000 * PRICING['input']
-    cost_cached = cached_tokens / 1000 * PRICING['cached']
-    cost_output = output_tokens / 1000 * PRICING['output']
-    total_cost = cost_input + cost_cached + cost_output
+    input_tokens = current['input_tokens']
+    output_tokens = current['output_tokens']
+    total_tokens = current['total_tokens']
+    cached_tokens = current['cached_tokens']
+    reasoning_tokens = current['reasoning_tokens']
+    total_cost = current['cost']
 
     # Формируем текст статистики в HTML формате
     text = f"📊 <b>{operation}</b>\n"
@@ -244,37 +412,53 @@ def format_token_stats(operation: str, usage: dict, user_id: int) -> str:
     # Стоимость
     text += f"\n💰 <b>Стоимость запроса:</b> ~{total_cost:.4f} ₽"
     if cached_tokens > 0:
-        saved = (cached_tokens / 1000 * (PRICING['input'] - PRICING['cached']))
-        text += f" (экономия: {saved:.4f} ₽)\n"
+        text += f" (экономия: {cache_savings(cached_tokens):.4f} ₽)\n"
     else:
         text += "\n"
 
-    # Накопительная статистика
-    total_session_cost = (
-        (stats['total_input_tokens'] - stats['total_cached_tokens']) / 1000 * PRICING['input'] +
-        stats['total_cached_tokens'] / 1000 * PRICING['cached'] +
-        stats['total_output_tokens'] / 1000 * PRICING['output']
-    )
+    # Накопительная статистика (агрегат сессии из журнала, O(1))
+    stats = get_ledger().session(user_id)
 
-    text += f"\n📦 <b>Статистика сессии</b> (запросов: {stats['total_requests']}): \n"
+    text += f"\n📦 <b>Статистика сессии</b> (запросов: {stats['requests']}): \n"
     text += f"   • Всего токенов: {stats['total_tokens']}\n"
-    text += f"   • Входные: {stats['total_input_tokens']}\n"
-    if stats['total_cached_tokens'] > 0:
-        cache_percent_total = (stats['total_cached_tokens'] / stats['total_input_tokens'] * 100) if stats['total_input_tokens'] > 0 else 0
-        text += f"      └ из кеша: {stats['total_cached_tokens']} ({cache_percent_total:.1f}% 💾)\n"
-    text += f"   • Выходные: {stats['total_output_tokens']}\n"
-    text += f"   • Стоимость: ~{total_session_cost:.4f} ₽\n"
+    text += f"   • Входные: {stats['input_tokens']}\n"
+    if stats['cached_tokens'] > 0:
+        cache_percent_total = (stats['cached_tokens'] / stats['input_tokens'] * 100) if stats['input_tokens'] > 0 else 0
+        text += f"      └ из кеша: {stats['cached_tokens']} ({cache_percent_total:.1f}% 💾)\n"
+    text += f"   • Выходные: {stats['output_tokens']}\n"
+    text += f"   • Стоимость: ~{stats['cost']:.4f} ₽\n"
 
     return text
 
 
 class TelegramSMMBot:
     def __init__(self):
-        if not TELEGRAM_BOT_TOKEN:
-            raise ValueError("TELEGRAM_BOT_TOKEN не найден в переменных окружения. Проверьте GitHub Secrets.")
+        validate(telegram=True)
         
         self.natrium_bot = NatriumBot()
-        self.application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+        # Соединение с Yandex API устанавливается в фоне, пока бот подключается к Telegram
+        self.natrium_bot.warm_up()
+        if PROMPT_WATCH_DEBOUNCE > 0:
+            self.natrium_bot.watch_prompts(debounce=PROMPT_WATCH_DEBOUNCE)
+        self.prefetcher = PostPrefetcher(self.natrium_bot, top_n=PREFETCH_TOP_N, ledger=get_ledger())
+        # Все исходящие запросы Bot API проходят через планировщик (лимиты + RetryAfter)
+        self.rate_limiter = OutboundRateLimiter()
+        # Готовые посты на близкие темы (повторная генерация не нужна)
+        self.semantic_cache = SemanticPostCache(
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            ttl=SEMANTIC_CACHE_TTL
+        )
+        # concurrent_updates: генерация для одного пользователя не задерживает остальных
+        builder = (
+            Application.builder()
+            .token(TELEGRAM_BOT_TOKEN)
+            .rate_limiter(self.rate_limiter)
+            .concurrent_updates(True)
+        )
+        if TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(TELEGRAM_API_BASE_URL)
+        self.application = builder.build()
         
         # Постоянная клавиатура с кнопками
         self.main_keyboard = ReplyKeyboardMarkup(
@@ -289,6 +473,15 @@ class TelegramSMMBot:
         # Регистрация обработчиков
         self.application.add_handler(CommandHandler("start", self.start_command))
         self.application.add_handler(CommandHandler("update_prompt", self.update_prompt_command))
+        self.application.add_handler(CommandHandler("prompt_versions", self.prompt_versions_command))
+        self.application.add_handler(CommandHandler("rollback_prompt", self.rollback_prompt_command))
+        self.application.add_handler(CommandHandler("routes", self.routes_command))
+        self.application.add_handler(CommandHandler("route", self.route_command))
+        self.application.add_handler(CommandHandler("prefetch_stats", self.prefetch_stats_command))
+        self.application.add_handler(CommandHandler("cache_stats", self.cache_stats_command))
+        self.application.add_handler(CommandHandler("archive", self.archive_command))
+        self.application.add_handler(CommandHandler("report", self.report_command))
+        self.application.add_handler(CommandHandler("send_stats", self.send_stats_command))
         self.application.add_handler(CallbackQueryHandler(self.button_handler))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.text_handler))
 
@@ -296,13 +489,14 @@ class TelegramSMMBot:
         """Обновляет системный промпт агента в Yandex Cloud (только для администраторов)"""
         user_id = update.effective_user.id
         
-        # Проверка прав администратора (укажите свой Telegram ID)
-        ADMIN_IDS = [int(os.getenv("ADMIN_TELEGRAM_ID", "0"))]  # Добавьте свой ID в .env
-        
-        if user_id not in ADMIN_IDS and ADMIN_IDS != [0]:
+        # Проверка прав администратора (укажите свой Telegram ID в ADMIN_TELEGRAM_ID)
+        if not is_admin(user_id):
             await update.message.reply_text("❌ Эта команда доступна только администраторам.")
             return
         
+        # /update_prompt force - развернуть даже без изменений
+        force = bool(context.args) and context.args[0].lower() == "force"
+        
         await update.message.reply_text(
             "🔄 <b>Обновление системного промпта агента...</b>\n\n"
             "⏳ Это может занять несколько секунд.",
@@ -310,15 +504,21 @@ class TelegramSMMBot:
         )
         
         try:
-            success = self.natrium_bot.update_agent_prompt()
+            status = await asyncio.to_thread(self.natrium_bot.sync_agent_prompt, force=force)
+            version = self.natrium_bot.prompt_versions.current
             
-            if success:
+            if status == DEPLOYED:
                 await update.message.reply_text(
                     "✅ <b>Системный промпт успешно обновлён!</b>\n\n"
-                    "Агент Yandex Cloud теперь использует новые требования:\n"
-                    "• Обязательный заголовок в CAPS\n"
-                    "• Обязательный лид-затравка после заголовка\n"
-                    "• Усиленный контроль структуры постов",
+                    f"Версия: <code>{version['hash'][:8]}</code> ({version['length']} симв.)\n"
+                    "Откат к предыдущей версии: /rollback_prompt",
+                    parse_mode='HTML'
+                )
+            elif status == UNCHANGED:
+                await update.message.reply_text(
+                    "ℹ️ <b>Промпт не изменился</b>\n\n"
+                    f"У агента уже версия <code>{version['hash'][:8]}</code> от {version['deployed_at']}.\n"
+                    "Повторное обновление сбросило бы кеш промпта. Принудительно: /update_prompt force",
                     parse_mode='HTML'
                 )
             else:
@@ -334,6 +534,288 @@ class TelegramSMMBot:
                 parse_mode='HTML'
             )
 
+    async def prompt_versions_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """История развёртываний системного промпта (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        history = self.natrium_bot.prompt_versions.history(limit=10)
+        if not history:
+            await update.message.reply_text("⚠️ Промпт ещё не развёртывался через бота. Используйте /update_prompt")
+            return
+
+        stats = self.natrium_bot.prompt_stats
+        text = "🗃 <b>ВЕРСИИ СИСТЕМНОГО ПРОМПТА</b>\n\n"
+        for number, version in enumerate(history):
+            marker = "▶️" if number == 0 else f"{number}."
+            text += f"{marker} <code>{version['hash'][:8]}</code> {version['deployed_at'].replace('T', ' ')}\n"
+            text += f"   └ {escape(version['source'])}, {version['length']} симв.\n"
+        text += (
+            f"\nЗа сеанс: развёрнуто {stats['deployed']}, пропущено без изменений {stats['skipped']}, "
+            f"ошибок {stats['failed']}\n"
+            "Откат: /rollback_prompt [N назад | хеш]"
+        )
+        await update.message.reply_text(text, parse_mode='HTML')
+
+    async def rollback_prompt_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Откат системного промпта к версии из истории (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        target = context.args[0] if context.args else "1"
+        try:
+            status, version = await asyncio.to_thread(self.natrium_bot.rollback_prompt, target)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {escape(str(e))}", parse_mode='HTML')
+            return
+
+        if status == DEPLOYED:
+            await update.message.reply_text(
+                f"⏪ <b>Промпт откатан к версии <code>{version['hash'][:8]}</code></b>\n"
+                f"   └ {escape(version['source'])} от {version['deployed_at'].replace('T', ' ')}",
+                parse_mode='HTML'
+            )
+        elif status == UNCHANGED:
+            await update.message.reply_text(f"ℹ️ Версия <code>{version['hash'][:8]}</code> уже развёрнута", parse_mode='HTML')
+        else:
+            await update.message.reply_text("❌ <b>Ошибка отката промпта</b>\n\nПроверьте логи для деталей.", parse_mode='HTML')
+
+    async def routes_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Маршруты операций и телеметрия по ним (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        routes = self.natrium_bot.router.routes()
+        text = "🧭 <b>МАРШРУТЫ ОПЕРАЦИЙ</b>\n\n"
+        if not routes:
+            text += "Все операции идут в агент по умолчанию (YANDEX_AGENT_ID)\n"
+        for key, route in sorted(routes.items()):
+            details = []
+            if route.tools:
+                details.append(f"инструменты: {', '.join(str(tool) for tool in route.tools)}")
+            if route.max_output_tokens:
+                details.append(f"до {route.max_output_tokens} ток.")
+            text += f"• <code>{escape(key)}</code> → {escape(route.target)}"
+            text += f" ({'; '.join(details)})\n" if details else "\n"
+
+        report = self.natrium_bot.route_telemetry.report()
+        if report:
+            text += "\n📊 <b>ТЕЛЕМЕТРИЯ</b> (на вызов)\n"
+            for item in report:
+                text += f"\n<b>{escape(item['route'])}</b>\n"
+                text += f"   • Вызовов: {item['calls']}, ошибок: {item['error_rate'] * 100:.0f}%\n"
+                text += f"   • Время: {item['avg_latency_s']:.1f} с (макс {item['max_latency_s']:.1f} с)\n"
+                text += f"   • Токены: {item['avg_tokens']:.0f}, стоимость: {item['avg_cost']:.4f} ₽\n"
+                if item['pass_rate'] is not None:
+                    text += f"   └ без замечаний валидатора: {item['pass_rate'] * 100:.0f}% из {item['checked']}\n"
+        text += "\nИзменить: /route &lt;операция[:техника]&gt; model=… | agent_id=… [tools=…] [max_output_tokens=…]"
+        text += "\nСбросить: /route &lt;операция[:техника]&gt; default"
+
+        for part in split_message(text):
+            await update.message.reply_text(part, parse_mode='HTML')
+
+    async def route_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Задаёт маршрут операции во время работы: /route themes model=yandexgpt-lite/latest max_output_tokens=800"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        if len(context.args or []) < 2:
+            await update.message.reply_text(
+                "Использование: /route &lt;операция[:техника]&gt; model=… | agent_id=… [tools=web_search,file_search] "
+                "[max_output_tokens=…]\nили /route &lt;операция[:техника]&gt; default\n\n"
+                "Операции: themes, post, research, write, repair; * - по умолчанию",
+                parse_mode='HTML'
+            )
+            return
+
+        key, options = context.args[0], context.args[1:]
+        if options == ["default"]:
+            removed = self.natrium_bot.router.remove_route(key)
+            await update.message.reply_text(
+                f"🧭 Маршрут <code>{escape(key)}</code> сброшен" if removed else f"ℹ️ Маршрут <code>{escape(key)}</code> не задан",
+                parse_mode='HTML'
+            )
+            return
+
+        fields = {}
+        for option in options:
+            name, _, value = option.partition('=')
+            fields[name] = [tool for tool in value.split(',') if tool] if name == 'tools' else value
+        try:
+            route = self.natrium_bot.router.set_route(key, **fields)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {escape(str(e))}", parse_mode='HTML')
+            return
+        await update.message.reply_text(f"🧭 <code>{escape(key)}</code> → {escape(route.target)}", parse_mode='HTML')
+
+    async def prefetch_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает эффективность спекулятивной предгенерации (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        if not self.prefetcher.enabled:
+            await update.message.reply_text(
+                "⚠️ Предгенерация выключена. Задайте PREFETCH_TOP_N в .env",
+                parse_mode='HTML'
+            )
+            return
+
+        stats = self.prefetcher.stats
+        wasted_cost = calc_cost(stats['wasted_input_tokens'], stats['wasted_cached_tokens'], stats['wasted_output_tokens'])
+
+        text = f"⚡ <b>ПРЕДГЕНЕРАЦИЯ ПОСТОВ</b> (top-{self.prefetcher.top_n})\n\n"
+        text += f"🎯 <b>Hit rate</b> (длина {self.prefetcher.post_length}): {self.prefetcher.hit_rate() * 100:.1f}%\n"
+        text += f"   • Попаданий: {stats['hits']}\n"
+        text += f"   • Промахов: {stats['misses']}\n"
+        text += f"   • Другая длина (не учитывается): {stats['other_length']}\n\n"
+        text += f"📦 <b>Запущено:</b> {stats['started']}\n"
+        text += f"   • Отменено до старта: {stats['cancelled']}\n"
+        text += f"   • Не использовано: {stats['wasted']}\n\n"
+        text += f"🔢 <b>Токены:</b>\n"
+        text += f"   • Использованные: {stats['used_tokens']}\n"
+        text += f"   • Лишний расход: {stats['wasted_tokens']}\n"
+        text += f"\n💰 <b>Лишняя стоимость:</b> ~{wasted_cost:.4f} ₽\n"
+
+        await update.message.reply_text(text, parse_mode='HTML')
+
+    async def archive_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Поиск по архиву постов: /archive гребля"""
+        query = " ".join(context.args or []).strip()
+        if not query:
+            await update.message.reply_text(
+                "🔎 Использование: /archive <слова>\nНапример: /archive гребля техника"
+            )
+            return
+
+        results = get_archive().search(query, limit=10)
+        if not results:
+            await update.message.reply_text(f"📭 В архиве нет постов по запросу «{escape(query)}»", parse_mode='HTML')
+            return
+
+        text = f"🗂 <b>АРХИВ: {escape(query)}</b> (найдено: {len(results)})\n\n"
+        for found in results:
+            date = datetime.fromtimestamp(found['ts']).strftime('%d.%m.%Y')
+            text += f"<b>{escape(found['theme'])}</b>\n"
+            text += f"   {date} ({format_age(found['ts'])}), {found['technique']}, {found['post_length']} симв.\n"
+            text += f"   └ {escape(found['snippet'])}\n\n"
+
+        for part in split_message(text):
+            await update.message.reply_text(part, parse_mode='HTML')
+
+    async def cache_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает долю входных токенов из кеша по шаблонам запросов (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        report = self.natrium_bot.cache_stats.report()
+        if not report:
+            await update.message.reply_text("⚠️ Запросов ещё не было")
+            return
+
+        text = "💾 <b>КЕШ ПО ШАБЛОНАМ ЗАПРОСОВ</b>\n\n"
+        for template, stats in sorted(report.items()):
+            text += f"<b>{template}</b> (запросов: {stats['requests']})\n"
+            text += f"   • Входные: {stats['input_tokens']}\n"
+            text += f"   └ из кеша: {stats['cached_tokens']} ({stats['ratio'] * 100:.1f}% 💾)\n\n"
+        
+        if self.semantic_cache.enabled:
+            semantic = self.semantic_cache.stats
+            text += "♻️ <b>СЕМАНТИЧЕСКИЙ КЕШ ПОСТОВ</b>\n"
+            text += f"   • Постов в кеше: {len(self.semantic_cache)}\n"
+            text += f"   • Попаданий: {semantic['hits']} из {semantic['lookups']} ({self.semantic_cache.hit_rate() * 100:.1f}%)\n"
+            text += f"   └ сэкономлено токенов: {semantic['saved_tokens']}\n"
+        
+        flight = self.natrium_bot.singleflight.stats
+        if flight['coalesced']:
+            text += "\n🔗 <b>ОБЪЕДИНЕНИЕ ОДИНАКОВЫХ ЗАПРОСОВ</b>\n"
+            text += f"   • Обращений: {flight['calls']}, вызовов API: {flight['executed']}\n"
+            text += f"   • Сэкономлено вызовов: {flight['coalesced']}\n"
+            text += f"   └ сэкономлено токенов: {flight['saved_tokens']}\n"
+
+        research = self.natrium_bot.research_report()
+        if research['posts']:
+            text += "\n🔬 <b>ДВУХЭТАПНАЯ ГЕНЕРАЦИЯ</b>\n"
+            text += f"   • Постов: {research['posts']}, исследований: {research['briefs']}, "
+            text += f"по брифу из кеша: {research['brief_hits']}\n"
+            text += f"   • Токены: {research['tokens']} против ~{research['baseline_tokens']} одноэтапно "
+            text += f"({research['saved_tokens_share'] * 100:+.0f}% экономии)\n"
+            text += f"   • Время: {research['latency_s']:.0f} с против ~{research['baseline_latency_s']:.0f} с "
+            text += f"({research['saved_latency_share'] * 100:+.0f}%)\n"
+            text += f"   └ одноэтапно - оценка: по истории вызовов для {research['baseline_observed']} "
+            text += f"из {research['posts']} постов, для остальных - по априорным значениям\n"
+
+        repair = self.natrium_bot.repair_stats
+        if repair['checked']:
+            text += "\n🩹 <b>ПРОВЕРКА ПОСТОВ</b>\n"
+            text += f"   • Проверено: {repair['checked']}, без замечаний: {repair['valid']}\n"
+            text += f"   • Исправлено точечно: {repair['repaired']} (запросов: {repair['repair_calls']}, токенов: {repair['repair_tokens']})\n"
+            text += f"   • Требуют новой генерации: {repair['unrepairable']}\n"
+            text += f"   └ полных генераций не понадобилось: {repair['avoided_regenerations']}\n"
+
+        await update.message.reply_text(text, parse_mode='HTML')
+
+    async def report_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводный отчёт по токенам и стоимости по всем пользователям (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+
+        # Отчёт строится только из агрегатов журнала, без сканирования сырых записей
+        report = get_ledger().report(days=7)
+        total = report['total']
+
+        if total['requests'] == 0:
+            await update.message.reply_text("⚠️ Запросов ещё не было")
+            return
+
+        cache_percent = (total['cached_tokens'] / total['input_tokens'] * 100) if total['input_tokens'] > 0 else 0
+
+        text = "📑 <b>ОТЧЁТ ПО ИСПОЛЬЗОВАНИЮ</b>\n\n"
+        text += f"📦 <b>Всего запросов:</b> {total['requests']} (пользователей: {len(report['users'])})\n"
+        text += f"   • Токенов: {total['total_tokens']}\n"
+        text += f"   • из кеша: {total['cached_tokens']} ({cache_percent:.1f}% 💾)\n"
+        text += f"   • Стоимость: ~{total['cost']:.4f} ₽\n"
+
+        text += "\n📅 <b>По дням (7 дней):</b>\n"
+        for day, stats in report['days'].items():
+            if stats['requests']:
+                text += f"   • {day}: {stats['requests']} запр., ~{stats['cost']:.4f} ₽\n"
+
+        text += "\n🎯 <b>По техникам:</b>\n"
+        for technique, stats in sorted(report['techniques'].items(), key=lambda item: -item[1]['cost']):
+            text += f"   • {technique or '—'}: {stats['requests']} запр., ~{stats['cost']:.4f} ₽\n"
+
+        text += "\n⚙️ <b>По операциям:</b>\n"
+        for operation, stats in sorted(report['operations'].items(), key=lambda item: -item[1]['cost']):
+            text += f"   • {operation}: {stats['requests']} запр., ~{stats['cost']:.4f} ₽\n"
+
+        text += "\n👥 <b>Топ пользователей:</b>\n"
+        top_users = sorted(report['users'].items(), key=lambda item: -item[1]['cost'])[:5]
+        for user_id, stats in top_users:
+            text += f"   • {user_id}: {stats['requests']} запр., ~{stats['cost']:.4f} ₽\n"
+
+        await update.message.reply_text(text, parse_mode='HTML')
+
+    async def send_stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Статистика планировщика исходящих сообщений (только для администраторов)"""
+        if not is_admin(update.effective_user.id):
+            await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+            return
+        
+        stats = self.rate_limiter.stats
+        text = "📤 <b>ИСХОДЯЩИЕ СООБЩЕНИЯ</b>\n\n"
+        text += f"📦 Запросов к Bot API: {stats['requests']}\n"
+        text += f"⏳ Ждали лимит: {stats['throttled']} (всего {stats['wait_s']:.1f} с)\n"
+        text += f"🚦 RetryAfter от Telegram: {stats['retry_after']}\n"
+        text += f"❌ Не отправлено после повторов: {stats['failed']}"
+        await update.message.reply_text(text, parse_mode='HTML')
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
@@ -376,12 +858,23 @@ class TelegramSMMBot:
         await update.message.reply_text(focus_text, reply_markup=reply_markup, parse_mode='HTML')
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий на кнопки"""
+        """Обработчик нажатий на кнопки (корневой span трассы)"""
+        query = update.callback_query
+        with span("button_handler", callback_data=query.data or "", user_id=query.from_user.id, update_id=update.update_id):
+            await self._handle_button(update, context)
+
+    async def _handle_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка нажатия на кнопку"""
         query = update.callback_query
         await query.answer()
         
         data = query.data
         
+        # Меню под постом: пост не трогаем, следующий экран - новым сообщением
+        from_post = data.startswith(POST_MENU_PREFIX)
+        if from_post:
+            data = data[len(POST_MENU_PREFIX):]
+        
         # Выбор темы по номеру
         if data.startswith("theme_"):
             theme_num = int(data.replace("theme_", ""))
@@ -392,17 +885,16 @@ class TelegramSMMBot:
             if 1 <= theme_num <= len(parsed_themes):
                 theme_name = parsed_themes[theme_num - 1]
                 context.user_data['current_theme'] = theme_name
+                context.user_data.pop('skip_semantic_cache', None)
+                
+                theme = find_theme(context.user_data.get('theme_list', []), theme_num)
+                sources_text = f"\n📚 Источники: {escape(', '.join(theme.sources))}" if theme and theme.sources else ""
                 
                 # Запрашиваем длину поста (без названия темы в callback)
-                keyboard = [
-                    [InlineKeyboardButton("📏 500 символов", callback_data="len_500")],
-                    [InlineKeyboardButton("📏 700 символов", callback_data="len_700")],
-                    [InlineKeyboardButton("📏 1000 символов", callback_data="len_1000")],
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+                reply_markup = self.length_keyboard(theme_name, context.user_data.get('technique', 'cov+cok'))
                 
                 await query.edit_message_text(
-                    f"✅ Тема: <b>{theme_name}</b>\n\nВыберите длину поста:",
+                    f"✅ Тема: <b>{theme_name}</b>{sources_text}\n\nВыберите длину поста:",
                     reply_markup=reply_markup,
                     parse_mode='HTML'
                 )
@@ -428,39 +920,78 @@ class TelegramSMMBot:
                 )
                 return
             
-            await self.generate_post_callback(query, theme_name, technique, post_length)
+            context.user_data['current_length'] = post_length
+            # "Новый пост на эту тему" - пользователю нужен другой текст, кеш не используем
+            use_cache = not context.user_data.pop('skip_semantic_cache', False)
+            await self.generate_post_callback(query, theme_name, technique, post_length, use_cache=use_cache)
+        
+        # Пост из семантического кеша не подошёл - генерируем заново в обход кеша
+        elif data == "regen_fresh":
+            theme_name = context.user_data.get('current_theme', '')
+            post_length = context.user_data.get('current_length')
+            technique = context.user_data.get('technique', 'cov+cok')
+            
+            if not theme_name or not post_length:
+                await self.show(
+                    query, from_post,
+                    "❌ Ошибка: тема не найдена. Используйте /start",
+                    parse_mode='HTML'
+                )
+                return
+            
+            await self.generate_post_callback(query, theme_name, technique, post_length,
+                                              use_cache=False, new_message=from_post)
         
         # Регенерация поста (используем current_theme из контекста)
         elif data == "regen":
             theme_name = context.user_data.get('current_theme', '')
             
             if not theme_name:
-                await query.edit_message_text(
+                await self.show(
+                    query, from_post,
                     "❌ Ошибка: тема не найдена. Используйте /start",
                     parse_mode='HTML'
                 )
                 return
             
             # Запрашиваем длину поста
-            keyboard = [
-                [InlineKeyboardButton("📏 500 символов", callback_data="len_500")],
-                [InlineKeyboardButton("📏 700 символов", callback_data="len_700")],
-                [InlineKeyboardButton("📏 1000 символов", callback_data="len_1000")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            context.user_data['skip_semantic_cache'] = True
+            reply_markup = self.length_keyboard(theme_name, context.user_data.get('technique', 'cov+cok'))
             
-            await query.edit_message_text(
+            await self.show(
+                query, from_post,
                 f"✅ Тема: <b>{theme_name}</b>\n\nВыберите длину поста:",
                 reply_markup=reply_markup,
                 parse_mode='HTML'
             )
         
+        # Несколько вариантов поста одним запросом (поиск и проверка фактов - один раз на все варианты)
+        elif data == "variants":
+            theme_name = context.user_data.get('current_theme', '')
+            post_length = context.user_data.get('current_length')
+            technique = context.user_data.get('technique', 'cov+cok')
+            
+            if not theme_name or not post_length:
+                await self.show(
+                    query, from_post,
+                    "❌ Ошибка: тема не найдена. Используйте /start",
+                    parse_mode='HTML'
+                )
+                return
+            
+            await self._generate_variants(query, context, theme_name, technique, post_length, new_message=from_post)
+        
+        # Листание и выбор вариантов: var_<номер>, var_pick_<номер>
+        elif data.startswith("var_"):
+            await self._handle_variant(query, context, data[len("var_"):])
+        
         # Другая тема - показываем УЖЕ сгенерированные темы
         elif data == "other_theme":
             parsed_themes = context.user_data.get('parsed_themes', [])
             
             if not parsed_themes:
-                await query.edit_message_text(
+                await self.show(
+                    query, from_post,
                     "❌ Темы не найдены. Используйте /start",
                     parse_mode='HTML'
                 )
@@ -487,10 +1018,13 @@ class TelegramSMMBot:
             keyboard.append([InlineKeyboardButton("✏️ Написать свою тему", callback_data="custom_theme")])
             
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(themes_text, reply_markup=reply_markup, parse_mode='HTML')
+            await self.show(query, from_post, themes_text, reply_markup=reply_markup, parse_mode='HTML')
         
         # Новые темы - показываем выбор фокуса
         elif data == "new_themes":
+            # Пользователь ушёл от текущего списка - предгенерации больше не нужны
+            self.prefetcher.discard(query.from_user.id)
+            
             # Показываем кнопки выбора фокуса
             focus_text = "🎯 <b>НА ЧТО СДЕЛАТЬ УПОР В НОВЫХ ТЕМАХ?</b>\n\nВыберите направление:"
             
@@ -504,7 +1038,7 @@ class TelegramSMMBot:
             ]
             
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(focus_text, reply_markup=reply_markup, parse_mode='HTML')
+            await self.show(query, from_post, focus_text, reply_markup=reply_markup, parse_mode='HTML')
         
         # Регенерация тем с тем же фокусом
         elif data == "regenerate_same_focus":
@@ -552,16 +1086,24 @@ class TelegramSMMBot:
                     custom_input = None
                 
                 # Передаём предыдущие темы для избежания повторений
-                themes, usage = self.natrium_bot.generate_themes(
+                # Вызов API - в отдельном потоке: бот продолжает обрабатывать других пользователей,
+                # а одинаковые одновременные запросы объединяются (NatriumBot.singleflight)
+                themes, usage = await asyncio.to_thread(
+                    self.natrium_bot.generate_themes,
                     technique, 
                     custom_input=custom_input,
                     previous_themes=all_previous_themes
                 )
                 context.user_data['themes'] = themes
                 
-                # Парсим темы и создаём кнопки
-                parsed_themes = self.parse_themes_list(themes)
+                # Парсим темы один раз и создаём кнопки (источники сохраняем для экрана выбора длины)
+                theme_list = extract_themes(themes)
+                parsed_themes = [theme.title for theme in theme_list]
                 context.user_data['parsed_themes'] = parsed_themes
+                context.user_data['theme_list'] = theme_list
+                
+                # Спекулятивно генерируем посты для первых тем (если режим включён)
+                self.prefetcher.start(query.from_user.id, parsed_themes, technique)
                 
                 # Добавляем новые темы к списку всех сгенерированных тем
                 all_previous_themes.extend(parsed_themes)
@@ -591,28 +1133,33 @@ class TelegramSMMBot:
                 keyboard.append([InlineKeyboardButton("✏️ Написать свою тему", callback_data="custom_theme")])
                 
                 reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(themes_text, reply_markup=reply_markup, parse_mode='HTML')
+                await traced(query.edit_message_text(themes_text, reply_markup=reply_markup, parse_mode='HTML'),
+                             "telegram.edit_message_text")
                 
-                # Отправляем статистику, если включена
+                # Записываем вызов в журнал и отправляем статистику, если включена
                 if usage:
                     user_id = query.from_user.id
+                    current = get_ledger().record(user_id, "Генерация тем", technique, usage)
                     settings = get_user_settings(user_id)
                     if settings['show_token_stats']:
-                        stats_text = format_token_stats("Генерация тем", usage, user_id)
-                        await query.message.reply_text(stats_text, parse_mode='HTML')
+                        stats_text = format_token_stats("Генерация тем", current, user_id)
+                        await traced(query.message.reply_text(stats_text, parse_mode='HTML'))
                     
             except Exception as e:
                 logger.error(f"Ошибка генерации тем: {e}")
-                await query.message.reply_text(f"❌ Ошибка: {e}\n\nИспользуйте /start")
+                mark_error(e)
+                await traced(query.message.reply_text(f"❌ Ошибка: {e}\n\nИспользуйте /start"))
         
         # Завершить
         elif data == "finish":
-            await query.edit_message_text(
+            await self.show(
+                query, from_post,
                 "✅ Работа завершена!\n\n"
                 "Используйте /start для новой сессии.",
                 parse_mode='HTML'
             )
             context.user_data.clear()
+            self.prefetcher.discard(query.from_user.id)
         
         # Настройки
         elif data == "settings":
@@ -628,47 +1175,34 @@ class TelegramSMMBot:
         # Сброс счетчиков сессии
         elif data == "reset_stats":
             user_id = query.from_user.id
-            USER_SESSION_STATS[user_id] = {
-                'total_input_tokens': 0,
-                'total_output_tokens': 0,
-                'total_cached_tokens': 0,
-                'total_reasoning_tokens': 0,
-                'total_requests': 0,
-                'total_tokens': 0
-            }
+            get_ledger().reset_session(user_id)
             await query.answer("✅ Счетчики сессии сброшены", show_alert=True)
             await self.show_settings_menu(query, context)
         
         # Показать текущую статистику сессии
         elif data == "view_stats":
             user_id = query.from_user.id
-            stats = get_user_stats(user_id)
+            stats = get_ledger().session(user_id)
             
-            if stats['total_requests'] == 0:
+            if stats['requests'] == 0:
                 await query.answer("⚠️ Запросов ещё не было", show_alert=True)
             else:
-                total_cost = (
-                    (stats['total_input_tokens'] - stats['total_cached_tokens']) / 1000 * PRICING['input'] +
-                    stats['total_cached_tokens'] / 1000 * PRICING['cached'] +
-                    stats['total_output_tokens'] / 1000 * PRICING['output']
-                )
-                cache_percent = (stats['total_cached_tokens'] / stats['total_input_tokens'] * 100) if stats['total_input_tokens'] > 0 else 0
-                avg_tokens = stats['total_tokens'] / stats['total_requests']
+                cache_percent = (stats['cached_tokens'] / stats['input_tokens'] * 100) if stats['input_tokens'] > 0 else 0
+                avg_tokens = stats['total_tokens'] / stats['requests']
                 
                 stats_text = f"📊 <b>СТАТИСТИКА СЕССИИ</b>\n\n"
-                stats_text += f"📦 <b>Запросов:</b> {stats['total_requests']}\n\n"
+                stats_text += f"📦 <b>Запросов:</b> {stats['requests']}\n\n"
                 stats_text += f"🔢 <b>Токены:</b>\n"
                 stats_text += f"   • Всего: {stats['total_tokens']}\n"
-                stats_text += f"   • Входные: {stats['total_input_tokens']}\n"
-                stats_text += f"      └ из кеша: {stats['total_cached_tokens']} ({cache_percent:.1f}% 💾)\n"
-                stats_text += f"   • Выходные: {stats['total_output_tokens']}\n"
-                if stats['total_reasoning_tokens'] > 0:
-                    stats_text += f"      └ reasoning: {stats['total_reasoning_tokens']}\n"
+                stats_text += f"   • Входные: {stats['input_tokens']}\n"
+                stats_text += f"      └ из кеша: {stats['cached_tokens']} ({cache_percent:.1f}% 💾)\n"
+                stats_text += f"   • Выходные: {stats['output_tokens']}\n"
+                if stats['reasoning_tokens'] > 0:
+                    stats_text += f"      └ reasoning: {stats['reasoning_tokens']}\n"
                 stats_text += f"   • Средне/запрос: {avg_tokens:.0f}\n\n"
-                stats_text += f"💰 <b>Общая стоимость:</b> ~{total_cost:.4f} ₽\n"
-                if stats['total_cached_tokens'] > 0:
-                    saved = (stats['total_cached_tokens'] / 1000 * (PRICING['input'] - PRICING['cached']))
-                    stats_text += f"   └ Экономия на кеше: ~{saved:.4f} ₽"
+                stats_text += f"💰 <b>Общая стоимость:</b> ~{stats['cost']:.4f} ₽\n"
+                if stats['cached_tokens'] > 0:
+                    stats_text += f"   └ Экономия на кеше: ~{cache_savings(stats['cached_tokens']):.4f} ₽"
                 
                 await query.answer()
                 await query.message.reply_text(stats_text, parse_mode='HTML')
@@ -688,6 +1222,7 @@ class TelegramSMMBot:
         # Обработка кнопки "Начать заново"
         if text == "🔄 Начать заново":
             context.user_data.clear()
+            self.prefetcher.discard(update.effective_user.id)
             await self.start_command(update, context)
             return
         
@@ -708,15 +1243,11 @@ class TelegramSMMBot:
         if context.user_data.get('waiting_custom_theme'):
             theme_name = text
             context.user_data['current_theme'] = theme_name
+            context.user_data.pop('skip_semantic_cache', None)
             context.user_data['waiting_custom_theme'] = False
             
             # Запрашиваем длину поста (используем индекс вместо названия темы)
-            keyboard = [
-                [InlineKeyboardButton("📏 500 символов", callback_data="len_500")],
-                [InlineKeyboardButton("📏 700 символов", callback_data="len_700")],
-                [InlineKeyboardButton("📏 1000 символов", callback_data="len_1000")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = self.length_keyboard(theme_name, context.user_data['technique'])
             
             await update.message.reply_text(
                 f"✅ Тема: <b>{theme_name}</b>\n\nВыберите длину поста:",
@@ -776,290 +1307,314 @@ class TelegramSMMBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='HTML')
     
-    def parse_themes_list(self, themes_text: str) -> list:
-        """Парсит список тем из текста (берет последние 10 если есть дубликаты)"""
-        import re
-        
-        themes = []
-        # Ищем темы с разными форматами нумерации
-        patterns = [
-            r'[1-9]️⃣\s+([^\[\n]+)',  # 1️⃣-9️⃣ (цифры с эмодзи)
-            r'🔟\s+([^\[\n]+)',        # 🔟 (специальный эмодзи для "10")
-            r'^\d+\)\s+([^\[\n]+)',            # 1) Тема
-            r'^\d+\.\s+([^\[\n]+)',            # 1. Тема
+    async def show(self, query, new_message: bool, text: str, **kwargs):
+        """Показывает следующий экран: редактирует сообщение с кнопками или отправляет новое"""
+        if new_message:
+            return await query.message.reply_text(text, **kwargs)
+        return await query.edit_message_text(text, **kwargs)
+
+    def post_menu(self, prefix: str = "", from_cache: bool = False) -> InlineKeyboardMarkup:
+        """Меню действий после поста (короткие callback без темы)
+
+        Args:
+            prefix: префикс callback (POST_MENU_PREFIX - меню прикреплено к посту)
+            from_cache: пост взят из семантического кеша - предлагаем сгенерировать заново
+        """
+        keyboard = []
+        if from_cache:
+            keyboard.append([InlineKeyboardButton("🔄 Сгенерировать заново", callback_data=f"{prefix}regen_fresh")])
+        keyboard.append([InlineKeyboardButton("🔄 Новый пост на эту тему", callback_data=f"{prefix}regen")])
+        if POST_VARIANTS > 1:
+            keyboard.append([InlineKeyboardButton(f"🔀 Варианты на эту тему ({POST_VARIANTS} шт.)",
+                                                  callback_data=f"{prefix}variants")])
+        keyboard += [
+            [InlineKeyboardButton("📋 Другая тема", callback_data=f"{prefix}other_theme")],
+            [InlineKeyboardButton("🆕 Новые темы", callback_data=f"{prefix}new_themes")],
+            [InlineKeyboardButton("🏁 Завершить", callback_data=f"{prefix}finish")],
         ]
-        
-        all_themes = []
-        for pattern in patterns:
-            matches = re.findall(pattern, themes_text, re.MULTILINE)
-            if matches:
-                for match in matches:
-                    theme = match.strip()
-                    # Удаляем текст в скобках и квадратных скобках в конце
-                    theme = re.sub(r'\s*[\[\(].*$', '', theme).strip()
-                    if theme:
-                        all_themes.append(theme)
-        
-        logger.info(f"parse_themes_list: найдено {len(all_themes)} тем (до удаления дубликатов)")
-        
-        # Если нашли больше 10 тем (значит дубликаты), берем последние 10
-        if len(all_themes) > 10:
-            unique_themes = []
-            for theme in reversed(all_themes):  # Идем с конца
-                if theme not in unique_themes:
-                    unique_themes.insert(0, theme)
-                if len(unique_themes) == 10:
-                    break
-            logger.info(f"parse_themes_list: возвращаем {len(unique_themes)} уникальных тем")
-            return unique_themes
-        
-        # Иначе убираем дубликаты сохраняя порядок
-        seen = set()
-        for theme in all_themes:
-            if theme not in seen:
-                seen.add(theme)
-                themes.append(theme)
-        
-        logger.info(f"parse_themes_list: возвращаем {len(themes)} тем (после удаления дубликатов)")
-        return themes[:10]  # Возвращаем максимум 10 тем
+        return InlineKeyboardMarkup(keyboard)
+
+    def length_keyboard(self, theme_name: str, technique: str) -> InlineKeyboardMarkup:
+        """Клавиатура выбора длины поста с локальной оценкой времени и стоимости (без API)"""
+        keyboard = []
+        for post_length in (500, 700, 1000):
+            button_text = f"📏 {post_length} символов"
+            try:
+                estimate = self.natrium_bot.estimate(theme=theme_name, technique=technique, post_length=post_length)
+                button_text += f" ({format_estimate_hint(estimate)})"
+            except Exception as e:
+                logger.warning(f"Не удалось оценить запрос: {e}")
+            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"len_{post_length}")])
+        return InlineKeyboardMarkup(keyboard)
+
+    async def generate_post_callback(self, query, theme_name: str, technique: str, post_length: int,
+                                     use_cache: bool = True, new_message: bool = False):
+        """Генерирует пост и отправляет пользователю
+
+        Args:
+            use_cache: искать готовый пост на близкую тему в семантическом кеше
+            new_message: статус отправить новым сообщением (нажатие из меню под постом)
+        """
+        with span("generate_post_callback", theme=theme_name, technique=technique, post_length=post_length):
+            if use_cache and await self._send_cached_post(query, theme_name, technique, post_length, new_message):
+                return
+            note = ""
+            if use_cache and POST_ARCHIVE_DEDUP_MODE != 'off':
+                recent = get_archive().find_recent(theme_name, POST_ARCHIVE_DEDUP_DAYS)
+                if recent is not None:
+                    note = (f"⚠️ Пост на похожую тему уже был {format_age(recent['ts'])}: "
+                            f"<b>{escape(recent['theme'])}</b>\n\n")
+                    if POST_ARCHIVE_DEDUP_MODE == 'block':
+                        # Повтор генерируем только по явному подтверждению
+                        await self.show(
+                            query, new_message,
+                            f"{note}Сгенерировать ещё один пост на эту тему?",
+                            reply_markup=InlineKeyboardMarkup([
+                                [InlineKeyboardButton("✍️ Всё равно сгенерировать", callback_data="regen_fresh")],
+                                [InlineKeyboardButton("📋 Другая тема", callback_data="other_theme")],
+                            ]),
+                            parse_mode='HTML'
+                        )
+                        return
+            await self._generate_post(query, theme_name, technique, post_length, new_message, note)
 
-    async def generate_post_callback(self, query, theme_name: str, technique: str, post_length: int):
-        """Генерирует пост и отправляет пользователю"""
-        await query.edit_message_text(
-            f"✍️ Генерирую пост на тему: <b>{theme_name}</b>\n"
+    async def _send_cached_post(self, query, theme_name: str, technique: str, post_length: int,
+                                new_message: bool) -> bool:
+        """Отправляет пост из семантического кеша; False - подходящего поста нет"""
+        with span("semantic_cache.lookup") as lookup_span:
+            found = self.semantic_cache.lookup(theme_name, technique, post_length)
+            lookup_span.set_attribute("hit", found is not None)
+        if found is None:
+            return False
+
+        entry, similarity = found
+        await traced(self.show(
+            query, new_message,
+            f"♻️ Похожий пост уже есть: <b>{escape(entry['theme'])}</b>\n"
+            f"📊 Сходство тем: {similarity * 100:.0f}%, длина: {post_length} символов\n\n"
+            "Не подходит - нажмите «🔄 Сгенерировать заново».",
+            parse_mode='HTML'
+        ), "telegram.edit_message_text")
+
+        parts = split_message(entry['post'])
+        for part in parts[:-1]:
+            await traced(query.message.reply_text(part, parse_mode='HTML'), length=len(part))
+        await traced(query.message.reply_text(
+            parts[-1],
+            reply_markup=self.post_menu(POST_MENU_PREFIX, from_cache=True),
+            parse_mode='HTML'
+        ), length=len(parts[-1]))
+        return True
+
+    async def _generate_post(self, query, theme_name: str, technique: str, post_length: int,
+                             new_message: bool = False, note: str = ""):
+        estimate = self.natrium_bot.estimate(theme=theme_name, technique=technique, post_length=post_length)
+        await traced(self.show(
+            query, new_message,
+            f"{note}✍️ Генерирую пост на тему: <b>{theme_name}</b>\n"
             f"📊 Длина: {post_length} символов\n\n"
-            f"⏳ Пожалуйста, подождите...",
+            f"⏳ Пожалуйста, подождите ({format_estimate_hint(estimate)})...",
             parse_mode='HTML'
-        )
+        ), "telegram.edit_message_text")
         
         try:
-            post, usage = self.natrium_bot.generate_post(
-                theme=theme_name,
-                technique=technique,
-                post_length=post_length
-            )
-            
-            # КРИТИЧЕСКОЕ ЛОГИРОВАНИЕ: проверяем что пришло от Яндекса
-            logger.info(f"===== RAW POST FROM YANDEX (before processing) =====")
-            logger.info(f"Length: {len(post)} chars")
-            logger.info(f"First 200 chars: {post[:200]}")
-            logger.info(f"Contains **: {('**' in post)}")
-            if '**' in post:
-                # Найдем все вхождения **
-                import re
-                bold_markers = re.findall(r'\*\*[^*]+\*\*', post)
-                logger.info(f"Found {len(bold_markers)} bold markers: {bold_markers[:3]}")
-            logger.info(f"=============================================\n")
-            
-            # КРИТИЧЕСКИ ВАЖНО: Полное удаление всех символов цитирования
-            # Но НЕ трогаем содержимое поста!
-            
-            # КРИТИЧЕСКИ ВАЖНО: Удаляем шаги рассуждений модели
-            # МЕТОД 1: Ищем маркер "ГОТОВЫЙ ПОСТ:"
-            # МЕТОД 2: Ищем строку с эмодзи поста (💪🧠💤🔥⚡️💓🍽️) + ** + CAPS
-            # МЕТОД 3: Удаляем строки с артефактами рассуждений
-            
-            lines = post.split('\n')
-            post_start_index = None
+            post, usage = None, None
             
-            # Эмодзи заголовков постов (НЕ путать с 🔄 🏋️ из рассуждений)
-            post_emojis = ['💪', '🧠', '💤', '🔥', '⚡️', '💓', '🍽️', '🏃', '⚡', '📊', '🎯']
+            # Подхватываем спекулятивную предгенерацию (готовую или ещё выполняющуюся)
+            prefetched = self.prefetcher.take(query.from_user.id, theme_name, technique, post_length)
+            if prefetched is not None:
+                try:
+                    with span("prefetch.wait"):
+                        post, usage = await asyncio.wrap_future(prefetched)
+                except Exception as e:
+                    logger.warning(f"Предгенерация завершилась ошибкой, генерируем заново: {e}")
             
-            # Артефакты рассуждений (удаляем эти строки ПОЛНОСТЬЮ)
-            reasoning_markers = [
-                '🔄 Сначала мне нужно',
-                '[Вызов функции',
-                'search_index',
-                'web_search',
-                'FileSearch',
-                'Web Search',
-                'ГЕНЕРИРУЮ',
-                'Шаг 1',
-                'Шаг 2',
-                'Шаг 3',
-                'для поиска',
-                'с запросом'
-            ]
-            
-            # МЕТОД 1: Ищем маркер "ГОТОВЫЙ ПОСТ:"
-            for i, line in enumerate(lines):
-                if 'ГОТОВЫЙ ПОСТ:' in line.strip():
-                    post_start_index = i + 1  # Начало после маркера
-                    logger.info(f"Found 'ГОТОВЫЙ ПОСТ:' marker at line {i}")
-                    break
-            
-            # МЕТОД 2: Если маркера нет, ищем по эмодзи + ** + CAPS
-            if post_start_index is None:
-                for i, line in enumerate(lines):
-                    stripped = line.strip()
-                    if not stripped or len(stripped) < 10:
-                        continue
-                    
-                    # Пропускаем рассуждения
-                    if any(marker in stripped for marker in reasoning_markers):
-                        continue
-                    if stripped.startswith('{'):
-                        continue
-                    
-                    # Ищем: эмодзи поста в начале + ** + CAPS
-                    starts_with_post_emoji = any(stripped.startswith(emoji) for emoji in post_emojis)
-                    if starts_with_post_emoji and '**' in stripped and any(c.isupper() for c in stripped):
-                        post_start_index = i
-                        logger.info(f"Found post start by emoji+CAPS pattern at line {i}")
-                        break
-            
-            # Если нашли начало поста, берем только с этого момента
-            if post_start_index is not None:
-                removed_count = post_start_index
-                lines = lines[post_start_index:]
-                logger.info(f"Removed {removed_count} lines of reasoning steps")
-            else:
-                logger.warning("No reasoning steps detected, using full response")
-            
-            # Удаляем ТОЛЬКО начальные пустые строки и строки с >
-            # Пропускаем пустые строки и строки с > В НАЧАЛЕ документа
-            while lines and (not lines[0].strip() or lines[0].strip().startswith('>')):
-                lines.pop(0)
-            
-            post = '\n'.join(lines).strip()
-            
-            # КРИТИЧЕСКИ ВАЖНО: Удаляем тройные обратные кавычки (```), которые конфликтуют с форматированием
-            post = post.replace('```', '')
-            logger.info(f"Removed ``` markers")
-            
-            # КРИТИЧЕСКОЕ ЛОГИРОВАНИЕ: проверяем что осталось после очистки
-            logger.info(f"===== POST AFTER CLEANING (before HTML conversion) =====")
-            logger.info(f"Length: {len(post)} chars")
-            logger.info(f"Contains **: {('**' in post)}")
-            logger.info(f"Contains [link]: {('[' in post and '](' in post)}")
-            if '**' in post:
-                import re
-                bold_markers = re.findall(r'\*\*[^*]+\*\*', post)
-                logger.info(f"Found {len(bold_markers)} bold markers after cleaning")
-            logger.info(f"=============================================\n")
-            
-            # НЕ проверяем парность ** - это сделает convert_markdown_to_html()
-            # Удаляем старую валидацию для Markdown
-            
-            # Нормализация источников: WHO → ВОЗ для единообразия
-            post = post.replace('WHO', 'ВОЗ')
-            post = post.replace('(WHO)', '(ВОЗ)')
-            logger.info(f"Normalized WHO → ВОЗ for consistency")
-            
-            # КРИТИЧЕСКИ ВАЖНО: Конвертируем Markdown в HTML ДО обработки источников
-            # Это сохранит правильные ссылки [PubMed](URL) → <a href="URL">PubMed</a>
-            # Яндекс генерирует ссылки в формате [текст](URL)
-            # Telegram с parse_mode='HTML' требует <a href="URL">текст</a>
-            post = convert_markdown_to_html(post)
-            logger.info(f"Converted Markdown to HTML (links preserved)")
-            
-            # ПОСЛЕ конвертации в HTML обрабатываем источники
-            # Теперь ссылки в формате <a href="URL">PubMed</a> и мы их НЕ трогаем
-            import re
-            
-            # СНАЧАЛА обрабатываем crossfit.com (чтобы не превратить в (CrossFit).com)
-            # Обрабатываем разные случаи: с точкой, точкой с запятой, переносом строки, в конце
-            # НО НЕ трогаем если это внутри HTML тега <a>
-            # Паттерн: crossfit.com НЕ внутри <a>...</a>
-            post = re.sub(r'(?<!>)\s+crossfit\.com([\.;,!\?])', r' (crossfit.com)\1', post, flags=re.IGNORECASE)
-            post = re.sub(r'(?<!>)\s+crossfit\.com\n', r' (crossfit.com)\n', post, flags=re.IGNORECASE)
-            post = re.sub(r'(?<!>)\s+crossfit\.com$', r' (crossfit.com)', post, flags=re.IGNORECASE)
-            
-            # ПОТОМ обрабатываем остальные источники (но НЕ CrossFit без .com)
-            # Расширенная обработка: точка, точка с запятой, запятая, восклицательный знак, вопросительный знак
-            # ВАЖНО: НЕ трогаем источники внутри HTML тегов <a>источник</a>
-            sources = ['ВОЗ', 'PubMed', 'Исследования', 'Исследование']
-            for source in sources:
-                # Заменяем источник с разными знаками препинания ТОЛЬКО если он НЕ внутри <a>...</a>
-                # Negative lookbehind (?<!>) - НЕ после >
-                # Пример: "текст ВОЗ." → "текст (ВОЗ).", "текст PubMed;" → "текст (PubMed);"
-                # НО: "<a href='...'>PubMed</a>" остаётся без изменений
-                post = re.sub(rf'(?<!>)\s+{source}([\.;,!\?])', f' ({source})\\1', post)
-                post = re.sub(rf'(?<!>)\s+{source}\n', f' ({source})\n', post)
-                post = re.sub(rf'(?<!>)\s+{source}$', f' ({source})', post)
-            
-            logger.info(f"Wrapped sources in parentheses (ВОЗ, PubMed, Исследования, crossfit.com)")
-            
-            # ДОПОЛНИТЕЛЬНО: Если остались артефакты типа (PubMed)(URL) - исправляем их
-            # Это происходит если Яндекс сгенерировал (Source)(URL) вместо [Source](URL)
-            # Конвертируем (Source)(URL) → <a href="URL">Source</a>
-            for source in sources + ['crossfit.com', 'ВОЗ']:
-                # Паттерн: (Источник)(http...)
-                pattern = rf'\({re.escape(source)}\)\((https?://[^\)]+)\)'
-                replacement = f'<a href="\\1">{source}</a>'
-                post = re.sub(pattern, replacement, post, flags=re.IGNORECASE)
-            
-            logger.info(f"Fixed malformed links (Source)(URL) → <a href>Source</a>")
-            
-            # КРИТИЧЕСКИ ВАЖНО: Удаляем артефакты рассуждений модели после хештегов
-            # Ищем последнюю строку с хештегами (начинается с #)
-            lines = post.split('\n')
-            last_hashtag_index = -1
-            for i in range(len(lines) - 1, -1, -1):
-                stripped = lines[i].strip()
-                if stripped and stripped.startswith('#'):
-                    last_hashtag_index = i
-                    break
-            
-            # Если нашли хештеги, обрезаем все что после них
-            if last_hashtag_index >= 0:
-                # Берем только строки до хештегов включительно
-                post = '\n'.join(lines[:last_hashtag_index + 1])
-                logger.info(f"Removed reasoning artifacts after hashtags (line {last_hashtag_index})")
+            if post is None:
+                post, usage = await asyncio.to_thread(
+                    self.natrium_bot.generate_post,
+                    theme=theme_name,
+                    technique=technique,
+                    post_length=post_length
+                )
             
-            # HTML конвертация уже выполнена ВЫШЕ (до обработки источников)
-            # Это важно для сохранения правильных ссылок [text](URL) → <a href="URL">text</a>
+            get_archive().add(to_markdown(post), theme_name, technique, post_length, usage,
+                              source='telegram', user_id=query.from_user.id)
             
-            # ФИНАЛЬНОЕ ЛОГИРОВАНИЕ перед отправкой в Telegram
-            logger.info(f"===== FINAL TEXT SENT TO TELEGRAM =====")
-            logger.info(f"Length: {len(post)} chars")
-            logger.info(f"Contains <a href: {('<a href' in post)}")
-            logger.info(f"Contains <b>: {('<b>' in post)}")
-            logger.info(f"First 200 chars: {post[:200]}")
-            logger.info(f"Last 200 chars: {post[-200:]}")
-            logger.info(f"=====================================\n")
+            with span("post_processing", raw_length=len(post)) as processing:
+                post = render_post(post)
+                processing.set_attribute("length", len(post))
+            self.semantic_cache.store(theme_name, technique, post_length, post, usage)
             
-            # Отправляем пост БЕЗ заголовка (для прямого копирования в канал)
-            await query.message.reply_text(
-                post,
-                parse_mode='HTML'
-            )
-            
-            # Отправляем статистику, если включена
+            # Записываем вызов в журнал; статистику показываем, если включена
+            stats_text = None
             if usage:
                 # Получаем user_id из context (query.from_user может быть недоступен)
                 user_id = query.from_user.id
+                current = get_ledger().record(user_id, "Генерация поста", technique, usage)
                 settings = get_user_settings(user_id)
                 if settings['show_token_stats']:
-                    stats_text = format_token_stats("Генерация поста", usage, user_id)
-                    await query.message.reply_text(stats_text, parse_mode='HTML')
+                    stats_text = format_token_stats("Генерация поста", current, user_id)
             
-            # Меню действий (используем короткие callback без темы)
-            keyboard = [
-                [InlineKeyboardButton("🔄 Новый пост на эту тему", callback_data="regen")],
-                [InlineKeyboardButton("📋 Другая тема", callback_data="other_theme")],
-                [InlineKeyboardButton("🆕 Новые темы", callback_data="new_themes")],
-                [InlineKeyboardButton("🏁 Завершить", callback_data="finish")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Отправляем пост БЕЗ заголовка (для прямого копирования в канал)
+            # Посты длиннее лимита Telegram делим по абзацам с сохранением тегов
+            parts = split_message(post)
+            menu_text = "🎯 <b>Что делать дальше?</b>"
             
-            await query.message.reply_text(
-                "🎯 <b>Что делать дальше?</b>",
-                reply_markup=reply_markup,
-                parse_mode='HTML'
-            )
+            if stats_text is None:
+                # Меню прикрепляем к последней части поста - одно сообщение вместо двух
+                for part in parts[:-1]:
+                    await traced(query.message.reply_text(part, parse_mode='HTML'), length=len(part))
+                await traced(query.message.reply_text(
+                    parts[-1],
+                    reply_markup=self.post_menu(POST_MENU_PREFIX),
+                    parse_mode='HTML'
+                ), length=len(parts[-1]))
+            else:
+                # Статистику не смешиваем с постом (его копируют в канал) - объединяем её с меню
+                for part in parts:
+                    await traced(query.message.reply_text(part, parse_mode='HTML'), length=len(part))
+                await traced(query.message.reply_text(
+                    f"{stats_text}\n\n{menu_text}",
+                    reply_markup=self.post_menu(),
+                    parse_mode='HTML'
+                ))
             
         except Exception as e:
             logger.error(f"Ошибка генерации поста: {e}")
-            await query.message.reply_text(
+            mark_error(e)
+            await traced(query.message.reply_text(
                 f"❌ Ошибка при генерации поста: {e}\n\n"
                 "Попробуйте ещё раз или используйте /start"
-            )
+            ))
+
+    def variant_keyboard(self, count: int, index: int) -> InlineKeyboardMarkup:
+        """Листание вариантов поста и меню действий"""
+        nav = []
+        if index > 0:
+            nav.append(InlineKeyboardButton("◀️", callback_data=f"var_{index - 1}"))
+        nav.append(InlineKeyboardButton(f"{index + 1}/{count}", callback_data="var_noop"))
+        if index < count - 1:
+            nav.append(InlineKeyboardButton("▶️", callback_data=f"var_{index + 1}"))
+        keyboard = [nav, [InlineKeyboardButton("✅ Выбрать этот вариант", callback_data=f"var_pick_{index}")]]
+        return InlineKeyboardMarkup(keyboard + list(self.post_menu(POST_MENU_PREFIX).inline_keyboard))
+
+    @staticmethod
+    def variant_page(post: str) -> str:
+        """Текст страницы варианта: одно сообщение (длинный вариант целиком - по кнопке «Выбрать»)"""
+        parts = split_message(post)
+        return parts[0] if len(parts) == 1 else f"{parts[0]}\n\n<i>… продолжение - по кнопке «Выбрать»</i>"
+
+    async def _handle_variant(self, query, context: ContextTypes.DEFAULT_TYPE, action: str):
+        """Листание вариантов (правка сообщения) и отправка выбранного варианта отдельным постом"""
+        state = context.user_data.get('variants')
+        if action == "noop":
+            return
+        if not state:
+            await query.message.reply_text("⚠️ Варианты устарели. Нажмите «🔀 Варианты на эту тему» ещё раз.")
+            return
+
+        posts = state['posts']
+        if action.startswith("pick_"):
+            index = int(action[len("pick_"):])
+            if not 0 <= index < len(posts):
+                return
+            post = posts[index]
+            self.semantic_cache.store(state['theme'], state['technique'], state['post_length'], post, state['usages'][index])
+            parts = split_message(post)
+            for part in parts[:-1]:
+                await traced(query.message.reply_text(part, parse_mode='HTML'), length=len(part))
+            await traced(query.message.reply_text(
+                parts[-1],
+                reply_markup=self.post_menu(POST_MENU_PREFIX),
+                parse_mode='HTML'
+            ), length=len(parts[-1]))
+            return
+
+        index = int(action)
+        if 0 <= index < len(posts):
+            await traced(query.edit_message_text(
+                self.variant_page(posts[index]),
+                reply_markup=self.variant_keyboard(len(posts), index),
+                parse_mode='HTML'
+            ), "telegram.edit_message_text")
+
+    async def _generate_variants(self, query, context: ContextTypes.DEFAULT_TYPE, theme_name: str, technique: str,
+                                 post_length: int, new_message: bool = False):
+        """Генерирует POST_VARIANTS вариантов поста одним запросом и показывает их страницами"""
+        count = POST_VARIANTS
+        estimate = self.natrium_bot.estimate(theme=theme_name, technique=technique, post_length=post_length,
+                                             variants=count)
+        status = await traced(self.show(
+            query, new_message,
+            f"🔀 Генерирую варианты поста ({count} шт.) на тему: <b>{escape(theme_name)}</b>\n"
+            f"📊 Длина: {post_length} символов\n\n"
+            f"⏳ Пожалуйста, подождите ({format_estimate_hint(estimate)})...",
+            parse_mode='HTML'
+        ), "telegram.edit_message_text")
+
+        try:
+            started = time.perf_counter()
+            with span("generate_variants", theme=theme_name, variants=count):
+                posts, usage = await asyncio.to_thread(
+                    self.natrium_bot.generate_post,
+                    theme=theme_name,
+                    technique=technique,
+                    post_length=post_length,
+                    variants=count
+                )
+            elapsed = time.perf_counter() - started
+            user_id = query.from_user.id
+
+            # Каждый вариант - отдельный пост в архиве с долей общего usage
+            usages = split_usage(usage, len(posts))
+            for post, share in zip(posts, usages):
+                get_archive().add(to_markdown(post), theme_name, technique, post_length, share,
+                                  source='telegram', user_id=user_id)
+
+            with span("post_processing", variants=len(posts)):
+                rendered = [render_post(post) for post in posts]
+            context.user_data['variants'] = {
+                'theme': theme_name,
+                'technique': technique,
+                'post_length': post_length,
+                'posts': rendered,
+                'usages': usages
+            }
+
+            stats_text = None
+            summary = f"🔀 Готово: вариантов {len(posts)} за один запрос, {elapsed:.0f} с"
+            if usage:
+                current = get_ledger().record(user_id, "Генерация вариантов поста", technique, usage)
+                summary += f", ~{current['cost'] / len(posts):.4f} ₽ за вариант"
+                if get_user_settings(user_id)['show_token_stats']:
+                    stats_text = format_token_stats("Генерация вариантов поста", current, user_id)
+            if hasattr(status, 'edit_text'):
+                await traced(status.edit_text(f"{summary}\nЛистайте ◀️ ▶️ и выберите лучший.", parse_mode='HTML'),
+                             "telegram.edit_message_text")
+
+            await traced(query.message.reply_text(
+                self.variant_page(rendered[0]),
+                reply_markup=self.variant_keyboard(len(rendered), 0),
+                parse_mode='HTML'
+            ), length=len(rendered[0]))
+            if stats_text:
+                await traced(query.message.reply_text(stats_text, parse_mode='HTML'))
+
+        except Exception as e:
+            logger.error(f"Ошибка генерации вариантов поста: {e}")
+            mark_error(e)
+            await traced(query.message.reply_text(
+                f"❌ Ошибка при генерации вариантов: {e}\n\n"
+                "Попробуйте ещё раз или используйте /start"
+            ))
 
     def run(self):
         """Запуск бота"""
         logger.info("🚀 Telegram-бот запущен!")
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            self.application.run_polling(allowed_updates=Update.ALL_TYPES)
+        finally:
+            self.prefetcher.shutdown()
 
 
 if __name__ == "__main__":
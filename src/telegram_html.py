@@ -0,0 +1,270 @@
+import html
+import re
+
+# Лимит длины одного сообщения Telegram (символы после разбора разметки, UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Максимальная длина URL в ссылке [текст](URL) - ограничивает просмотр вперёд
+MAX_URL_LENGTH = 2048
+
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+_EMPHASIS_TAGS = {'**': 'b', '*': 'i'}
+# Символы, на которых рендер останавливается; обычный текст между ними копируется целиком
+_SPECIAL_RE = re.compile(r'[*\[\]\n&<>]')
+
+
+def escape(text: str) -> str:
+    """Экранирует &, <, > для parse_mode='HTML'"""
+    return html.escape(text, quote=False)
+
+
+def markdown_to_html(text: str) -> str:
+    """Конвертирует Markdown ответа модели в HTML для Telegram за один проход
+
+    Поддерживаемые преобразования:
+    - [текст](URL) → <a href="URL">текст</a>
+    - **текст** → <b>текст</b>
+    - *текст* → <i>текст</i> (кроме * в начале строки - это буллеты)
+
+    Символы &, <, > экранируются. Незакрытые или перекрёстные маркеры
+    остаются обычным текстом, поэтому теги в результате всегда сбалансированы.
+    Разметка не переходит через перевод строки.
+
+    Args:
+        text: Текст с Markdown форматированием
+
+    Returns:
+        Текст с HTML форматированием
+    """
+    out = []      # фрагменты результата; открывающие маркеры - заглушки с индексом в out
+    stack = []    # открытые маркеры: [marker, index_in_out]
+    counts = {'**': 0, '*': 0, '[': 0}
+
+    def drop_above(depth: int) -> None:
+        # Маркеры выше depth так и не закрылись - остаются текстом
+        while len(stack) > depth:
+            marker, _ = stack.pop()
+            counts[marker] -= 1
+
+    def find(marker: str) -> int:
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == marker:
+                return depth
+        return -1
+
+    i = 0
+    n = len(text)
+    plain_start = 0
+
+    while i < n:
+        special = _SPECIAL_RE.search(text, i)
+        if special is None:
+            break
+        i = special.start()
+        ch = text[i]
+
+        # Сбрасываем накопленный обычный текст
+        if plain_start < i:
+            out.append(text[plain_start:i])
+
+        if ch == '\n':
+            drop_above(0)
+            out.append('\n')
+            i += 1
+
+        elif ch in _ESCAPES:
+            out.append(_ESCAPES[ch])
+            i += 1
+
+        elif ch == '*':
+            marker = '**' if text.startswith('**', i) else '*'
+            end = i + len(marker)
+            prev_char = text[i - 1] if i > 0 else '\n'
+            next_char = text[end] if end < n else '\n'
+            can_close = counts[marker] > 0 and not prev_char.isspace()
+            can_open = not next_char.isspace() and not (marker == '*' and prev_char == '\n')
+
+            if can_close:
+                depth = find(marker)
+                drop_above(depth + 1)
+                _, index = stack.pop()
+                counts[marker] -= 1
+                tag = _EMPHASIS_TAGS[marker]
+                out[index] = f'<{tag}>'
+                out.append(f'</{tag}>')
+            elif can_open:
+                stack.append([marker, len(out)])
+                counts[marker] += 1
+                out.append(marker)
+            else:
+                out.append(marker)
+            i = end
+
+        elif ch == '[':
+            stack.append(['[', len(out)])
+            counts['['] += 1
+            out.append('[')
+            i += 1
+
+        else:  # ']'
+            url_end = _scan_url(text, i + 1) if counts['['] > 0 else -1
+            if url_end < 0:
+                out.append(']')
+                i += 1
+            else:
+                url = text[i + 2:url_end]
+                depth = find('[')
+                drop_above(depth + 1)
+                _, index = stack.pop()
+                counts['['] -= 1
+                out[index] = f'<a href="{html.escape(url, quote=True)}">'
+                out.append('</a>')
+                # Ссылки не вкладываются: внешние [ становятся текстом
+                for entry in stack:
+                    if entry[0] == '[':
+                        entry[0] = None
+                stack[:] = [entry for entry in stack if entry[0] is not None]
+                counts['['] = 0
+                i = url_end + 1
+
+        plain_start = i
+
+    if plain_start < n:
+        out.append(text[plain_start:])
+
+    return ''.join(out)
+
+
+def _scan_url(text: str, start: int) -> int:
+    """Проверяет "(URL)" с позиции start, возвращает индекс ")" или -1"""
+    if not text.startswith('(', start):
+        return -1
+    limit = min(len(text), start + 1 + MAX_URL_LENGTH)
+    for j in range(start + 1, limit):
+        c = text[j]
+        if c == ')':
+            return j if j > start + 1 else -1
+        if c.isspace() or c == '(':
+            return -1
+    return -1
+
+
+def visible_length(text: str) -> int:
+    """Длина текста так, как её считает Telegram (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+# Токены HTML: тег или текст между тегами
+_HTML_TOKEN_RE = re.compile(r'<(/?)([a-zA-Z]+)[^>]*>|[^<]+')
+# Разделители внутри текста по приоритету разбиения: абзац, строка, пробел
+_SEPARATOR_RE = re.compile(r'(\n\s*\n)|(\n)|([ \t]+)')
+_BREAK_LEVELS = ('paragraph', 'line', 'space')
+
+
+def _atoms(html_text: str) -> list:
+    """Разбивает HTML на атомы: ('open'|'close', raw, tag), ('text', str) и ('sep', str, level)"""
+    atoms = []
+    for match in _HTML_TOKEN_RE.finditer(html_text):
+        if match.group(2):
+            kind = 'close' if match.group(1) else 'open'
+            atoms.append((kind, match.group(0), match.group(2).lower()))
+            continue
+        text = html.unescape(match.group(0))
+        pos = 0
+        for sep in _SEPARATOR_RE.finditer(text):
+            if sep.start() > pos:
+                atoms.append(('text', text[pos:sep.start()]))
+            atoms.append(('sep', sep.group(0), _BREAK_LEVELS[sep.lastindex - 1]))
+            pos = sep.end()
+        if pos < len(text):
+            atoms.append(('text', text[pos:]))
+    return atoms
+
+
+def _render_atoms(atoms) -> str:
+    return ''.join(atom[1] if atom[0] in ('open', 'close') else escape(atom[1]) for atom in atoms)
+
+
+def split_message(html_text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Делит HTML на сообщения не длиннее limit видимых символов
+
+    Разрезает по границам абзацев, затем строк, затем пробелов; слово длиннее
+    лимита режется посимвольно. Теги, открытые на границе, закрываются в конце
+    одного сообщения и открываются заново в начале следующего.
+
+    Returns:
+        list: фрагменты HTML (один, если текст помещается целиком)
+    """
+    if visible_length(html_text) <= limit:
+        return [html_text]
+
+    atoms = _atoms(html_text)
+    chunks = []
+    stack = []  # открытые теги на начало текущего сообщения: [(raw, tag)]
+    i = 0
+
+    while i < len(atoms):
+        current = list(stack)
+        length = 0
+        breaks = {}  # level -> (индекс разделителя, открытые теги в этой точке)
+        j = i
+        while j < len(atoms):
+            atom = atoms[j]
+            if atom[0] == 'open':
+                current.append((atom[1], atom[2]))
+            elif atom[0] == 'close':
+                if current and current[-1][1] == atom[2]:
+                    current.pop()
+            else:
+                size = visible_length(atom[1])
+                if length + size > limit:
+                    break
+                if atom[0] == 'sep' and length > 0:
+                    breaks[atom[2]] = (j, list(current))
+                length += size
+            j += 1
+
+        if j == len(atoms):
+            body, next_i, next_stack = atoms[i:], j, current
+        else:
+            cut = next((breaks[level] for level in _BREAK_LEVELS if level in breaks), None)
+            if cut is not None:
+                end, next_stack = cut
+                body, next_i = atoms[i:end], end + 1
+            elif length >= limit:
+                body, next_i, next_stack = atoms[i:j], j, current
+            else:
+                # Разделителя нет - режем слово atoms[j] по остатку лимита
+                head, tail = _cut_text(atoms[j][1], limit - length)
+                if head:
+                    atoms[j:j + 1] = [('text', head), ('text', tail)]
+                    j += 1
+                elif length == 0:
+                    # Лимит меньше одного символа - символ всё равно уходит, иначе цикл не сдвинется
+                    atoms[j:j + 1] = [('text', tail[:1]), ('text', tail[1:])]
+                    j += 1
+                # Иначе даже первый символ (эмодзи - 2 единицы UTF-16) не влез - слово целиком в следующее сообщение
+                body, next_i, next_stack = atoms[i:j], j, current
+
+        opening = ''.join(raw for raw, _ in stack)
+        closing = ''.join(f'</{tag}>' for _, tag in reversed(next_stack))
+        chunk = (opening + _render_atoms(body) + closing).strip()
+        if chunk:
+            chunks.append(chunk)
+        stack = next_stack
+        i = next_i
+
+    return chunks
+
+
+def _cut_text(text: str, limit: int) -> tuple:
+    """Режет строку так, чтобы первая часть занимала не больше limit UTF-16 единиц
+
+    Если не влезает даже первый символ, первая часть пустая: ('', text).
+    """
+    size = 0
+    for index, ch in enumerate(text):
+        size += 2 if ord(ch) > 0xFFFF else 1
+        if size > limit:
+            return text[:index], text[index:]
+    return text, ''
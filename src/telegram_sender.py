@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: ~30 сообщений/с на бота, ~1 сообщение/с в личный чат, 20 сообщений/мин в группу
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 5
+
+# Методы, которые не ограничиваем (ответы на нажатия и служебные запросы)
+UNTHROTTLED_ENDPOINTS = {'answerCallbackQuery', 'getUpdates', 'getMe', 'setMyCommands', 'deleteWebhook'}
+
+# Сколько простаивающих чатов держать в памяти до очистки
+MAX_CHAT_BUCKETS = 1000
+
+
+class TokenBucket:
+    """Token bucket с резервированием: возвращает, сколько ждать до своего токена
+
+    Токены могут уходить в минус - так очередь ожидающих обслуживается
+    по порядку без блокировок (все вызовы идут из одного event loop).
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        """Ведро полностью восстановилось - его можно удалить"""
+        return self.tokens + (time.monotonic() - self.updated_at) * self.rate >= self.capacity
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Планировщик исходящих запросов Bot API для Application.builder().rate_limiter()
+
+    Каждый запрос к чату ждёт токен в ведре чата и в общем ведре бота.
+    На RetryAfter (flood control) чат ставится на паузу на указанное время,
+    и запрос повторяется - сообщения не теряются при всплесках.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, max_retries: int = 5):
+        """
+        Args:
+            global_rate: общий лимит сообщений в секунду
+            max_retries: сколько раз повторять запрос после RetryAfter
+        """
+        self.global_bucket = TokenBucket(global_rate, int(global_rate))
+        self.max_retries = max_retries
+        self._chat_buckets = {}  # {chat_id: TokenBucket}
+        self._paused_until = {}  # {chat_id: monotonic time}; None - пауза для всего бота
+
+        self.stats = {
+            'requests': 0,       # запросов через планировщик
+            'throttled': 0,      # запросов, которые ждали токен
+            'wait_s': 0.0,       # суммарное ожидание токенов
+            'retry_after': 0,    # полученных RetryAfter
+            'failed': 0          # запросов, не прошедших после max_retries
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {cid: b for cid, b in self._chat_buckets.items() if not b.idle()}
+            # Отрицательный chat_id (или @username) - группа или канал
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST) if is_group else TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_turn(self, chat_id) -> None:
+        waited = 0.0
+        for key in {None, chat_id}:
+            if key not in self._paused_until:
+                continue
+            pause = self._paused_until[key] - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                waited += pause
+            if self._paused_until.get(key, 0) <= time.monotonic():
+                self._paused_until.pop(key, None)
+
+        if chat_id is not None:
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                waited += delay
+        delay = self.global_bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+
+        if waited > 0:
+            self.stats['throttled'] += 1
+            self.stats['wait_s'] += waited
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in UNTHROTTLED_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        chat_id = data.get('chat_id')
+        self.stats['requests'] += 1
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_turn(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                self.stats['retry_after'] += 1
+                self._paused_until[chat_id] = time.monotonic() + seconds
+                logger.warning(f"Flood control: {endpoint} в чат {chat_id}, пауза {seconds:.0f} с (попытка {attempt + 1})")
+                if attempt == self.max_retries:
+                    self.stats['failed'] += 1
+                    raise
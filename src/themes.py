@@ -0,0 +1,90 @@
+import re
+from dataclasses import dataclass
+
+# Максимум тем в одном ответе агента
+MAX_THEMES = 10
+
+# Строка темы: необязательный маркер списка/жирного, затем номер
+# в виде 1️⃣..9️⃣, 🔟, "1." или "1)", затем текст темы
+_THEME_LINE_RE = re.compile(
+    r'^[ \t>*•-]*'
+    r'(?:(?P<keycap>[1-9])️?⃣|(?P<ten>🔟)|(?P<number>\d{1,2})[.)](?!\d))'
+    r'[ \t*]*(?P<rest>\S.*)$',
+    re.MULTILINE
+)
+# Источники в квадратных скобках: "[PubMed, ВОЗ]"
+_SOURCES_RE = re.compile(r'\[([^\[\]]+)\]')
+_TITLE_END_RE = re.compile(r'[\[(]')
+
+
+@dataclass(frozen=True)
+class Theme:
+    """Тема из ответа агента"""
+    number: int
+    title: str
+    sources: tuple = ()
+
+
+def _title_from_match(match) -> str:
+    """Название темы из совпадения _THEME_LINE_RE - до первой скобки (источники и пояснения отбрасываем)"""
+    rest = match.group('rest')
+    title_end = _TITLE_END_RE.search(rest)
+    return (rest[:title_end.start()] if title_end else rest).replace('**', '').strip(' \t\r*-—:')
+
+
+def _theme_from_match(match, title: str) -> Theme:
+    """Theme из совпадения _THEME_LINE_RE с уже выделенным названием"""
+    keycap, ten, number, rest = match.group('keycap', 'ten', 'number', 'rest')
+    number = int(keycap) if keycap else 10 if ten else int(number)
+
+    sources = ()
+    if '[' in rest:
+        parts = (part.strip() for found in _SOURCES_RE.findall(rest) for part in found.replace(';', ',').split(','))
+        sources = tuple(part for part in parts if part)
+
+    return Theme(number, title, sources)
+
+
+def extract_themes(text: str, limit: int = MAX_THEMES) -> list:
+    """Извлекает темы из ответа агента за один проход по строкам
+
+    Если тем больше limit (модель повторила список, например после рассуждений),
+    берутся последние limit уникальных - итоговый список обычно в конце ответа.
+    Дубликаты определяются по названию без учёта регистра.
+
+    Args:
+        text: ответ агента со списком тем
+        limit: максимум тем
+
+    Returns:
+        list: список Theme в порядке появления
+    """
+    # Сначала только названия; Theme с источниками строится для выбранных строк
+    found = []
+    for match in _THEME_LINE_RE.finditer(text or ''):
+        title = _title_from_match(match)
+        if title:
+            found.append((match, title))
+
+    ordered = reversed(found) if len(found) > limit else found
+    seen = set()
+    themes = []
+    for match, title in ordered:
+        key = title.casefold()
+        if key in seen:
+            continue
+        seen.add(key)
+        themes.append(_theme_from_match(match, title))
+        if len(themes) == limit:
+            break
+
+    if len(found) > limit:
+        themes.reverse()
+    return themes
+
+
+def find_theme(themes: list, number: int):
+    """Тема по порядковому номеру в списке (1..len), None если номера нет"""
+    if 1 <= number <= len(themes):
+        return themes[number - 1]
+    return None
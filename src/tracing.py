@@ -0,0 +1,223 @@
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Текущий span (наследуется asyncio-задачами и asyncio.to_thread)
+_current_span = contextvars.ContextVar('natrium_current_span', default=None)
+
+SERVICE_NAME = "natrium-smm-bot"
+DEFAULT_EXPORT_PATH = Path(__file__).parent.parent / "output" / "traces.jsonl"
+
+# Лимит трасс в буфере (защита от утечки, если корневой span не завершился)
+MAX_BUFFERED_TRACES = 1000
+
+
+class Span:
+    """Один участок трассы (совместим по полям с OpenTelemetry)"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = 'OK'
+        self.error = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error) -> None:
+        self.status = 'ERROR'
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+
+    def to_otlp(self) -> dict:
+        """Span в формате OTLP/JSON"""
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns or time.time_ns()),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.status == 'ERROR' else {'code': 1}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+class FileSpanExporter:
+    """Экспорт трасс в локальный файл: одна строка = ExportTraceServiceRequest в OTLP/JSON
+
+    Формат совпадает с file exporter OpenTelemetry Collector, файл можно
+    загрузить в Jaeger/Tempo через otelcol (receiver otlpjsonfile).
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, spans: list) -> None:
+        request = {
+            'resourceSpans': [{
+                'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+                'scopeSpans': [{
+                    'scope': {'name': SERVICE_NAME},
+                    'spans': [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        line = json.dumps(request, ensure_ascii=False)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+class Tracer:
+    """Сборщик трасс с tail-sampling
+
+    Завершённые span'ы копятся в буфере до окончания корневого span'а.
+    Затем трасса целиком экспортируется, только если она медленная
+    (корень дольше slow_ms) или в ней есть ошибка, иначе отбрасывается.
+    """
+
+    def __init__(self, exporter: FileSpanExporter = None, slow_ms: float = 30000.0):
+        self.exporter = exporter
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._traces = {}  # {trace_id: [Span]}
+        self.stats = {'traces': 0, 'exported': 0, 'dropped': 0}
+
+    def start_span(self, name: str, attributes: dict = None) -> Span:
+        parent = _current_span.get()
+        if parent is None:
+            return Span(name, secrets.token_hex(16), attributes=attributes)
+        return Span(name, parent.trace_id, parent_id=parent.span_id, attributes=attributes)
+
+    def end_span(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        with self._lock:
+            spans = self._traces.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_id is not None:
+                if len(self._traces) > MAX_BUFFERED_TRACES:
+                    self._traces.pop(next(iter(self._traces)))
+                return
+            spans = self._traces.pop(span.trace_id)
+            self.stats['traces'] += 1
+
+        keep = span.duration_ms >= self.slow_ms or any(s.status == 'ERROR' for s in spans)
+        if not keep or self.exporter is None:
+            with self._lock:
+                self.stats['dropped'] += 1
+            return
+
+        try:
+            self.exporter.export(spans)
+            with self._lock:
+                self.stats['exported'] += 1
+            logger.info(f"🧵 Трасса {span.trace_id} сохранена: {span.name} {span.duration_ms:.0f} мс, span'ов: {len(spans)}")
+        except Exception as e:
+            logger.warning(f"Не удалось экспортировать трассу {span.trace_id}: {e}")
+
+
+_TRACER = None
+
+
+def get_tracer() -> Tracer:
+    """Общий трассировщик процесса (TRACE_EXPORT_PATH, TRACE_SLOW_MS)"""
+    global _TRACER
+    if _TRACER is None:
+        export_path = os.getenv("TRACE_EXPORT_PATH", str(DEFAULT_EXPORT_PATH))
+        exporter = FileSpanExporter(export_path) if export_path else None
+        _TRACER = Tracer(exporter, slow_ms=float(os.getenv("TRACE_SLOW_MS", "30000")))
+    return _TRACER
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Открывает span как дочерний к текущему (или новую трассу)
+
+    Пример:
+        with span("yandex.call_api", template="post:cov+cok") as s:
+            s.set_attribute("input_tokens", 123)
+    """
+    tracer = get_tracer()
+    current = tracer.start_span(name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.end_span(current)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def mark_error(error) -> None:
+    """Помечает текущий span ошибкой (когда исключение обработано и не пробрасывается)"""
+    current = _current_span.get()
+    if current is not None:
+        current.set_error(error)
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет trace_id текущей трассы в записи логов (%(trace_id)s)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_span.get()
+        record.trace_id = current.trace_id if current is not None else '-'
+        return True
+
+
+def install_log_filter() -> None:
+    """Подключает TraceIdFilter ко всем обработчикам корневого логгера"""
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+
+
+async def traced(awaitable, name: str = "telegram.reply_text", **attributes):
+    """Ожидает корутину внутри span'а (отправка сообщений в Telegram и т.п.)
+
+    Пример:
+        await traced(query.message.reply_text(post, parse_mode='HTML'), length=len(post))
+    """
+    with span(name, **attributes):
+        return await awaitable
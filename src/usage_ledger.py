@@ -0,0 +1,222 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Тарифы Yandex Cloud GPT (руб. за 1000 токенов, примерные)
+# Обновите актуальные цены на https://yandex.cloud/ru/docs/yandexgpt/pricing
+PRICING = {
+    'input': 0.0012,      # за 1000 токенов
+    'output': 0.0012,     # за 1000 токенов
+    'cached': 0.0006      # за 1000 токенов (примерно в 2 раза дешевле)
+}
+
+DEFAULT_DB_PATH = Path(__file__).parent.parent / "output" / "usage.sqlite3"
+
+# Счётчики, которые хранятся в каждой агрегатной строке
+COUNTERS = ('requests', 'input_tokens', 'cached_tokens', 'output_tokens', 'reasoning_tokens', 'total_tokens', 'cost')
+
+
+def _detail(details, field: str) -> int:
+    """Достаёт поле из *_tokens_details (dict или объект)"""
+    if not details:
+        return 0
+    if hasattr(details, field):
+        return getattr(details, field) or 0
+    return details.get(field, 0) or 0
+
+
+def normalize_usage(usage: dict) -> dict:
+    """Приводит usage из _call_api к плоскому виду со стоимостью"""
+    usage = usage or {}
+    input_tokens = usage.get('input_tokens', 0)
+    cached_tokens = _detail(usage.get('input_tokens_details'), 'cached_tokens')
+    output_tokens = usage.get('output_tokens', 0)
+    return {
+        'input_tokens': input_tokens,
+        'cached_tokens': cached_tokens,
+        'output_tokens': output_tokens,
+        'reasoning_tokens': _detail(usage.get('output_tokens_details'), 'reasoning_tokens'),
+        'total_tokens': usage.get('total_tokens', 0),
+        'cost': calc_cost(input_tokens, cached_tokens, output_tokens)
+    }
+
+
+def calc_cost(input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """Стоимость в рублях по PRICING"""
+    return (
+        (input_tokens - cached_tokens) / 1000 * PRICING['input'] +
+        cached_tokens / 1000 * PRICING['cached'] +
+        output_tokens / 1000 * PRICING['output']
+    )
+
+
+def cache_savings(cached_tokens: int) -> float:
+    """Экономия в рублях за счёт кешированных входных токенов"""
+    return cached_tokens / 1000 * (PRICING['input'] - PRICING['cached'])
+
+
+def merge_usage(*usages) -> dict:
+    """Суммирует usage нескольких вызовов API (генерация + исправления) в один usage формата _call_api"""
+    total = {
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'total_tokens': 0,
+        'input_tokens_details': {'cached_tokens': 0},
+        'output_tokens_details': {'reasoning_tokens': 0}
+    }
+    for usage in usages:
+        if not usage:
+            continue
+        for field in ('input_tokens', 'output_tokens', 'total_tokens'):
+            total[field] += usage.get(field, 0) or 0
+        total['input_tokens_details']['cached_tokens'] += _detail(usage.get('input_tokens_details'), 'cached_tokens')
+        total['output_tokens_details']['reasoning_tokens'] += _detail(usage.get('output_tokens_details'), 'reasoning_tokens')
+    return total
+
+
+class UsageLedger:
+    """Журнал использования токенов (SQLite, append-only) с инкрементальными агрегатами
+
+    Каждый вызов API - одна запись в calls. В той же транзакции обновляются
+    агрегаты rollups по ключам (scope, key): пользователь, день, техника,
+    операция, пользователь+день, сессия пользователя и общий итог. Запросы
+    статистики читают одну строку агрегата по первичному ключу, не сканируя calls.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS calls (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                technique TEXT NOT NULL,
+                input_tokens INTEGER NOT NULL,
+                cached_tokens INTEGER NOT NULL,
+                output_tokens INTEGER NOT NULL,
+                reasoning_tokens INTEGER NOT NULL,
+                total_tokens INTEGER NOT NULL,
+                cost REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS rollups (
+                scope TEXT NOT NULL,
+                key TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                cached_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                reasoning_tokens INTEGER NOT NULL DEFAULT 0,
+                total_tokens INTEGER NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, key)
+            ) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    def record(self, user_id, operation: str, technique: str, usage: dict) -> dict:
+        """Записывает один вызов API и обновляет агрегаты
+
+        Returns:
+            dict: нормализованный usage со стоимостью
+        """
+        row = normalize_usage(usage)
+        now = time.time()
+        day = datetime.fromtimestamp(now).strftime('%Y-%m-%d')
+        user_id = str(user_id)
+        technique = technique or ''
+
+        keys = [
+            ('global', '*'),
+            ('user', user_id),
+            ('session', user_id),
+            ('day', day),
+            ('user_day', f"{user_id}:{day}"),
+            ('technique', technique),
+            ('operation', operation),
+        ]
+        values = [1] + [row[field] for field in COUNTERS[1:]]
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO calls (ts, day, user_id, operation, technique, input_tokens, cached_tokens,"
+                " output_tokens, reasoning_tokens, total_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, day, user_id, operation, technique, row['input_tokens'], row['cached_tokens'],
+                 row['output_tokens'], row['reasoning_tokens'], row['total_tokens'], row['cost'])
+            )
+            self._conn.executemany(
+                f"INSERT INTO rollups (scope, key, {', '.join(COUNTERS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                f" ON CONFLICT (scope, key) DO UPDATE SET "
+                + ", ".join(f"{field} = {field} + excluded.{field}" for field in COUNTERS),
+                [(scope, key, *values) for scope, key in keys]
+            )
+        return row
+
+    def get(self, scope: str, key: str) -> dict:
+        """Агрегат по ключу (O(1) чтение по первичному ключу)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(COUNTERS)} FROM rollups WHERE scope = ? AND key = ?", (scope, str(key))
+            )
+            found = cursor.fetchone()
+        return dict(zip(COUNTERS, found)) if found else dict.fromkeys(COUNTERS, 0)
+
+    def scope(self, scope: str) -> dict:
+        """Все агрегаты одного уровня: {key: counters} (читает только rollups)"""
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT key, {', '.join(COUNTERS)} FROM rollups WHERE scope = ?", (scope,)
+            )
+            rows = cursor.fetchall()
+        return {found[0]: dict(zip(COUNTERS, found[1:])) for found in rows}
+
+    def session(self, user_id) -> dict:
+        return self.get('session', user_id)
+
+    def reset_session(self, user_id) -> None:
+        """Сбрасывает счётчики сессии пользователя (журнал и остальные агрегаты не трогаются)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM rollups WHERE scope = 'session' AND key = ?", (str(user_id),))
+
+    def report(self, days: int = 7) -> dict:
+        """Сводка по всем пользователям для администратора
+
+        Returns:
+            dict: total, days {day: counters}, techniques, operations, users
+        """
+        today = datetime.now().date()
+        day_keys = [(today - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+        return {
+            'total': self.get('global', '*'),
+            'days': {day: self.get('day', day) for day in day_keys},
+            'techniques': self.scope('technique'),
+            'operations': self.scope('operation'),
+            'users': self.scope('user')
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_LEDGER = None
+
+
+def get_ledger() -> UsageLedger:
+    """Общий журнал процесса (путь - USAGE_LEDGER_PATH или output/usage.sqlite3)"""
+    global _LEDGER
+    if _LEDGER is None:
+        _LEDGER = UsageLedger(os.getenv("USAGE_LEDGER_PATH", str(DEFAULT_DB_PATH)))
+    return _LEDGER
@@ -1,12 +1,8 @@
 import os
-import requests
 import json
 from pathlib import Path
 from typing import List, Dict, Any
-from dotenv import load_dotenv
-
-# Загрузка переменных окружения
-load_dotenv()
+from src.http_transport import get_http_client
 
 class YandexFileSync:
     def __init__(self):
@@ -35,16 +31,12 @@ class YandexFileSync:
         Returns:
             Ответ API
         """
-        headers = {
-            "Authorization": f"Api-Key {self.api_key}"
-        }
-        
         url = f"{self.base_url}/{endpoint}"
         
-        response = requests.request(
+        # Общий клиент (заголовок авторизации и пул соединений) - без нового соединения на каждый вызов
+        response = get_http_client().request(
             method=method,
             url=url,
-            headers=headers,
             data=data,
             files=files
         )
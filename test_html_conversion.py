@@ -3,33 +3,14 @@
 Тест конвертации Markdown в HTML для Telegram
 """
 
+import html
 import re
+import sys
+from pathlib import Path
 
-def convert_markdown_to_html(text: str) -> str:
-    """
-    Конвертирует Markdown форматирование в HTML для Telegram
-    
-    Поддерживаемые преобразования:
-    - [текст](URL) → <a href="URL">текст</a>
-    - **текст** → <b>текст</b>
-    - *текст* → <i>текст</i>
-    """
-    
-    # 1. Конвертируем ссылки: [текст](URL) → <a href="URL">текст</a>
-    text = re.sub(
-        r'\[([^\]]+)\]\(([^)]+)\)',
-        r'<a href="\2">\1</a>',
-        text
-    )
-    
-    # 2. Конвертируем жирный текст: **текст** → <b>текст</b>
-    text = re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
-    
-    # 3. Конвертируем курсив: *текст* → <i>текст</i>
-    # Но НЕ трогаем одинарные * в начале строки (буллеты)
-    text = re.sub(r'(?<!^)(?<!\n)\*([^*\n]+?)\*', r'<i>\1</i>', text, flags=re.MULTILINE)
-    
-    return text
+sys.path.append(str(Path(__file__).parent))
+
+from src.telegram_html import markdown_to_html as convert_markdown_to_html, split_message, visible_length
 
 
 # Тестовые примеры
@@ -79,6 +60,31 @@ test_cases = [
 • улучшает нейромышечную проводимость (ВОЗ)
 
 #натриумфитнес #разминка"""
+    },
+    {
+        "name": "Экранирование <, >, &",
+        "input": "Пульс < 120 & нагрузка > 80%",
+        "expected": "Пульс &lt; 120 &amp; нагрузка &gt; 80%"
+    },
+    {
+        "name": "Незакрытый жирный остаётся текстом",
+        "input": "**НАУКА\n• факт **1**",
+        "expected": "**НАУКА\n• факт <b>1</b>"
+    },
+    {
+        "name": "Перекрёстная разметка без разбалансировки тегов",
+        "input": "**жирный *курсив** хвост*",
+        "expected": "<b>жирный *курсив</b> хвост*"
+    },
+    {
+        "name": "Буллет * в начале строки",
+        "input": "* пункт 1\n* пункт *2*",
+        "expected": "* пункт 1\n* пункт <i>2</i>"
+    },
+    {
+        "name": "Ссылка с & в URL",
+        "input": "[PubMed](https://pubmed.ncbi.nlm.nih.gov/?term=a&b=c)",
+        "expected": '<a href="https://pubmed.ncbi.nlm.nih.gov/?term=a&amp;b=c">PubMed</a>'
     }
 ]
 
@@ -100,6 +106,38 @@ for i, test in enumerate(test_cases, 1):
         failed += 1
     print()
 
+# Разбиение длинного поста на сообщения
+long_post = convert_markdown_to_html("💪 **ЗАГОЛОВОК**\n\n" + "\n\n".join(
+    f"**Абзац {i}:** " + "слово " * 120 for i in range(12)
+))
+parts = split_message(long_post)
+limits_ok = all(visible_length(part) <= 4096 for part in parts)
+balanced = all(part.count("<b>") == part.count("</b>") for part in parts)
+if len(parts) > 1 and limits_ok and balanced:
+    print(f"✅ Тест {len(test_cases) + 1}: Разбиение длинного поста ({len(parts)} сообщения)")
+    passed += 1
+else:
+    print(f"❌ Тест {len(test_cases) + 1}: Разбиение длинного поста")
+    print(f"   Частей: {len(parts)}, лимит соблюдён: {limits_ok}, теги сбалансированы: {balanced}")
+    failed += 1
+print()
+
+# Эмодзи (2 единицы UTF-16) на границе лимита, когда осталась 1 единица
+number = len(test_cases) + 2
+for source in ('<b>' + 'a' * 4095 + '</b>😀😀', 'a' * 4095 + '<i>😀😀</i>'):
+    parts = split_message(source)
+    sizes = [visible_length(html.unescape(re.sub(r'<[^>]+>', '', part))) for part in parts]
+    text = ''.join(html.unescape(re.sub(r'<[^>]+>', '', part)) for part in parts)
+    if all(size <= 4096 for size in sizes) and text == html.unescape(re.sub(r'<[^>]+>', '', source)):
+        print(f"✅ Тест {number}: Эмодзи на границе лимита ({sizes})")
+        passed += 1
+    else:
+        print(f"❌ Тест {number}: Эмодзи на границе лимита")
+        print(f"   Видимая длина частей: {sizes}")
+        failed += 1
+    number += 1
+print()
+
 print(f"\n📊 Результаты: {passed} пройдено, {failed} провалено")
 
 if failed == 0: